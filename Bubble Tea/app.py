@@ -3,16 +3,41 @@
 Flask + PostgreSQL
 """
 
-from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response
+from flask import Flask, render_template, request, redirect, url_for, flash, jsonify, send_from_directory, Response, session, make_response, g, has_request_context, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import joinedload, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
 from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
-from werkzeug.security import generate_password_hash, check_password_hash
-from werkzeug.utils import secure_filename
-from datetime import datetime
+from werkzeug.security import generate_password_hash, check_password_hash, safe_join
+from datetime import datetime, timedelta
 from functools import wraps
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait
 import os
+import re
+import base64
+import gzip
+import hashlib
+import json
+import csv
+import io
+import uuid
+import queue
+import select
+import sqlite3
+import threading
+import time
 from decimal import Decimal
 from dotenv import load_dotenv
+import click
+import mimetypes
+
+import static_assets
 
 # Загружаем переменные из .env ДО обращения к os.getenv()
 load_dotenv()
@@ -37,6 +62,23 @@ except ImportError as e:
     print(f"⚠️ Warning: Telegram notifier not available: {e}")
     TELEGRAM_AVAILABLE = False
 
+# Try to import NumPy (vectorized recipe math, optional)
+try:
+    import numpy as np
+    NUMPY_AVAILABLE = True
+    print("✅ NumPy loaded successfully")
+except ImportError as e:
+    print(f"⚠️ Warning: NumPy not available, using pure Python fallback: {e}")
+    NUMPY_AVAILABLE = False
+
+# Try to import PyArrow (Parquet export, optional)
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
 app = Flask(__name__)
 
 # Register Backup Manager Blueprint
@@ -72,6 +114,34 @@ app.config['SESSION_COOKIE_SECURE'] = (               # HTTPS-only в production
 )
 app.config['PERMANENT_SESSION_LIFETIME'] = 3600        # Сессия 1 час
 
+# ── Кэш рецептур ─────────────────────────────────────────────────────────────
+app.config['RECIPE_STOCK_TTL'] = float(os.getenv('RECIPE_STOCK_TTL', '5'))      # Секунд до перечитывания остатков
+app.config['RECIPE_GRAPH_TTL'] = float(os.getenv('RECIPE_GRAPH_TTL', '60'))     # Секунд до перестройки рецептур (изменения в других воркерах)
+app.config['LOW_STOCK_BADGE_THRESHOLD'] = int(os.getenv('LOW_STOCK_BADGE_THRESHOLD', '5'))  # «Осталось N»
+app.config['IDEMPOTENCY_KEY_TTL'] = int(os.getenv('IDEMPOTENCY_KEY_TTL', '3600'))  # Секунд хранения Idempotency-Key
+app.config['ORDER_BATCH_LIMIT'] = int(os.getenv('ORDER_BATCH_LIMIT', '500'))  # Максимум заказов в /api/orders/batch
+app.config['EVENT_STREAM_KEEPALIVE'] = float(os.getenv('EVENT_STREAM_KEEPALIVE', '15'))  # Секунд между keepalive в SSE
+app.config['EVENT_STREAM_TIMEOUT'] = float(os.getenv('EVENT_STREAM_TIMEOUT', '300'))     # Секунд до переподключения SSE-клиента
+app.config['CUSTOMER_CACHE_SIZE'] = int(os.getenv('CUSTOMER_CACHE_SIZE', '2048'))  # Телефонов в LRU клиентов
+app.config['CUSTOMER_CACHE_TTL'] = float(os.getenv('CUSTOMER_CACHE_TTL', '300'))  # Секунд жизни клиента в LRU (правки в других воркерах)
+app.config['QUERY_BUDGET'] = int(os.getenv('QUERY_BUDGET', '0'))  # SQL-запросов на запрос по умолчанию (0 = без лимита)
+app.config['HTTP_CACHE_MAX_AGE'] = int(os.getenv('HTTP_CACHE_MAX_AGE', '10'))  # max-age каталога для reverse proxy
+app.config['IMAGE_GC_GRACE'] = int(os.getenv('IMAGE_GC_GRACE', '3600'))  # Секунд, в течение которых новый файл не удаляется GC
+app.config['PAGE_CACHE_SIZE'] = int(os.getenv('PAGE_CACHE_SIZE', '512'))  # Отрендеренных страниц каталога в памяти
+app.config['PAGE_CACHE_TTL'] = float(os.getenv('PAGE_CACHE_TTL', '30'))   # Секунд жизни страницы (остатки, другие воркеры)
+app.config['SUGGEST_LIMIT'] = int(os.getenv('SUGGEST_LIMIT', '8'))  # Подсказок на группу в /api/suggest
+app.config['SUGGEST_CACHE_SIZE'] = int(os.getenv('SUGGEST_CACHE_SIZE', '1024'))  # Префиксов в кэше подсказок
+app.config['SUGGEST_CACHE_TTL'] = float(os.getenv('SUGGEST_CACHE_TTL', '30'))    # Секунд жизни подсказки
+app.config['SEARCH_DEADLINE'] = float(os.getenv('SEARCH_DEADLINE', '2'))  # Секунд на /api/search (все сущности вместе)
+app.config['SEARCH_WORKERS'] = int(os.getenv('SEARCH_WORKERS', '8'))        # Потоков для параллельного поиска
+app.config['ANALYTICS_MAX_DAYS'] = int(os.getenv('ANALYTICS_MAX_DAYS', '366'))          # Максимальный диапазон /api/analytics/sales
+app.config['ANALYTICS_CACHE_TTL'] = float(os.getenv('ANALYTICS_CACHE_TTL', '10'))  # Секунд жизни ответа за закрытый период (в других процессах — задержка сброса)
+app.config['SALES_ROLLUP_SHARDS'] = int(os.getenv('SALES_ROLLUP_SHARDS', '8'))  # Строк итогов на день/продукт (order_id % N)
+app.config['EXPORT_CHUNK_SIZE'] = int(os.getenv('EXPORT_CHUNK_SIZE', '5000'))  # Строк на чанк выгрузки (server-side cursor)
+app.config['COUNTER_CACHE_TTL'] = float(os.getenv('COUNTER_CACHE_TTL', '10'))  # Секунд жизни счётчиков дашборда
+app.config['STATIC_FINGERPRINT'] = os.getenv('STATIC_FINGERPRINT', 'true').lower() == 'true'  # Хэшированные и сжатые CSS/JS
+app.config['SCHEDULER_RESYNC_INTERVAL'] = float(os.getenv('SCHEDULER_RESYNC_INTERVAL', '30'))  # Секунд до сверки очередей с БД
+
 db = SQLAlchemy(app)
 login_manager = LoginManager(app)
 login_manager.login_view = 'login'
@@ -204,9 +274,19 @@ class Product(db.Model):
     is_available = db.Column(db.Boolean, default=True)
     preparation_time = db.Column(db.Integer)
     image_url = db.Column(db.String(255))
+    image_variants = db.Column(db.Text)  # JSON {format: [[width, url], ...]} от image_processor
     created_at = db.Column(db.DateTime, default=datetime.now)
     order_items = db.relationship('OrderItem', backref='product', lazy=True)
 
+    @property
+    def image_srcsets(self):
+        """[(format, srcset)] для <picture>; пусто, пока варианты не сгенерированы"""
+        if not self.image_variants:
+            return []
+        variants = json.loads(self.image_variants)
+        return [(fmt, ', '.join(f"{url} {width}w" for width, url in variants[fmt]))
+                for fmt in ('avif', 'webp') if variants.get(fmt)]
+
 class Ingredient(db.Model):
     __tablename__ = 'ingredients'
     ingredient_id = db.Column(db.Integer, primary_key=True)
@@ -226,14 +306,40 @@ class Ingredient(db.Model):
         return self.stock_quantity >= quantity
     
     def use(self, quantity):
-        """Deduct quantity from stock"""
-        if not self.can_use(quantity):
+        """
+        Deduct quantity from stock atomically on the SQL side.
+
+        Runs UPDATE ... SET stock_quantity = stock_quantity - :q
+        WHERE stock_quantity >= :q RETURNING, so concurrent workers
+        cannot oversell or overwrite each other. The row stays locked
+        until the surrounding transaction ends.
+        """
+        quantity = Decimal(str(quantity))
+        row = db.session.execute(
+            db.update(Ingredient)
+            .where(Ingredient.ingredient_id == self.ingredient_id,
+                   Ingredient.stock_quantity >= quantity)
+            .values(stock_quantity=Ingredient.stock_quantity - quantity)
+            .returning(Ingredient.stock_quantity)
+            .execution_options(synchronize_session=False)
+        ).first()
+        if row is None:
             raise ValueError(f"Not enough {self.ingredient_name} in stock")
-        self.stock_quantity -= Decimal(str(quantity))
+        set_committed_value(self, 'stock_quantity', row.stock_quantity)
+        recipe_graph.update_stock(self.ingredient_id, row.stock_quantity)
     
     def restock(self, quantity):
-        """Add quantity to stock"""
-        self.stock_quantity += Decimal(str(quantity))
+        """Add quantity to stock atomically on the SQL side"""
+        quantity = Decimal(str(quantity))
+        row = db.session.execute(
+            db.update(Ingredient)
+            .where(Ingredient.ingredient_id == self.ingredient_id)
+            .values(stock_quantity=Ingredient.stock_quantity + quantity)
+            .returning(Ingredient.stock_quantity)
+            .execution_options(synchronize_session=False)
+        ).first()
+        set_committed_value(self, 'stock_quantity', row.stock_quantity)
+        recipe_graph.update_stock(self.ingredient_id, row.stock_quantity)
 
 class ProductIngredient(db.Model):
     __tablename__ = 'product_ingredients'
@@ -254,7 +360,8 @@ class Order(db.Model):
     employee_id = db.Column(db.Integer, db.ForeignKey('employees.employee_id'), nullable=False)
     order_date = db.Column(db.DateTime, nullable=False, default=datetime.now)
     total_amount = db.Column(db.Numeric(10, 2), nullable=False, default=0)
-    status = db.Column(db.String(20), nullable=False, default='pending')
+    # active_history: прежний статус нужен итогам продаж даже у выгруженного объекта
+    status = db.column_property(db.Column(db.String(20), nullable=False, default='pending'), active_history=True)
     payment_method = db.Column(db.String(20), nullable=False)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.now)
@@ -283,63 +390,176 @@ class Notification(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.now)
     created_by = db.Column(db.String(50), default='system')
 
+class OutboxEvent(db.Model):
+    __tablename__ = 'outbox_events'
+    event_id = db.Column(db.Integer, primary_key=True)
+    event_type = db.Column(db.String(30), nullable=False)  # telegram, image
+    payload = db.Column(db.Text, nullable=False)           # JSON
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.now)
+    processed_at = db.Column(db.DateTime)
+    locked_until = db.Column(db.DateTime)  # аренда диспетчером: событие обрабатывается вне транзакции
+
+    __table_args__ = (
+        db.Index('idx_outbox_pending', 'event_id',
+                 postgresql_where=db.text("status = 'pending'"),
+                 sqlite_where=db.text("status = 'pending'")),
+    )
+
+ANONYMOUS_IDEMPOTENCY_SCOPE = 0  # user_id ключей, отправленных без входа
+
+class IdempotencyKey(db.Model):
+    __tablename__ = 'idempotency_keys'
+    # Ключи уникальны в пределах пользователя (0 — анонимное оформление):
+    # чужой ключ не возвращает чужой заказ
+    user_id = db.Column(db.Integer, primary_key=True, default=ANONYMOUS_IDEMPOTENCY_SCOPE)
+    idempotency_key = db.Column(db.String(255), primary_key=True)
+    order_id = db.Column(db.Integer, db.ForeignKey('orders.order_id', ondelete='CASCADE'), nullable=False)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.now, index=True)
+
+class DailySales(db.Model):
+    """Итоги завершённых заказов за день (поддерживаются инкрементально, читаются через SUM по shard)"""
+    __tablename__ = 'daily_sales'
+    sale_date = db.Column(db.Date, primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, default=0)  # order_id % SALES_ROLLUP_SHARDS
+    total_orders = db.Column(db.Integer, nullable=False, default=0)
+    total_revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
+class ProductDailySales(db.Model):
+    """Продажи продукта за день по завершённым заказам"""
+    __tablename__ = 'product_daily_sales'
+    sale_date = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('products.product_id', ondelete='CASCADE'), primary_key=True)
+    shard = db.Column(db.SmallInteger, primary_key=True, default=0)
+    times_ordered = db.Column(db.Integer, nullable=False, default=0)
+    quantity_sold = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Numeric(12, 2), nullable=False, default=0)
+
 # ========================================
 # HELPER FUNCTIONS FOR INGREDIENTS
 # ========================================
 
+def parse_cart(product_ids, quantities):
+    """Собрать корзину {product_id: quantity} из списков формы, суммируя повторы"""
+    cart = {}
+    for raw_id, raw_qty in zip(product_ids, quantities):
+        quantity = int(raw_qty)
+        if quantity > 0:
+            product_id = int(raw_id)
+            cart[product_id] = cart.get(product_id, 0) + quantity
+    return cart
+
+def load_recipes(product_ids):
+    """
+    Load recipes with ingredient stock for many products in one query.
+
+    Returns {product_id: [(ingredient, per_unit)]}.
+    """
+    if not product_ids:
+        return {}
+
+    rows = db.session.query(ProductIngredient.product_id, ProductIngredient.quantity, Ingredient).join(
+        Ingredient, ProductIngredient.ingredient_id == Ingredient.ingredient_id
+    ).filter(ProductIngredient.product_id.in_(list(product_ids))).all()
+
+    recipes = {}
+    for product_id, per_unit, ingredient in rows:
+        recipes.setdefault(product_id, []).append((ingredient, Decimal(str(per_unit))))
+    return recipes
+
+def cart_requirements(cart, recipes):
+    """
+    Aggregate a cart over preloaded recipes.
+
+    Returns {ingredient_id: {'ingredient', 'required', 'product_ids'}} where
+    'required' is summed across all cart lines sharing that ingredient.
+    """
+    requirements = {}
+    for product_id, quantity in cart.items():
+        for ingredient, per_unit in recipes.get(product_id, ()):
+            entry = requirements.setdefault(ingredient.ingredient_id, {
+                'ingredient': ingredient,
+                'required': Decimal('0'),
+                'product_ids': []
+            })
+            entry['required'] += per_unit * Decimal(str(quantity))
+            entry['product_ids'].append(product_id)
+    return requirements
+
+def load_cart_requirements(cart):
+    """Load recipes and ingredient stock for the whole cart in one query"""
+    return cart_requirements(cart, load_recipes(cart))
+
+def shortage_reason(name, required, unit, have):
+    """Текст причины нехватки ингредиента"""
+    return f"Not enough {name} (need {required} {unit}, have {have})"
+
+def find_cart_shortages(requirements):
+    """Вернуть список нехваток [(ingredient_id, reason, product_ids)] для агрегированных требований корзины"""
+    shortages = []
+    for ingredient_id, entry in requirements.items():
+        ingredient = entry['ingredient']
+        if ingredient.stock_quantity < entry['required']:
+            shortages.append((ingredient_id,
+                              shortage_reason(ingredient.ingredient_name, entry['required'], ingredient.unit, ingredient.stock_quantity),
+                              entry['product_ids']))
+    return shortages
+
 def check_product_availability(product_id, quantity=1):
     """Check if product can be made with current ingredient stock"""
-    product_ingredients = ProductIngredient.query.filter_by(product_id=product_id).all()
-    
-    if not product_ingredients:
-        # Product has no ingredients defined, assume available
-        return True, None
-    
-    for pi in product_ingredients:
-        required = Decimal(str(pi.quantity)) * Decimal(str(quantity))
-        if pi.ingredient.stock_quantity < required:
-            return False, f"Not enough {pi.ingredient.ingredient_name} (need {required} {pi.ingredient.unit}, have {pi.ingredient.stock_quantity})"
-    
+    shortages = find_cart_shortages(load_cart_requirements({int(product_id): quantity}))
+    if shortages:
+        return False, shortages[0][1]
+    # Product has no ingredients defined or enough stock
     return True, None
 
 def deduct_ingredients(product_id, quantity=1):
     """Deduct ingredients for product from stock"""
-    product_ingredients = ProductIngredient.query.filter_by(product_id=product_id).all()
-    
+    return deduct_cart_ingredients(load_cart_requirements({int(product_id): quantity}))
+
+def deduct_cart_ingredients(requirements):
+    """
+    Deduct aggregated cart requirements from stock in one pass.
+
+    Ingredients are decremented in ascending ingredient_id order so that
+    concurrent checkouts always take row locks in the same order and
+    cannot deadlock each other. Low-stock alerts are added to the current
+    transaction; the caller commits.
+    """
     deducted = []
     low_stock_ingredients = []
-    
+
     try:
-        for pi in product_ingredients:
-            required = Decimal(str(pi.quantity)) * Decimal(str(quantity))
-            pi.ingredient.use(required)
+        for _, entry in sorted(requirements.items()):
+            ingredient = entry['ingredient']
+            required = entry['required']
+            ingredient.use(required)
             deducted.append({
-                'ingredient': pi.ingredient.ingredient_name,
+                'ingredient': ingredient.ingredient_name,
                 'amount': float(required),
-                'unit': pi.ingredient.unit
+                'unit': ingredient.unit
             })
-            
+
             # Check if ingredient is now below minimum
-            if pi.ingredient.needs_restock:
+            if ingredient.needs_restock:
                 low_stock_ingredients.append({
-                    'name': pi.ingredient.ingredient_name,
-                    'current': float(pi.ingredient.stock_quantity),
-                    'minimum': float(pi.ingredient.min_quantity),
-                    'unit': pi.ingredient.unit
+                    'name': ingredient.ingredient_name,
+                    'current': float(ingredient.stock_quantity),
+                    'minimum': float(ingredient.min_quantity),
+                    'unit': ingredient.unit
                 })
-        
-        # Send Telegram notification if any ingredient is low
-        if low_stock_ingredients and TELEGRAM_AVAILABLE:
-            try:
-                notifier = get_notifier()
-                
-                items_text = []
-                for ing in low_stock_ingredients:
-                    items_text.append(
-                        f"• <b>{ing['name']}</b>: {ing['current']}/{ing['minimum']} {ing['unit']}"
-                    )
-                
-                message = f"""
+
+        # Queue Telegram notification if any ingredient is low
+        if low_stock_ingredients:
+            items_text = []
+            for ing in low_stock_ingredients:
+                items_text.append(
+                    f"• <b>{ing['name']}</b>: {ing['current']}/{ing['minimum']} {ing['unit']}"
+                )
+
+            enqueue_telegram(f"""
 ⚠️ <b>НИЗКИЙ ОСТАТОК ИНГРЕДИЕНТОВ!</b>
 
 Необходимо пополнение:
@@ -348,19 +568,16 @@ def deduct_ingredients(product_id, quantity=1):
 📦 Перейдите в раздел Inventory для пополнения запасов
 
 ⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
-                notifier.send_message(message)
-                print(f"📱 Telegram: низкий остаток ингредиентов")
-            except Exception as e:
-                print(f"⚠️ Telegram notification failed: {e}")
-        
-        # Уведомление на сайте о низком остатке
+""")
+
+        # Уведомление на сайте о низком остатке (в той же транзакции)
         if low_stock_ingredients:
             names = ', '.join(ing['name'] for ing in low_stock_ingredients)
             create_notification(
                 title='⚠️ Низкий остаток ингредиентов',
                 message=f'Необходимо пополнение: {names}',
-                category='inventory', level='warning'
+                category='inventory', level='warning',
+                commit=False
             )
         
         return True, deducted
@@ -369,24 +586,662 @@ def deduct_ingredients(product_id, quantity=1):
         db.session.rollback()
         return False, str(e)
 
-def update_product_availability():
-    """Update product availability based on ingredient stock"""
-    products = Product.query.all()
-    updated = 0
-    
-    for product in products:
-        available, reason = check_product_availability(product.product_id, 1)
-        if product.is_available != available:
-            product.is_available = available
-            updated += 1
-    
+def update_product_availability(ingredient_ids=None, commit=True):
+    """
+    Update product availability based on ingredient stock.
+
+    With ingredient_ids only the products whose recipes use those
+    ingredients are recomputed (reverse ingredient -> products lookup);
+    without it the whole catalog is rechecked. Either way availability is
+    computed in a single grouped query. commit=False leaves the changes in
+    the caller's transaction.
+    """
+    if ingredient_ids is not None:
+        ingredient_ids = list(ingredient_ids)
+        if not ingredient_ids:
+            return 0
+
+    shortages = db.func.sum(db.case(
+        (Ingredient.stock_quantity < ProductIngredient.quantity, 1), else_=0
+    ))
+    query = db.session.query(Product.product_id, Product.is_available, shortages).outerjoin(
+        ProductIngredient, ProductIngredient.product_id == Product.product_id
+    ).outerjoin(
+        Ingredient, ProductIngredient.ingredient_id == Ingredient.ingredient_id
+    ).group_by(Product.product_id, Product.is_available)
+
+    if ingredient_ids is not None:
+        affected = db.session.query(ProductIngredient.product_id).filter(
+            ProductIngredient.ingredient_id.in_(ingredient_ids)
+        )
+        query = query.filter(Product.product_id.in_(affected))
+
+    became_available, became_unavailable = [], []
+    for product_id, is_available, short in query.all():
+        available = not short
+        if is_available != available:
+            (became_available if available else became_unavailable).append(product_id)
+
+    for product_ids, value in ((became_available, True), (became_unavailable, False)):
+        if product_ids:
+            Product.query.filter(Product.product_id.in_(product_ids)).update({'is_available': value})
+
+    updated = len(became_available) + len(became_unavailable)
     if updated > 0:
-        db.session.commit()
+        db.session().info['catalog_dirty'] = True
+        if commit:
+            db.session.commit()
     
     return updated
 
-def create_notification(title, message, category='system', level='info', related_id=None, created_by='system'):
-    """Сохранить уведомление в базу данных для отображения на сайте"""
+# ========================================
+# LRU CACHE
+# ========================================
+
+class LRUCache:
+    """Потокобезопасный LRU-кэш на OrderedDict с необязательным TTL (секунды)"""
+
+    def __init__(self, maxsize=1024, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._data = OrderedDict()  # key -> (value, stored_at)
+
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._data.get(key)
+            if item is None:
+                return default
+            value, stored_at = item
+            if self.ttl is not None and time.monotonic() - stored_at > self.ttl:
+                del self._data[key]
+                return default
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = (value, time.monotonic())
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._data.pop(key, None)
+            return default if item is None else item[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+def dialect_insert(model):
+    """INSERT с поддержкой ON CONFLICT для текущей СУБД (PostgreSQL или SQLite)"""
+    if db.engine.dialect.name == 'postgresql':
+        return postgresql.insert(model)
+    return sqlite.insert(model)
+
+# ========================================
+# TABLE COUNTERS (dashboard, analytics, metrics)
+# ========================================
+
+COUNTED_TABLES = {'products': Product, 'users': User, 'orders': Order, 'customers': Customer}
+
+# Один ключ 'counts'; TTL ограничивает устаревание от Core-вставок и других воркеров
+counter_cache = LRUCache(maxsize=1, ttl=app.config['COUNTER_CACHE_TTL'])
+
+def table_counts():
+    """
+    Количество строк в products, users, orders, customers.
+
+    Все счётчики читаются одним SELECT (count(*) подзапросами) и
+    кэшируются на COUNTER_CACHE_TTL секунд: дашборд и /metrics
+    обновляются постоянно, а полный подсчёт orders дорогой.
+    """
+    counts = counter_cache.get('counts')
+    if counts is None:
+        row = db.session.query(*(
+            db.select(db.func.count()).select_from(model).scalar_subquery().label(name)
+            for name, model in COUNTED_TABLES.items()
+        )).one()
+        counts = row._asdict()
+        counter_cache.set('counts', counts)
+    return counts
+
+@event.listens_for(db.session, 'before_flush')
+def _track_counted_rows(session, flush_context, instances):
+    """Добавление или удаление строк через ORM сбрасывает счётчики после COMMIT"""
+    counted = tuple(COUNTED_TABLES.values())
+    if any(isinstance(obj, counted) for obj in (*session.new, *session.deleted)):
+        session.info['counts_dirty'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_counts(session):
+    if session.info.pop('counts_dirty', False):
+        counter_cache.clear()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_counts_dirty(session, previous_transaction):
+    session.info.pop('counts_dirty', None)
+
+# ========================================
+# CUSTOMER LOOKUP
+# ========================================
+
+# TTL ограничивает устаревание от правок клиентов в других воркерах и в SQL
+customer_cache = LRUCache(maxsize=app.config['CUSTOMER_CACHE_SIZE'], ttl=app.config['CUSTOMER_CACHE_TTL'])
+
+def find_or_create_customer(phone, full_name=None):
+    """
+    Вернуть (customer_id, full_name) клиента по телефону или None.
+
+    Повторные клиенты берутся из LRU без запроса к БД. Если передано имя,
+    клиент находится или создаётся одним INSERT ... ON CONFLICT (phone)
+    DO UPDATE ... RETURNING, поэтому параллельные заказы на новый номер не
+    падают на уникальном индексе. Для существующей строки UPDATE ставит
+    created_at самому себе: имя не перезаписывается, а триггер search_vector
+    (UPDATE OF first_name, last_name, phone, email) не срабатывает. В LRU
+    запись попадает только после COMMIT, чтобы откат не оставил в кэше
+    несуществующий customer_id.
+    """
+    cached = customer_cache.get(phone)
+    if cached is not None:
+        return cached
+
+    columns = (Customer.customer_id, Customer.first_name, Customer.last_name)
+    if full_name and full_name.strip():
+        first_name, _, last_name = full_name.strip().partition(' ')
+        created_at = datetime.now()
+        stmt = dialect_insert(Customer).values(first_name=first_name, last_name=last_name, phone=phone,
+                                               created_at=created_at)
+        row = db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['phone'], set_={'created_at': Customer.created_at}
+        ).returning(*columns, Customer.created_at)).first()
+        if row.created_at == created_at:
+            db.session().info['customers_created'] = True  # новый клиент: сбросить подсказки
+    else:
+        row = db.session.query(*columns).filter(Customer.phone == phone).first()
+        if row is None:
+            return None
+
+    customer = (row.customer_id, f"{row.first_name} {row.last_name}")
+    db.session().info.setdefault('seen_customers', {})[phone] = customer
+    return customer
+
+@event.listens_for(db.session, 'before_flush')
+def _track_customer_changes(session, flush_context, instances):
+    """Изменение или удаление клиента через ORM сбрасывает LRU, новый — подсказки"""
+    if any(isinstance(obj, Customer) for obj in (*session.dirty, *session.deleted)):
+        session.info['customers_dirty'] = True
+    elif any(isinstance(obj, Customer) for obj in session.new):
+        session.info['customers_created'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _cache_seen_customers(session):
+    """Запомнить подтверждённых коммитом клиентов"""
+    if session.info.pop('customers_dirty', False):
+        customer_cache.clear()
+        customer_suggest_cache.clear()
+    if session.info.pop('customers_created', False):
+        customer_suggest_cache.clear()
+    for phone, customer in session.info.pop('seen_customers', {}).items():
+        customer_cache.set(phone, customer)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_seen_customers(session, previous_transaction):
+    session.info.pop('customers_dirty', None)
+    session.info.pop('customers_created', None)
+    session.info.pop('seen_customers', None)
+
+# ========================================
+# SALES ROLLUP (daily_sales, product_daily_sales)
+# ========================================
+
+def apply_sales_rollup(session, order, sign):
+    """
+    Добавить (sign=1) или вычесть (sign=-1) заказ из дневных итогов.
+
+    Обновляется одна строка daily_sales и по строке product_daily_sales на
+    продукт заказа — upsert с приращением, без пересчёта истории. Строки
+    разбиты на SALES_ROLLUP_SHARDS частей по order_id, чтобы одновременные
+    завершения заказов не ждали друг друга на одной строке дня; строки
+    продуктов блокируются по возрастанию product_id (без взаимоблокировок).
+    """
+    sale_date = order.order_date.date()
+    shard = order.order_id % app.config['SALES_ROLLUP_SHARDS']
+    stmt = dialect_insert(DailySales).values(
+        sale_date=sale_date, shard=shard, total_orders=sign, total_revenue=sign * (order.total_amount or 0)
+    )
+    session.execute(stmt.on_conflict_do_update(index_elements=['sale_date', 'shard'], set_={
+        'total_orders': DailySales.total_orders + stmt.excluded.total_orders,
+        'total_revenue': DailySales.total_revenue + stmt.excluded.total_revenue,
+    }))
+
+    items = session.query(
+        OrderItem.product_id,
+        db.func.count(OrderItem.order_item_id),
+        db.func.sum(OrderItem.quantity),
+        db.func.sum(OrderItem.subtotal)
+    ).filter(OrderItem.order_id == order.order_id).group_by(OrderItem.product_id).order_by(
+        OrderItem.product_id
+    ).all()
+    if not items:
+        return
+    stmt = dialect_insert(ProductDailySales).values([{
+        'sale_date': sale_date, 'product_id': product_id, 'shard': shard,
+        'times_ordered': sign * count, 'quantity_sold': sign * quantity, 'revenue': sign * subtotal
+    } for product_id, count, quantity, subtotal in items])
+    session.execute(stmt.on_conflict_do_update(index_elements=['sale_date', 'product_id', 'shard'], set_={
+        'times_ordered': ProductDailySales.times_ordered + stmt.excluded.times_ordered,
+        'quantity_sold': ProductDailySales.quantity_sold + stmt.excluded.quantity_sold,
+        'revenue': ProductDailySales.revenue + stmt.excluded.revenue,
+    }))
+
+@event.listens_for(db.session, 'before_flush')
+def _track_completed_orders(session, flush_context, instances):
+    """Заказ перешёл в 'completed' или вышел из него (в т.ч. удалён) — поправить итоги"""
+    for obj in (*session.dirty, *session.deleted):
+        if not isinstance(obj, Order):
+            continue
+        history = db.inspect(obj).attrs.status.history
+        was_completed = (history.deleted or history.unchanged or [None])[0] == 'completed'
+        is_completed = obj.status == 'completed' and obj not in session.deleted
+        if was_completed != is_completed:
+            apply_sales_rollup(session, obj, 1 if is_completed else -1)
+            session.info['sales_dirty'] = True
+
+@event.listens_for(db.session, 'after_flush')
+def _track_new_completed_orders(session, flush_context):
+    """
+    Заказ, вставленный сразу в 'completed' (импорт, тесты): order_id и
+    позиции, добавленные вместе с ним, появляются только после INSERT.
+    """
+    for obj in session.new:
+        if isinstance(obj, Order) and obj.status == 'completed':
+            apply_sales_rollup(session, obj, 1)
+            session.info['sales_dirty'] = True
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_sales_cache(session):
+    """Изменились продажи (в том числе задним числом) — кэш диапазонов устарел"""
+    if session.info.pop('sales_dirty', False):
+        sales_cache.clear()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _discard_sales_dirty(session, previous_transaction):
+    session.info.pop('sales_dirty', None)
+
+def rebuild_sales_rollup():
+    """Пересчитать итоги с нуля (первичное заполнение или сверка)"""
+    sale_date = db.func.date(Order.order_date)
+    shard = Order.order_id % app.config['SALES_ROLLUP_SHARDS']
+    db.session.query(ProductDailySales).delete()
+    db.session.query(DailySales).delete()
+    db.session.execute(db.insert(DailySales).from_select(
+        ['sale_date', 'shard', 'total_orders', 'total_revenue'],
+        db.select(sale_date, shard, db.func.count(Order.order_id), db.func.sum(Order.total_amount))
+        .where(Order.status == 'completed').group_by(sale_date, shard)
+    ))
+    db.session.execute(db.insert(ProductDailySales).from_select(
+        ['sale_date', 'product_id', 'shard', 'times_ordered', 'quantity_sold', 'revenue'],
+        db.select(sale_date, OrderItem.product_id, shard, db.func.count(OrderItem.order_item_id),
+                  db.func.sum(OrderItem.quantity), db.func.sum(OrderItem.subtotal))
+        .join(Order, OrderItem.order_id == Order.order_id)
+        .where(Order.status == 'completed').group_by(sale_date, OrderItem.product_id, shard)
+    ))
+    db.session.commit()
+
+@app.cli.command('rebuild-sales-rollup')
+def rebuild_sales_rollup_command():
+    """Пересчитать daily_sales и product_daily_sales по всем заказам"""
+    rebuild_sales_rollup()
+    print(f"✅ Дней в итогах: {db.session.query(db.func.count(db.distinct(DailySales.sale_date))).scalar()}")
+
+# Ответы /api/analytics/sales за закрытые периоды (явный to в прошлом).
+# Сбрасывается при изменении продаж в этом процессе, в других — по короткому TTL.
+sales_cache = LRUCache(maxsize=256, ttl=app.config['ANALYTICS_CACHE_TTL'])
+
+SALES_BUCKETS = ('hour', 'day', 'week')
+SALES_GROUPS = ('product', 'category', 'employee', 'payment_method')
+
+# strftime-аналоги date_trunc для SQLite (неделя начинается с понедельника)
+SQLITE_BUCKET_ARGS = {
+    'hour': ('%Y-%m-%d %H:00:00',),
+    'day': ('%Y-%m-%d 00:00:00',),
+    'week': ('%Y-%m-%d 00:00:00', 'weekday 0', '-6 days'),
+}
+
+def bucket_expression(bucket, column):
+    """Начало интервала для GROUP BY: date_trunc в PostgreSQL, strftime в SQLite"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.date_trunc(db.literal_column(f"'{bucket}'"), column)
+    fmt, *modifiers = SQLITE_BUCKET_ARGS[bucket]
+    return db.func.strftime(fmt, column, *modifiers)
+
+def sales_series(start, end, bucket, group=None):
+    """
+    Продажи завершённых заказов за [start, end) по интервалам bucket.
+
+    Группировка и агрегаты выполняются в БД одним GROUP BY (по индексу
+    orders.order_date), в Python приходят только готовые строки.
+    """
+    bucket_col = bucket_expression(bucket, Order.order_date).label('bucket')
+    in_range = (Order.status == 'completed', Order.order_date >= start, Order.order_date < end)
+
+    if group in ('product', 'category'):
+        key, label = {
+            'product': (Product.product_id, Product.product_name),
+            'category': (Category.category_id, Category.category_name),
+        }[group]
+        query = db.session.query(
+            bucket_col, key.label('key'), label.label('label'),
+            db.func.count(db.distinct(Order.order_id)).label('orders'),
+            db.func.sum(OrderItem.quantity).label('quantity'),
+            db.func.sum(OrderItem.subtotal).label('revenue')
+        ).select_from(OrderItem).join(Order, OrderItem.order_id == Order.order_id).join(
+            Product, OrderItem.product_id == Product.product_id
+        )
+        if group == 'category':
+            query = query.join(Category, Product.category_id == Category.category_id)
+    else:
+        if group == 'employee':
+            key = Employee.employee_id
+            label = Employee.first_name.op('||')(db.literal_column("' '")).op('||')(Employee.last_name)
+        else:
+            key = label = Order.payment_method
+        dimensions = (key.label('key'), label.label('label')) if group else ()
+        query = db.session.query(
+            bucket_col, *dimensions,
+            db.func.count(Order.order_id).label('orders'),
+            db.null().label('quantity'),
+            db.func.sum(Order.total_amount).label('revenue')
+        )
+        if group == 'employee':
+            query = query.join(Employee, Order.employee_id == Employee.employee_id)
+
+    grouping = (bucket_col, key, label) if group else (bucket_col,)
+    rows = query.filter(*in_range).group_by(*grouping).order_by(*grouping[:2]).all()
+    series = []
+    for row in rows:
+        bucket_start = row.bucket if isinstance(row.bucket, datetime) else datetime.fromisoformat(row.bucket)
+        item = {'bucket': bucket_start.isoformat(), 'orders': row.orders, 'revenue': float(row.revenue or 0)}
+        if group:
+            item.update(key=row.key, label=row.label)
+        if row.quantity is not None:
+            item['quantity'] = int(row.quantity)
+        series.append(item)
+    return series
+
+# ========================================
+# RECIPE GRAPH CACHE
+# ========================================
+
+class RecipeGraph:
+    """
+    In-process, versioned cache of the product -> (ingredient_id, quantity) graph.
+
+    Recipes are kept as compact CSR arrays: for the i-th product its
+    ingredient columns and quantities live in columns/quantities
+    [offsets[i]:offsets[i + 1]]. Quantities and stock are stored as integer
+    hundredths (the DB columns are NUMERIC(10, 2)), so the "how many can we
+    make" math is exact integer division. The recipe arrays are rebuilt when
+    `version` changes or every RECIPE_GRAPH_TTL seconds (edits made by other
+    workers); the stock array is re-read every RECIPE_STOCK_TTL seconds and
+    patched in place from Ingredient.use()/restock(). Results are a display
+    hint for /menu and /api/products: checkout reads and decrements stock in
+    the database anyway, so it checks shortages there.
+    """
+
+    def __init__(self):
+        self.version = 0
+        self._lock = threading.Lock()
+        self._graph = None
+        self._graph_loaded_at = 0.0
+        self._stock = None
+        self._stock_loaded_at = 0.0
+
+    def invalidate(self):
+        """Сбросить рецептуры (после изменения продуктов, ингредиентов или рецептов)"""
+        with self._lock:
+            self.version += 1
+
+    def expire_stock(self):
+        """Перечитать остатки при следующем обращении"""
+        self._stock_loaded_at = 0.0
+
+    def update_stock(self, ingredient_id, stock_quantity):
+        """Обновить остаток одного ингредиента значением из RETURNING"""
+        with self._lock:
+            graph, stock = self._graph, self._stock
+            if graph is not None and ingredient_id in graph['column_of']:
+                stock[graph['column_of'][ingredient_id]] = int(Decimal(str(stock_quantity)) * 100)
+
+    def _read_stock(self, column_of):
+        stock = array('q', bytes(8 * len(column_of)))
+        for ingredient_id, stock_quantity in db.session.query(Ingredient.ingredient_id, Ingredient.stock_quantity):
+            if ingredient_id in column_of:
+                stock[column_of[ingredient_id]] = int(Decimal(str(stock_quantity)) * 100)
+        return stock
+
+    def _build(self, version):
+        ingredients = db.session.query(
+            Ingredient.ingredient_id, Ingredient.ingredient_name, Ingredient.unit
+        ).order_by(Ingredient.ingredient_id).all()
+        column_of = {row.ingredient_id: i for i, row in enumerate(ingredients)}
+
+        row_of, offsets, columns, quantities = {}, array('q', [0]), array('q'), array('q')
+        recipe_rows = db.session.query(
+            ProductIngredient.product_id, ProductIngredient.ingredient_id, ProductIngredient.quantity
+        ).order_by(ProductIngredient.product_id, ProductIngredient.ingredient_id)
+        for product_id, ingredient_id, quantity in recipe_rows:
+            hundredths = int(Decimal(str(quantity or 0)) * 100)
+            if hundredths <= 0:
+                continue  # нулевое количество не ограничивает выпуск (и делило бы на ноль)
+            if product_id not in row_of:
+                if row_of:
+                    offsets.append(len(columns))
+                row_of[product_id] = len(row_of)
+            columns.append(column_of[ingredient_id])
+            quantities.append(hundredths)
+        if row_of:
+            offsets.append(len(columns))
+
+        return {
+            'version': version,
+            'row_of': row_of,
+            'product_ids': list(row_of),
+            'offsets': offsets,
+            'columns': columns,
+            'quantities': quantities,
+            'column_of': column_of,
+            'ingredients': ingredients,
+        }
+
+    def _load(self):
+        """Вернуть (graph, stock), перестроив то, что устарело"""
+        with self._lock:
+            now = time.monotonic()
+            if (self._graph is None or self._graph['version'] != self.version
+                    or now - self._graph_loaded_at > app.config['RECIPE_GRAPH_TTL']):
+                self._graph = self._build(self.version)
+                self._graph_loaded_at = now
+                self._stock_loaded_at = 0.0
+            if now - self._stock_loaded_at > app.config['RECIPE_STOCK_TTL']:
+                self._stock = self._read_stock(self._graph['column_of'])
+                self._stock_loaded_at = now
+            return self._graph, self._stock
+
+    def max_makeable(self):
+        """
+        {product_id: units makeable from current stock} for products with recipes.
+
+        Products without a recipe are not limited by stock and are absent.
+        """
+        graph, stock = self._load()
+        if not graph['product_ids']:
+            return {}
+
+        offsets, columns, quantities = graph['offsets'], graph['columns'], graph['quantities']
+        if NUMPY_AVAILABLE:
+            ratios = np.frombuffer(stock, dtype=np.int64)[np.frombuffer(columns, dtype=np.int64)] \
+                // np.frombuffer(quantities, dtype=np.int64)
+            mins = np.minimum.reduceat(ratios, np.frombuffer(offsets, dtype=np.int64)[:-1]).tolist()
+        else:
+            mins = [
+                min(stock[c] // q for c, q in zip(columns[start:end], quantities[start:end]))
+                for start, end in zip(offsets, offsets[1:])
+            ]
+        return dict(zip(graph['product_ids'], mins))
+
+recipe_graph = RecipeGraph()
+
+def low_stock_left():
+    """{product_id: N} для продуктов, которых можно приготовить не больше порога «Осталось N»"""
+    threshold = app.config['LOW_STOCK_BADGE_THRESHOLD']
+    return {pid: left for pid, left in recipe_graph.max_makeable().items() if left <= threshold}
+
+RECIPE_GRAPH_MODELS = (Product, Ingredient, ProductIngredient)
+
+@event.listens_for(db.session, 'before_flush')
+def _track_recipe_graph_changes(session, flush_context, instances):
+    """Пометить сессию, если меняются продукты, ингредиенты или рецептуры"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, RECIPE_GRAPH_MODELS):
+            session.info['recipe_graph_dirty'] = True
+            return
+
+@event.listens_for(db.session, 'after_commit')
+def _invalidate_recipe_graph(session):
+    """Сбросить кэш рецептур только после коммита изменений"""
+    if session.info.pop('recipe_graph_dirty', False):
+        recipe_graph.invalidate()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _expire_recipe_graph_stock(session, previous_transaction):
+    """Откат мог отменить списания и назначения, уже учтённые в кэшах"""
+    session.info.pop('recipe_graph_dirty', None)
+    session.info.pop('employees_dirty', None)
+    recipe_graph.expire_stock()
+    employee_scheduler.expire()
+
+# ========================================
+# EMPLOYEE ASSIGNMENT SCHEDULER
+# ========================================
+
+OPEN_ORDER_STATUSES = ('pending', 'preparing')
+
+def order_weight(cart, products):
+    """Нагрузка заказа: суммарное время приготовления (мин), минимум 1"""
+    return max(1, sum((products[pid].preparation_time or 1) * qty for pid, qty in cart.items()))
+
+class EmployeeScheduler:
+    """
+    Assigns new orders to the active employee with the least queued work.
+
+    Queue state (employee_id -> summed preparation_time of open orders) is
+    kept in memory and updated when orders are created and when their status
+    changes. Other workers change the queues too, so the state is resynced
+    from the database every SCHEDULER_RESYNC_INTERVAL seconds, after an
+    employee changes, or when an unknown order changes status.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loads = {}     # employee_id -> [load, open_orders]
+        self._orders = {}    # order_id -> (employee_id, weight)
+        self._synced_at = 0.0
+
+    def expire(self):
+        """Сверить очереди с БД при следующем назначении"""
+        self._synced_at = 0.0
+
+    def _resync(self):
+        rows = db.session.query(
+            Employee.employee_id,
+            Order.order_id,
+            db.func.sum(db.func.coalesce(Product.preparation_time, 1) * OrderItem.quantity)
+        ).outerjoin(
+            Order, db.and_(Order.employee_id == Employee.employee_id, Order.status.in_(OPEN_ORDER_STATUSES))
+        ).outerjoin(
+            OrderItem, OrderItem.order_id == Order.order_id
+        ).outerjoin(
+            Product, Product.product_id == OrderItem.product_id
+        ).filter(Employee.is_active == True).group_by(Employee.employee_id, Order.order_id).all()
+
+        loads, orders = {}, {}
+        for employee_id, order_id, weight in rows:
+            entry = loads.setdefault(employee_id, [0, 0])
+            if order_id is not None:
+                weight = max(1, int(weight or 0))
+                orders[order_id] = (employee_id, weight)
+                entry[0] += weight
+                entry[1] += 1
+        self._loads, self._orders = loads, orders
+        self._synced_at = time.monotonic()
+
+    def assign(self, weight):
+        """Выбрать сотрудника с наименьшей нагрузкой и сразу учесть заказ; None если некому"""
+        with self._lock:
+            if time.monotonic() - self._synced_at > app.config['SCHEDULER_RESYNC_INTERVAL']:
+                self._resync()
+            if not self._loads:
+                return None
+            employee_id = min(self._loads, key=lambda eid: (self._loads[eid][0], self._loads[eid][1], eid))
+            self._loads[employee_id][0] += weight
+            self._loads[employee_id][1] += 1
+            return employee_id
+
+    def track(self, order_id, employee_id, weight):
+        """Запомнить заказ, чтобы снять нагрузку при смене статуса"""
+        with self._lock:
+            self._orders[order_id] = (employee_id, weight)
+
+    def order_status_changed(self, order_id, status):
+        """Обновить очередь после смены статуса заказа"""
+        with self._lock:
+            tracked = self._orders.get(order_id)
+            if tracked is None:
+                if status in OPEN_ORDER_STATUSES:
+                    self._synced_at = 0.0
+                return
+            if status not in OPEN_ORDER_STATUSES:
+                employee_id, weight = self._orders.pop(order_id)
+                entry = self._loads.get(employee_id)
+                if entry is not None:
+                    entry[0] = max(0, entry[0] - weight)
+                    entry[1] = max(0, entry[1] - 1)
+
+    def queues(self):
+        """Текущие очереди {employee_id: (load, open_orders)}"""
+        with self._lock:
+            return {eid: tuple(entry) for eid, entry in self._loads.items()}
+
+employee_scheduler = EmployeeScheduler()
+
+@event.listens_for(db.session, 'before_flush')
+def _track_employee_changes(session, flush_context, instances):
+    """Пометить сессию, если меняется состав сотрудников"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, Employee):
+            session.info['employees_dirty'] = True
+            return
+
+@event.listens_for(db.session, 'after_commit')
+def _expire_employee_scheduler(session):
+    """Сверить очереди после коммита изменений сотрудников"""
+    if session.info.pop('employees_dirty', False):
+        employee_scheduler.expire()
+
+def create_notification(title, message, category='system', level='info', related_id=None, created_by='system', commit=True):
+    """
+    Сохранить уведомление в базу данных для отображения на сайте.
+
+    commit=False только добавляет запись в текущую транзакцию, чтобы
+    уведомление сохранилось одним коммитом вместе с заказом.
+    """
     try:
         notif = Notification(
             title=title,
@@ -397,10 +1252,611 @@ def create_notification(title, message, category='system', level='info', related
             created_by=created_by
         )
         db.session.add(notif)
-        db.session.commit()
+        db.session.flush()
+        publish_event('notification', notification_payload(notif))
+        if commit:
+            db.session.commit()
     except Exception as e:
         print(f"⚠️ Не удалось создать уведомление: {e}")
-        db.session.rollback()
+        if commit:
+            db.session.rollback()
+
+def enqueue_image_processing(product):
+    """Поставить фото продукта в очередь на ресайз и перекодирование (outbox_dispatcher)"""
+    db.session.add(OutboxEvent(event_type='image', payload=json.dumps({
+        'product_id': product.product_id,
+        'image_url': product.image_url
+    })))
+
+def enqueue_telegram(message):
+    """
+    Поставить сообщение Telegram в outbox в рамках текущей транзакции.
+
+    Сообщение уходит только если транзакция закоммичена; отправляет его
+    outbox_dispatcher.py, поэтому запрос не ждёт Telegram API.
+    """
+    if not TELEGRAM_AVAILABLE:
+        return
+    db.session.add(OutboxEvent(event_type='telegram', payload=json.dumps({'text': message})))
+
+# ========================================
+# EVENT STREAM (Server-Sent Events)
+# ========================================
+
+class EventBroker:
+    """
+    Раздача событий (статусы заказов, уведомления) подключённым SSE-клиентам.
+
+    На PostgreSQL событие публикуется через pg_notify в текущей транзакции:
+    оно доставляется только после COMMIT и всем процессам сразу. В каждом
+    процессе один фоновый поток держит LISTEN и раскладывает события по
+    очередям подписчиков. На других СУБД (SQLite в тестах) события
+    копятся в session.info и раздаются внутри процесса после коммита.
+    """
+
+    CHANNEL = 'bubble_tea_events'
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._listener = None
+
+    def subscribe(self):
+        """Новая очередь событий для одного клиента"""
+        subscriber = queue.Queue(maxsize=100)
+        with self._lock:
+            self._subscribers.add(subscriber)
+            if db.engine.dialect.name == 'postgresql' and self._listener is None:
+                self._listener = threading.Thread(target=self._listen, args=(db.engine,),
+                                                  name='event-listener', daemon=True)
+                self._listener.start()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    def dispatch(self, event_data):
+        """Положить событие во все локальные очереди; медленные клиенты теряют события"""
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event_data)
+            except queue.Full:
+                pass
+
+    def _listen(self, engine):
+        """LISTEN на отдельном соединении (вне пула), переподключение при ошибке"""
+        while True:
+            try:
+                connection = engine.raw_connection()
+                connection.detach()
+                dbapi_connection = connection.driver_connection
+                dbapi_connection.autocommit = True
+                with dbapi_connection.cursor() as cursor:
+                    cursor.execute(f'LISTEN {self.CHANNEL}')
+                while True:
+                    if select.select([dbapi_connection], [], [], 60) == ([], [], []):
+                        continue
+                    dbapi_connection.poll()
+                    while dbapi_connection.notifies:
+                        notify = dbapi_connection.notifies.pop(0)
+                        self.dispatch(json.loads(notify.payload))
+            except Exception as e:
+                print(f"⚠️ Event listener: {e}")
+                time.sleep(5)
+
+event_broker = EventBroker()
+
+def publish_event(event_type, data):
+    """
+    Опубликовать событие в рамках текущей транзакции.
+
+    Клиенты получат его только после COMMIT; при откате событие теряется
+    вместе с изменениями.
+    """
+    event_data = {'type': event_type, 'data': data}
+    if db.engine.dialect.name == 'postgresql':
+        db.session.execute(text('SELECT pg_notify(:channel, :payload)'),
+                           {'channel': EventBroker.CHANNEL, 'payload': json.dumps(event_data)})
+    else:
+        db.session().info.setdefault('pending_events', []).append(event_data)
+
+@event.listens_for(db.session, 'after_commit')
+def _dispatch_pending_events(session):
+    """Раздать события, накопленные без pg_notify"""
+    for event_data in session.info.pop('pending_events', ()):
+        event_broker.dispatch(event_data)
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _drop_pending_events(session, previous_transaction):
+    """Откат отменяет и неотправленные события"""
+    session.info.pop('pending_events', None)
+
+def notification_payload(notif):
+    """Уведомление в формате колокольчика (/api/notifications и SSE)"""
+    return {
+        'id': notif.notification_id,
+        'title': notif.title,
+        'message': notif.message[:80] + '...' if len(notif.message) > 80 else notif.message,
+        'category': notif.category,
+        'level': notif.level,
+        'is_read': notif.is_read,
+        'created_at': notif.created_at.strftime('%d.%m %H:%M'),
+        'created_by': notif.created_by
+    }
+
+# ========================================
+# QUERY BUDGET (N+1 detection)
+# ========================================
+
+class QueryBudgetExceeded(RuntimeError):
+    """Маршрут выполнил больше SQL-запросов, чем разрешено его бюджетом"""
+
+def query_budget(limit):
+    """Задать маршруту собственный лимит SQL-запросов на один HTTP-запрос"""
+    def decorator(view):
+        view.query_budget = limit
+        return view
+    return decorator
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Считать SQL-запросы текущего HTTP-запроса"""
+    if has_request_context() and 'query_count' in g:
+        g.query_count += 1
+
+@app.before_request
+def _start_query_count():
+    if app.debug or app.testing or app.config['QUERY_BUDGET']:
+        g.query_count = 0
+
+@app.after_request
+def _check_query_budget(response):
+    """
+    Сравнить число запросов с бюджетом маршрута (@query_budget или QUERY_BUDGET).
+
+    В debug- и test-режиме превышение — ошибка, чтобы N+1 ловился до
+    продакшена; в остальных случаях только предупреждение в лог.
+    """
+    if 'query_count' not in g:
+        return response
+    view = app.view_functions.get(request.endpoint)
+    budget = getattr(view, 'query_budget', None) or app.config['QUERY_BUDGET']
+    response.headers['X-Query-Count'] = str(g.query_count)
+    if budget and g.query_count > budget:
+        message = f"{request.endpoint}: {g.query_count} SQL queries, budget {budget}"
+        if app.debug or app.testing:
+            raise QueryBudgetExceeded(message)
+        print(f"⚠️ Query budget exceeded — {message}")
+    return response
+
+# ========================================
+# PAGE CACHE (anonymous catalog pages)
+# ========================================
+
+page_cache = LRUCache(maxsize=app.config['PAGE_CACHE_SIZE'], ttl=app.config['PAGE_CACHE_TTL'])
+catalog_version = 0
+
+CATALOG_MODELS = (Product, Category, ProductIngredient)
+
+def bump_catalog_version():
+    """Новая версия каталога: все ранее отрендеренные страницы перестают совпадать по ключу"""
+    global catalog_version
+    catalog_version += 1
+
+def cached_page(view):
+    """
+    Кэш отрендеренных страниц каталога для анонимных посетителей.
+
+    Ответ отдаётся с ETag и Cache-Control: public (Vary: Cookie, чтобы прокси
+    не показал анонимную страницу вошедшему пользователю); повторный
+    запрос с тем же If-None-Match получает 304.
+
+    Ключ — путь, аргументы запроса и версия каталога на начало запроса,
+    поэтому страница, отрендеренная во время правки каталога, сохраняется
+    под старой версией и никогда не будет отдана. Версию поднимают коммиты
+    с изменениями продуктов, категорий и рецептур (admin_product_add /
+    edit / delete) и смена доступности товаров. Другие воркеры узнают о
+    правке не позже PAGE_CACHE_TTL секунд.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if current_user.is_authenticated or session.get('_flashes'):
+            return view(*args, **kwargs)
+
+        key = (request.path, tuple(sorted(request.args.items(multi=True))), catalog_version)
+        cached = page_cache.get(key)
+        if cached is None:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+            body = response.get_data()
+            cached = (body, response.mimetype, content_etag(body))
+            page_cache.set(key, cached)
+        response = conditional_response(*cached)
+        response.vary.add('Cookie')
+        return response
+    return wrapper
+
+def content_etag(body):
+    """Сильный ETag из содержимого: одинаков во всех воркерах для одинакового ответа"""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+def conditional_response(body, mimetype, etag, content_encoding=None):
+    """
+    Ответ каталога с ETag и Cache-Control: public для локального reverse proxy.
+
+    Совпавший If-None-Match превращается в 304 Not Modified без тела.
+    """
+    response = Response(body, mimetype=mimetype)
+    if content_encoding:
+        response.content_encoding = content_encoding
+    response.set_etag(etag)
+    response.cache_control.public = True
+    response.cache_control.max_age = app.config['HTTP_CACHE_MAX_AGE']
+    return response.make_conditional(request)
+
+@event.listens_for(db.session, 'before_flush')
+def _track_catalog_changes(session, flush_context, instances):
+    """Пометить сессию, если меняется содержимое каталога"""
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        if isinstance(obj, CATALOG_MODELS):
+            session.info['catalog_dirty'] = True
+            return
+
+@event.listens_for(db.session, 'after_commit')
+def _bump_catalog_version(session):
+    if session.info.pop('catalog_dirty', False):
+        bump_catalog_version()
+
+@event.listens_for(db.session, 'after_soft_rollback')
+def _forget_catalog_changes(session, previous_transaction):
+    session.info.pop('catalog_dirty', None)
+
+# ========================================
+# CATALOG SNAPSHOT (/api/products)
+# ========================================
+
+class CatalogSnapshot:
+    """
+    In-memory snapshot of the available catalog for /api/products.
+
+    Rows are kept in compact column form (parallel arrays/lists) and rebuilt
+    with one query per catalog version. Each distinct (filters, fields)
+    combination is serialized once per catalog version and set of rendered
+    available_quantity values into ready JSON bytes plus their gzip, which
+    are then sent as-is; stock movements that do not change what a response
+    shows reuse its bytes.
+    """
+
+    FIELDS = ('id', 'name', 'price', 'category', 'category_id', 'available_quantity')
+    DEFAULT_FIELDS = ('id', 'name', 'price', 'category', 'available_quantity')
+    NO_RECIPE = -2 ** 63  # available_quantity продуктов без рецепта (не ограничены складом)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self._columns = None
+        self._bodies = LRUCache(maxsize=256)
+        self._selections = LRUCache(maxsize=256)
+
+    def _load(self):
+        """Вернуть (версия каталога, колонки), перечитав их при смене catalog_version"""
+        with self._lock:
+            if self._version != catalog_version:
+                version = catalog_version
+                rows = db.session.query(
+                    Product.product_id, Product.product_name, Product.price,
+                    Product.category_id, Category.category_name
+                ).outerjoin(Category, Product.category_id == Category.category_id).filter(
+                    Product.is_available.is_(True)
+                ).order_by(Product.product_id).all()
+                self._columns = {
+                    'id': array('q', (r.product_id for r in rows)),
+                    'name': [r.product_name for r in rows],
+                    'price': array('d', (float(r.price) for r in rows)),
+                    'category_id': array('q', (r.category_id or 0 for r in rows)),
+                    'category': [r.category_name for r in rows],
+                }
+                self._version = version
+                self._bodies.clear()
+                self._selections.clear()
+            return self._version, self._columns
+
+    def _select(self, version, columns, category_id, min_price, max_price):
+        """Индексы строк снимка, прошедших фильтры (кэшируются на версию каталога)"""
+        key = (version, category_id, min_price, max_price)
+        selection = self._selections.get(key)
+        if selection is None:
+            prices, category_ids = columns['price'], columns['category_id']
+            selection = array('q', (
+                i for i in range(len(prices))
+                if (category_id is None or category_ids[i] == category_id)
+                and (min_price is None or prices[i] >= min_price)
+                and (max_price is None or prices[i] <= max_price)
+            ))
+            self._selections.set(key, selection)
+        return selection
+
+    def render(self, category_id=None, min_price=None, max_price=None, fields=DEFAULT_FIELDS):
+        """Вернуть (json_bytes, gzip_bytes, etag) для заданных фильтров"""
+        version, columns = self._load()
+        selection = self._select(version, columns, category_id, min_price, max_price)
+        ids = columns['id']
+
+        # Остатки читаются один раз: ключ и тело строятся из одних и тех же значений
+        makeable = recipe_graph.max_makeable() if 'available_quantity' in fields else {}
+        quantities = array('q', (makeable.get(ids[i], self.NO_RECIPE) for i in selection))
+        key = (version, category_id, min_price, max_price, fields,
+               hashlib.blake2b(quantities, digest_size=16).digest())
+        cached = self._bodies.get(key)
+        if cached is not None:
+            return cached
+
+        rows = []
+        for n, i in enumerate(selection):
+            row = {}
+            for field in fields:
+                if field == 'available_quantity':
+                    row[field] = None if quantities[n] == self.NO_RECIPE else quantities[n]
+                else:
+                    row[field] = columns[field][i]
+            rows.append(row)
+
+        body = json.dumps(rows, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        cached = (body, gzip.compress(body, compresslevel=6), content_etag(body))
+        self._bodies.set(key, cached)
+        return cached
+
+catalog_snapshot = CatalogSnapshot()
+
+# ========================================
+# PRODUCT IMAGE STORAGE (content-addressed)
+# ========================================
+
+PRODUCT_IMAGE_URL = '/static/images/products/'
+HASHED_IMAGE_RE = re.compile(r'^[0-9a-f]{32}(-\d+)?\.[a-z0-9]+$')
+# Расширения, которые может создать store_product_image / image_processor
+HASHED_IMAGE_EXTENSIONS = {'png', 'jpg', 'gif', 'webp', 'avif'}
+
+def store_product_image(file):
+    """
+    Сохранить загруженное фото под именем из хэша содержимого и вернуть URL.
+
+    Одинаковые байты записываются один раз и используются многими
+    продуктами; запись идёт во временный файл с атомарным переименованием.
+    """
+    data = file.read()
+    extension = file.filename.rsplit('.', 1)[1].lower().replace('jpeg', 'jpg')
+    filename = f"{hashlib.blake2b(data, digest_size=16).hexdigest()}.{extension}"
+    folder = app.config['UPLOAD_FOLDER']
+    path = os.path.join(folder, filename)
+    if os.path.exists(path):
+        # Старый файл без ссылок GC мог бы удалить до COMMIT нового продукта
+        if os.stat(path).st_mtime < time.time() - app.config['IMAGE_GC_GRACE'] / 2:
+            os.utime(path)
+    else:
+        os.makedirs(folder, exist_ok=True)
+        tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    return PRODUCT_IMAGE_URL + filename
+
+def set_product_image(product, image_url):
+    """
+    Привязать фото к продукту.
+
+    Если тот же файл уже обработан для другого продукта, его варианты
+    переиспользуются; иначе фото ставится в очередь image_processor.
+    """
+    if product.image_url == image_url:
+        return
+    product.image_url = image_url
+    product.image_variants = db.session.query(Product.image_variants).filter(
+        Product.image_url == image_url, Product.image_variants.isnot(None)
+    ).limit(1).scalar()
+    if product.image_variants is None:
+        db.session.flush()  # product_id для нового продукта
+        enqueue_image_processing(product)
+
+def collect_unreferenced_images(grace_seconds=None, dry_run=False):
+    """
+    Удалить из UPLOAD_FOLDER файлы с хэшем в имени, на которые не ссылается
+    ни один продукт (ни image_url, ни image_variants). Остальные файлы
+    (README.md, старые фото с ручными именами) не трогаются никогда, файлы
+    моложе grace_seconds — тоже: их загрузка или обработка может быть ещё
+    не закоммичена.
+    Возвращает список удалённых (при dry_run — подлежащих удалению) имён.
+    """
+    if grace_seconds is None:
+        grace_seconds = app.config['IMAGE_GC_GRACE']
+    folder = app.config['UPLOAD_FOLDER']
+    if not os.path.isdir(folder):
+        return []
+
+    referenced = set()
+    for image_url, image_variants in db.session.query(Product.image_url, Product.image_variants).filter(
+            Product.image_url.isnot(None)):
+        referenced.add(os.path.basename(image_url))
+        if image_variants:
+            for variants in json.loads(image_variants).values():
+                referenced.update(os.path.basename(url) for _, url in variants)
+
+    cutoff = time.time() - grace_seconds
+    removed = []
+    for entry in os.scandir(folder):
+        if not (HASHED_IMAGE_RE.match(entry.name)
+                and entry.name.rsplit('.', 1)[1] in HASHED_IMAGE_EXTENSIONS):
+            continue
+        if entry.is_file() and entry.name not in referenced and entry.stat().st_mtime < cutoff:
+            if not dry_run:
+                os.remove(entry.path)
+            removed.append(entry.name)
+    return removed
+
+@app.cli.command('gc-images')
+@click.option('--dry-run', is_flag=True, help='Только показать, что будет удалено')
+@click.option('--grace', type=int, default=None, help='Не трогать файлы моложе N секунд')
+def gc_images_command(dry_run, grace):
+    """Удалить фото продуктов, на которые больше нет ссылок"""
+    removed = collect_unreferenced_images(grace, dry_run=dry_run)
+    for name in removed:
+        print(f"{'[dry-run] ' if dry_run else ''}🗑️ {name}")
+    print(f"✅ Неиспользуемых файлов: {len(removed)}")
+
+@app.after_request
+def _immutable_image_cache(response):
+    """Файлы с хэшем в имени не меняются: кэшировать их на год"""
+    if (request.endpoint == 'static' and response.status_code == 200
+            and request.path.startswith(PRODUCT_IMAGE_URL)
+            and HASHED_IMAGE_RE.match(request.path[len(PRODUCT_IMAGE_URL):])):
+        response.cache_control.public = True
+        response.cache_control.max_age = 365 * 24 * 3600
+        response.cache_control.immutable = True
+    return response
+
+# ========================================
+# СТАТИЧЕСКИЕ АССЕТЫ (CSS/JS)
+# ========================================
+
+# Исходный путь -> путь с хэшем содержимого ({'css/style.css': 'dist/css/style.<hash>.css'}).
+# Сборка — шаг деплоя (flask --app app build-static); здесь манифест только
+# читается при первом url_for, чтобы импорт app (тесты, outbox_dispatcher)
+# не трогал static/
+static_manifest = None
+
+def get_static_manifest():
+    """Манифест текущей сборки ({} без сборки или при STATIC_FINGERPRINT=false)"""
+    global static_manifest
+    if static_manifest is None:
+        static_manifest = static_assets.load_manifest(app.static_folder) if app.config['STATIC_FINGERPRINT'] else {}
+    return static_manifest
+
+@app.cli.command('build-static')
+def build_static_command():
+    """Собрать хэшированные и сжатые CSS/JS в static/dist"""
+    for source, target in static_assets.build(app.static_folder).items():
+        print(f"✅ {source} -> {target}")
+
+@app.url_defaults
+def _fingerprint_static_url(endpoint, values):
+    """url_for('static', filename='css/style.css') -> URL версии с хэшем"""
+    if endpoint == 'static':
+        values['filename'] = get_static_manifest().get(values.get('filename'), values.get('filename'))
+
+@app.route(f"{app.static_url_path}/{static_assets.DIST_DIR}/<path:filename>")
+def static_dist(filename):
+    """
+    Собранная статика (static/dist) с отдачей заранее сжатых копий.
+
+    .br или .gz выбирается по Accept-Encoding (без сжатия на лету), кэш —
+    на год: при изменении файла меняется его имя. Остальную статику отдаёт
+    стандартный endpoint static.
+    """
+    filename = f"{static_assets.DIST_DIR}/{filename}"
+    options = {
+        'mimetype': mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+        'max_age': 365 * 24 * 3600,
+    }
+    for encoding, suffix in static_assets.PRECOMPRESSED:
+        path = safe_join(app.static_folder, filename + suffix)
+        if encoding in request.accept_encodings and path and os.path.isfile(path):
+            response = send_from_directory(app.static_folder, filename + suffix, **options)
+            response.headers['Content-Encoding'] = encoding
+            break
+    else:
+        response = send_from_directory(app.static_folder, filename, **options)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+# ========================================
+# TYPEAHEAD SUGGEST (pg_trgm)
+# ========================================
+
+SUGGEST_MAX_LIMIT = 20
+SUGGEST_MIN_LENGTH = 2
+PHONE_QUERY_RE = re.compile(r'^[\d\s()+-]+$')
+
+# Продукты: (запрос, limit, catalog_version) -> подсказки.
+# Клиенты: (запрос, limit) -> подсказки; кэш сбрасывается после COMMIT любого
+# изменения клиентов в этом процессе (ORM или upsert), в других — по TTL.
+suggest_cache = LRUCache(maxsize=app.config['SUGGEST_CACHE_SIZE'], ttl=app.config['SUGGEST_CACHE_TTL'])
+customer_suggest_cache = LRUCache(maxsize=app.config['SUGGEST_CACHE_SIZE'], ttl=app.config['SUGGEST_CACHE_TTL'])
+
+def phone_digits(phone):
+    """'+7-911-111-1111' -> '79111111111' (поиск по части номера без учёта формата)"""
+    return re.sub(r'\D', '', phone) if phone else phone
+
+@event.listens_for(Engine, 'connect')
+def _register_sqlite_functions(dbapi_connection, connection_record):
+    """В PostgreSQL phone_digits() создаёт full_text_search.sql, в SQLite — регистрируем здесь"""
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function('phone_digits', 1, phone_digits, deterministic=True)
+
+def _like_pattern(query):
+    """Подстрока для LIKE/ILIKE с экранированием % и _"""
+    escaped = query.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return f"%{escaped}%"
+
+def _similarity_order(column, query):
+    """Сортировка по сходству триграмм (PostgreSQL) или по длине строки (SQLite)"""
+    if db.engine.dialect.name == 'postgresql':
+        return db.func.similarity(column, query).desc()
+    return db.func.length(column)
+
+def suggest(scope, query, limit):
+    """
+    Подсказки для поля ввода: до limit совпадений по подстроке.
+
+    ILIKE '%...%' в PostgreSQL идёт по GIN-индексам gin_trgm_ops из
+    full_text_search.sql. Запрос из цифр ищет клиента по части телефона.
+    """
+    if scope == 'products':
+        cache, key = suggest_cache, (query.lower(), limit, catalog_version)
+    else:
+        cache, key = customer_suggest_cache, (query.lower(), limit)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    if scope == 'products':
+        rows = db.session.query(Product.product_id, Product.product_name, Product.price).filter(
+            Product.is_available == True,
+            Product.product_name.ilike(_like_pattern(query), escape='\\')
+        ).order_by(
+            _similarity_order(Product.product_name, query), Product.product_name
+        ).limit(limit).all()
+        results = [{
+            'product_id': row.product_id,
+            'product_name': row.product_name,
+            'price': float(row.price)
+        } for row in rows]
+    else:
+        columns = (Customer.customer_id, Customer.first_name, Customer.last_name, Customer.phone)
+        digits = phone_digits(query)
+        if PHONE_QUERY_RE.match(query) and len(digits) >= 3:
+            target, needle = db.func.phone_digits(Customer.phone), digits
+            condition = target.like(_like_pattern(needle), escape='\\')
+        else:
+            # Литерал, а не параметр: выражение должно совпасть с индексом
+            target = Customer.first_name.op('||')(db.literal_column("' '")).op('||')(Customer.last_name)
+            needle = query
+            condition = target.ilike(_like_pattern(needle), escape='\\')
+        rows = db.session.query(*columns).filter(condition).order_by(
+            _similarity_order(target, needle), Customer.last_name, Customer.first_name
+        ).limit(limit).all()
+        results = [{
+            'customer_id': row.customer_id,
+            'full_name': f"{row.first_name} {row.last_name}",
+            'phone': row.phone
+        } for row in rows]
+
+    cache.set(key, results)
+    return results
 
 # ========================================
 # МАРШРУТЫ (Routes)
@@ -449,9 +1905,9 @@ flask_app_health 1
     except:
         metrics_text += "flask_database_status 0\n"
     
-    # Add product count
+    # Add product count (счётчики одним запросом, с коротким кэшем)
     try:
-        product_count = Product.query.count()
+        product_count = table_counts()['products']
         metrics_text += f"\n# HELP flask_products_total Total number of products\n"
         metrics_text += f"# TYPE flask_products_total gauge\n"
         metrics_text += f"flask_products_total {product_count}\n"
@@ -460,7 +1916,7 @@ flask_app_health 1
     
     # Add order count
     try:
-        order_count = Order.query.count()
+        order_count = table_counts()['orders']
         metrics_text += f"\n# HELP flask_orders_total Total number of orders\n"
         metrics_text += f"# TYPE flask_orders_total gauge\n"
         metrics_text += f"flask_orders_total {order_count}\n"
@@ -470,139 +1926,204 @@ flask_app_health 1
     return Response(metrics_text, mimetype='text/plain; version=0.0.4')
 
 @app.route('/')
+@query_budget(4)
+@cached_page
 def index():
     """Главная страница"""
     categories = Category.query.all()
-    featured_products = Product.query.filter_by(is_available=True).limit(6).all()
+    featured_products = Product.query.options(joinedload(Product.category)).filter_by(is_available=True).limit(6).all()
     return render_template('index.html', categories=categories, products=featured_products)
 
 @app.route('/menu')
+@query_budget(6)
+@cached_page
 def menu():
     """Страница меню"""
     categories = Category.query.all()
     category_id = request.args.get('category', type=int)
     
+    query = Product.query.options(joinedload(Product.category)).filter_by(is_available=True)
     if category_id:
-        products = Product.query.filter_by(category_id=category_id, is_available=True).all()
-    else:
-        products = Product.query.filter_by(is_available=True).all()
+        query = query.filter_by(category_id=category_id)
+    products = query.all()
     
-    return render_template('menu.html', categories=categories, products=products, selected_category=category_id)
+    return render_template('menu.html', categories=categories, products=products, selected_category=category_id,
+                           stock_left=low_stock_left())
 
 @app.route('/product/<int:product_id>')
+@query_budget(3)
+@cached_page
 def product_detail(product_id):
     """Product detail page"""
-    product = Product.query.get_or_404(product_id)
+    product = Product.query.options(joinedload(Product.category)).filter_by(product_id=product_id).first_or_404()
     return render_template('product_detail.html', product=product)
 
+def get_idempotency_key():
+    """Idempotency-Key из заголовка или скрытого поля формы (None, если не передан)"""
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key') or ''
+    return key.strip() or None
+
+def idempotency_scope():
+    """Владелец Idempotency-Key: текущий пользователь или анонимный покупатель"""
+    return current_user.user_id if current_user.is_authenticated else ANONYMOUS_IDEMPOTENCY_SCOPE
+
+def find_idempotent_order(key):
+    """order_id, уже созданный этим пользователем по этому ключу, если ключ ещё не истёк"""
+    record = db.session.get(IdempotencyKey, {'user_id': idempotency_scope(), 'idempotency_key': key})
+    if record is None:
+        return None
+    if record.created_at < datetime.now() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL']):
+        db.session.delete(record)
+        db.session.commit()
+        return None
+    return record.order_id
+
+def integrity_violation(error):
+    """
+    Что нарушил IntegrityError: 'idempotency_key' (параллельный повтор с тем
+    же ключом), 'foreign_key' (строка, на которую ссылаемся, удалена) или 'other'.
+    """
+    message = str(error.orig)
+    if 'idempotency_keys_pkey' in message or 'UNIQUE constraint failed: idempotency_keys' in message:
+        return 'idempotency_key'
+    if getattr(error.orig, 'pgcode', None) == '23503' or 'FOREIGN KEY constraint failed' in message:
+        return 'foreign_key'
+    return 'other'
+
+def purge_idempotency_keys():
+    """Удалить истёкшие ключи; вызывается фоновым процессом, а не при оформлении заказа"""
+    cutoff = datetime.now() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'])
+    deleted = IdempotencyKey.query.filter(IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return deleted
+
+def order_created_response(order_id, replayed=False):
+    """Ответ на созданный заказ: JSON для POS-клиентов, редирект для браузера"""
+    if request.accept_mimetypes.best == 'application/json':
+        response = jsonify({
+            'success': True,
+            'order_id': order_id,
+            'url': url_for('order_detail', order_id=order_id),
+            'replayed': replayed
+        })
+        if not replayed:
+            response.status_code = 201
+    else:
+        if replayed:
+            flash(f'Заказ #{order_id} уже создан.', 'info')
+        response = redirect(url_for('order_detail', order_id=order_id))
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
 @app.route('/order/new', methods=['GET', 'POST'])
 def new_order():
     """Create new order"""
     if request.method == 'POST':
+        # Повтор с тем же Idempotency-Key возвращает уже созданный заказ
+        idempotency_key = get_idempotency_key()
+        if idempotency_key:
+            if len(idempotency_key) > 255:
+                return jsonify({'success': False, 'error': 'Idempotency-Key is too long'}), 400
+            order_id = find_idempotent_order(idempotency_key)
+            if order_id is not None:
+                return order_created_response(order_id, replayed=True)
+
         try:
             # Get form data
             customer_phone = request.form.get('customer_phone')
             payment_method = request.form.get('payment_method')
             notes = request.form.get('notes')
+
+            # Корзина целиком: рецептуры и остатки для всех позиций одним запросом
+            cart = parse_cart(request.form.getlist('product_id'), request.form.getlist('quantity'))
+            products = {
+                p.product_id: p
+                for p in Product.query.filter(Product.product_id.in_(list(cart))).all()
+            } if cart else {}
+            cart = {pid: qty for pid, qty in cart.items() if pid in products}
+
+            requirements = load_cart_requirements(cart)
+            shortages = find_cart_shortages(requirements)
+
+            # If any ingredient is short for the whole cart, abort
+            if shortages:
+                error_messages = []
+                for ingredient_id, reason, product_ids in shortages:
+                    names = ', '.join(products[pid].product_name for pid in product_ids)
+                    error_messages.append(f"{names}: {reason}")
+                flash(f'Невозможно создать заказ: {"; ".join(error_messages)}', 'error')
+                return redirect(url_for('new_order'))
+
+            # Find or create customer (LRU, then a single upsert)
+            customer = find_or_create_customer(customer_phone, request.form.get('customer_name')) if customer_phone else None
             
-            # Find or create customer
-            customer = None
-            if customer_phone:
-                customer = Customer.query.filter_by(phone=customer_phone).first()
-                if not customer and request.form.get('customer_name'):
-                    name_parts = request.form.get('customer_name').split(' ', 1)
-                    customer = Customer(
-                        first_name=name_parts[0],
-                        last_name=name_parts[1] if len(name_parts) > 1 else '',
-                        phone=customer_phone
-                    )
-                    db.session.add(customer)
-                    db.session.flush()
-            
-            # Create order
-            employee = Employee.query.filter_by(is_active=True).first()
-            if not employee:
+            # Create order, assigned to the least loaded active employee
+            weight = order_weight(cart, products)
+            employee_id = employee_scheduler.assign(weight)
+            if employee_id is None:
                 flash('Нет доступных сотрудников', 'error')
                 return redirect(url_for('menu'))
             
             order = Order(
                 user_id=current_user.user_id if current_user.is_authenticated else None,
-                customer_id=customer.customer_id if customer else None,
-                employee_id=employee.employee_id,
+                customer_id=customer[0] if customer else None,
+                employee_id=employee_id,
                 payment_method=payment_method,
                 notes=notes,
                 status='pending'
             )
             db.session.add(order)
             db.session.flush()
+
+            # Ключ вставляется в той же транзакции: параллельный повтор
+            # упрётся в PRIMARY KEY и получит заказ первого запроса
+            if idempotency_key:
+                try:
+                    db.session.add(IdempotencyKey(user_id=idempotency_scope(), idempotency_key=idempotency_key,
+                                                  order_id=order.order_id))
+                    db.session.flush()
+                except IntegrityError:
+                    db.session.rollback()
+                    order_id = find_idempotent_order(idempotency_key)
+                    if order_id is not None:
+                        return order_created_response(order_id, replayed=True)
+                    raise
+
+            employee_scheduler.track(order.order_id, employee_id, weight)
             
-            # Add order items and check ingredients
-            cart_items = request.form.getlist('product_id')
-            quantities = request.form.getlist('quantity')
-            total = Decimal('0')
-            
-            # First pass: Check all ingredients availability
-            ingredients_check = []
-            for i, product_id in enumerate(cart_items):
-                quantity = int(quantities[i])
-                if quantity > 0:
-                    available, reason = check_product_availability(product_id, quantity)
-                    if not available:
-                        ingredients_check.append((product_id, reason))
-            
-            # If any product lacks ingredients, abort
-            if ingredients_check:
-                error_messages = []
-                for product_id, reason in ingredients_check:
-                    product = Product.query.get(product_id)
-                    error_messages.append(f"{product.product_name}: {reason}")
-                flash(f'Невозможно создать заказ: {"; ".join(error_messages)}', 'error')
+            # Deduct ingredients for the whole cart in one pass
+            success, result = deduct_cart_ingredients(requirements)
+            if not success:
+                db.session.rollback()
+                flash(f'Ошибка списания ингредиентов: {result}', 'error')
                 return redirect(url_for('new_order'))
-            
-            # Second pass: Add items and deduct ingredients
-            for i, product_id in enumerate(cart_items):
-                quantity = int(quantities[i])
-                product = Product.query.get(product_id)
-                
-                if product and quantity > 0:
-                    # Deduct ingredients
-                    success, result = deduct_ingredients(product_id, quantity)
-                    if not success:
-                        db.session.rollback()
-                        flash(f'Ошибка списания ингредиентов: {result}', 'error')
-                        return redirect(url_for('new_order'))
-                    
-                    # Add order item
-                    subtotal = product.price * quantity
-                    order_item = OrderItem(
-                        order_id=order.order_id,
-                        product_id=product.product_id,
-                        quantity=quantity,
-                        unit_price=product.price,
-                        subtotal=subtotal
-                    )
-                    db.session.add(order_item)
-                    total += subtotal
+
+            # Add order items
+            total = Decimal('0')
+            items_list = []
+            for product_id, quantity in cart.items():
+                product = products[product_id]
+                subtotal = product.price * quantity
+                order_item = OrderItem(
+                    order_id=order.order_id,
+                    product_id=product.product_id,
+                    quantity=quantity,
+                    unit_price=product.price,
+                    subtotal=subtotal
+                )
+                db.session.add(order_item)
+                total += subtotal
+                items_list.append(f"• {product.product_name} x{quantity} (${float(subtotal):.2f})")
             
             order.total_amount = total
-            db.session.commit()
             
-            # Update product availability after ingredient deduction
-            update_product_availability()
+            # Update availability only for products using the deducted ingredients
+            update_product_availability(requirements.keys(), commit=False)
             
-            # Send Telegram notification about new order
-            if TELEGRAM_AVAILABLE:
-                try:
-                    notifier = get_notifier()
-                    
-                    # Формируем список товаров
-                    items_list = []
-                    for item in order.order_items:
-                        items_list.append(f"• {item.product.product_name} x{item.quantity} (${float(item.subtotal):.2f})")
-                    
-                    customer_name = customer.full_name if customer else "Guest"
-                    
-                    message = f"""
+            # Side effects go to the outbox / notifications in the same transaction
+            customer_name = customer[1] if customer else "Guest"
+            enqueue_telegram(f"""
 🛒 <b>НОВЫЙ ЗАКАЗ #{order.order_id}</b>
 
 👤 <b>Клиент:</b> {customer_name}
@@ -613,37 +2134,44 @@ def new_order():
 {chr(10).join(items_list)}
 
 ⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
-                    notifier.send_message(message)
-                    print(f"📱 Telegram: новый заказ #{order.order_id}")
-                except Exception as e:
-                    print(f"⚠️ Telegram notification failed: {e}")
+""")
             
             create_notification(
                 title=f'🛒 Новый заказ #{order.order_id}',
-                message=f'Клиент: {customer.full_name if customer else "Гость"} | Сумма: ${float(total):.2f} | Оплата: {payment_method}',
+                message=f'Клиент: {customer[1] if customer else "Гость"} | Сумма: ${float(total):.2f} | Оплата: {payment_method}',
                 category='order', level='info',
                 related_id=order.order_id,
-                created_by=current_user.username if current_user.is_authenticated else 'guest'
+                created_by=current_user.username if current_user.is_authenticated else 'guest',
+                commit=False
             )
             
+            db.session.commit()
+            
             flash(f'Заказ #{order.order_id} успешно создан! Ингредиенты списаны.', 'success')
-            return redirect(url_for('order_detail', order_id=order.order_id))
+            return order_created_response(order.order_id)
             
         except Exception as e:
             db.session.rollback()
+            if isinstance(e, IntegrityError):
+                # customer_id из LRU мог быть удалён в другом воркере
+                customer_cache.pop(request.form.get('customer_phone'))
             print(f"[ERROR] create order: {e}")
             flash('Ошибка при создании заказа. Попробуйте снова.', 'error')
             return redirect(url_for('menu'))
     
     products = Product.query.filter_by(is_available=True).all()
-    return render_template('new_order.html', products=products)
+    return render_template('new_order.html', products=products, idempotency_key=uuid.uuid4().hex)
 
 @app.route('/order/<int:order_id>')
+@query_budget(4)
 @login_required
 def order_detail(order_id):
     """Order detail page"""
-    order = Order.query.get_or_404(order_id)
+    order = Order.query.options(
+        joinedload(Order.customer),
+        joinedload(Order.employee).joinedload(Employee.position),
+        selectinload(Order.order_items).joinedload(OrderItem.product).joinedload(Product.category)
+    ).filter_by(order_id=order_id).first_or_404()
     # Только администратор или владелец заказа может просматривать детали
     if current_user.role != 'admin' and order.user_id != current_user.user_id:
         flash('Доступ запрещён: вы можете просматривать только свои заказы.', 'danger')
@@ -651,6 +2179,7 @@ def order_detail(order_id):
     return render_template('order_detail.html', order=order)
 
 @app.route('/orders')
+@query_budget(4)
 @login_required
 @admin_required
 def orders_list():
@@ -659,7 +2188,7 @@ def orders_list():
     page = request.args.get('page', 1, type=int)
     per_page = 20
     
-    query = Order.query
+    query = Order.query.options(joinedload(Order.customer), joinedload(Order.employee))
     if status:
         query = query.filter_by(status=status)
     
@@ -675,11 +2204,12 @@ def customers_list():
     return render_template('customers_list.html', customers=customers)
 
 @app.route('/employees')
+@query_budget(3)
 @login_required
 @admin_required
 def employees_list():
     """Employees list"""
-    employees = Employee.query.filter_by(is_active=True).all()
+    employees = Employee.query.options(joinedload(Employee.position)).filter_by(is_active=True).all()
     return render_template('employees_list.html', employees=employees)
 
 @app.route('/inventory')
@@ -690,9 +2220,6 @@ def inventory():
     ingredients = Ingredient.query.order_by(Ingredient.ingredient_name).all()
     low_stock = [ing for ing in ingredients if ing.needs_restock]
     
-    # Check if any products became unavailable
-    update_product_availability()
-    
     return render_template('inventory.html', ingredients=ingredients, low_stock=low_stock)
 
 @app.route('/inventory/restock/<int:ingredient_id>', methods=['POST'])
@@ -710,17 +2237,18 @@ def restock_ingredient(ingredient_id):
         
         old_quantity = float(ingredient.stock_quantity)
         ingredient.restock(quantity)
-        db.session.commit()
         
-        # Update product availability after restocking
-        updated = update_product_availability()
+        # Update availability of products that use this ingredient
+        updated = update_product_availability([ingredient.ingredient_id], commit=False)
         
         create_notification(
             title=f'📦 Пополнение склада',
             message=f'{ingredient.ingredient_name}: {old_quantity} → {float(ingredient.stock_quantity)} {ingredient.unit}',
             category='inventory', level='success',
-            created_by=current_user.username
+            created_by=current_user.username,
+            commit=False
         )
+        db.session.commit()
         
         flash(f'Склад пополнен: {ingredient.ingredient_name}: {old_quantity} → {float(ingredient.stock_quantity)} {ingredient.unit}. Обновлено продуктов: {updated}.', 'success')
     except Exception as e:
@@ -746,21 +2274,25 @@ def check_inventory_availability():
 @app.route('/analytics')
 @login_required
 @admin_required
+@query_budget(4)
 def analytics():
-    """Analytics and statistics"""
+    """Analytics and statistics (из дневных итогов, а не по всем заказам)"""
     # General statistics
-    total_orders = Order.query.filter_by(status='completed').count()
-    total_revenue = db.session.query(db.func.sum(Order.total_amount)).filter_by(status='completed').scalar() or 0
-    total_customers = Customer.query.count()
+    total_orders, total_revenue = db.session.query(
+        db.func.coalesce(db.func.sum(DailySales.total_orders), 0),
+        db.func.coalesce(db.func.sum(DailySales.total_revenue), 0)
+    ).one()
+    total_customers = table_counts()['customers']
     
     # Popular products
     popular_products = db.session.query(
         Product.product_name,
-        db.func.sum(OrderItem.quantity).label('total_sold'),
-        db.func.sum(OrderItem.subtotal).label('revenue')
-    ).join(OrderItem).join(Order).filter(
-        Order.status == 'completed'
-    ).group_by(Product.product_id, Product.product_name).order_by(
+        db.func.sum(ProductDailySales.times_ordered).label('times_ordered'),
+        db.func.sum(ProductDailySales.quantity_sold).label('total_sold'),
+        db.func.sum(ProductDailySales.revenue).label('revenue')
+    ).join(ProductDailySales).group_by(Product.product_id, Product.product_name).having(
+        db.func.sum(ProductDailySales.quantity_sold) > 0
+    ).order_by(
         db.desc('total_sold')
     ).limit(10).all()
     
@@ -770,143 +2302,624 @@ def analytics():
                          total_customers=total_customers,
                          popular_products=popular_products)
 
+def parse_range_bound(value, default):
+    """?from= / ?to=: дата или дата-время ISO 8601 (ValueError при ошибке)"""
+    if not value:
+        return default
+    parsed = datetime.fromisoformat(value)
+    # order_date хранится в локальном времени без зоны
+    return parsed.astimezone().replace(tzinfo=None) if parsed.tzinfo else parsed
+
+@app.route('/api/analytics/sales')
+@login_required
+@admin_required
+@query_budget(3)
+def api_analytics_sales():
+    """
+    API: продажи по интервалам — /api/analytics/sales?from=&to=&bucket=&group=.
+
+    bucket: hour | day | week; group (необязательно): product | category |
+    employee | payment_method. Диапазон [from, to), по умолчанию 7 дней.
+    Ответы за закрытые периоды кэшируются.
+    """
+    bucket = request.args.get('bucket', 'day')
+    group = request.args.get('group') or None
+    if bucket not in SALES_BUCKETS:
+        return jsonify({'success': False, 'error': f"bucket must be one of {', '.join(SALES_BUCKETS)}"}), 400
+    if group is not None and group not in SALES_GROUPS:
+        return jsonify({'success': False, 'error': f"group must be one of {', '.join(SALES_GROUPS)}"}), 400
+
+    now = datetime.now()
+    try:
+        end = parse_range_bound(request.args.get('to'), now)
+        start = parse_range_bound(request.args.get('from'), end - timedelta(days=7))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'from/to must be ISO 8601 dates'}), 400
+    if start >= end:
+        return jsonify({'success': False, 'error': 'from must be earlier than to'}), 400
+    if end - start > timedelta(days=app.config['ANALYTICS_MAX_DAYS']):
+        return jsonify({'success': False, 'error': f"Range is limited to {app.config['ANALYTICS_MAX_DAYS']} days"}), 400
+
+    key = (start, end, bucket, group)
+    closed = 'to' in request.args and end <= now  # без to конец — текущий момент, ключ не повторится
+    series = sales_cache.get(key) if closed else None
+    if series is None:
+        series = sales_series(start, end, bucket, group)
+        if closed:
+            sales_cache.set(key, series)
+
+    return jsonify({
+        'success': True,
+        'from': start.isoformat(),
+        'to': end.isoformat(),
+        'bucket': bucket,
+        'group': group,
+        'series': series,
+        'totals': {
+            'orders': sum(item['orders'] for item in series) if group in (None, 'employee', 'payment_method') else None,
+            'revenue': round(sum(item['revenue'] for item in series), 2)
+        }
+    })
+
 # ========================================
 # API Routes
 # ========================================
 
 @app.route('/api/products')
+@query_budget(5)
 def api_products():
-    """API: products list"""
-    products = Product.query.filter_by(is_available=True).all()
-    return jsonify([{
-        'id': p.product_id,
-        'name': p.product_name,
-        'price': float(p.price),
-        'category': p.category.category_name
-    } for p in products])
+    """
+    API: products list (из CatalogSnapshot).
+
+    Параметры: category (id), min_price, max_price, fields (через запятую).
+    Ответ отдаётся готовыми байтами, gzip — если клиент его принимает;
+    киоски, опрашивающие список с If-None-Match, получают 304.
+    """
+    category_id = request.args.get('category', type=int)
+    min_price = request.args.get('min_price', type=float)
+    max_price = request.args.get('max_price', type=float)
+    fields = CatalogSnapshot.DEFAULT_FIELDS
+    if request.args.get('fields'):
+        fields = tuple(f.strip() for f in request.args['fields'].split(',') if f.strip())
+        unknown = [f for f in fields if f not in CatalogSnapshot.FIELDS]
+        if unknown or not fields:
+            return jsonify({'error': f"Unknown fields: {', '.join(unknown)}",
+                            'allowed': list(CatalogSnapshot.FIELDS)}), 400
+
+    body, gzipped, etag = catalog_snapshot.render(category_id, min_price, max_price, fields)
+    if 'gzip' in request.accept_encodings:
+        response = conditional_response(gzipped, 'application/json', f'{etag}-gz', content_encoding='gzip')
+    else:
+        response = conditional_response(body, 'application/json', etag)
+    response.vary.add('Accept-Encoding')
+    return response
 
 @app.route('/api/order/<int:order_id>/status', methods=['PUT'])
 @login_required
 @admin_required
 def api_update_order_status(order_id):
     """API: update order status"""
-    order = Order.query.get_or_404(order_id)
+    # FOR UPDATE: два одновременных перехода в 'completed' не посчитают заказ дважды в итогах
+    order = Order.query.filter_by(order_id=order_id).with_for_update().first_or_404()
     data = request.get_json()
     
     new_status = data.get('status')
     if new_status in ['pending', 'preparing', 'ready', 'completed', 'cancelled']:
         order.status = new_status
+        publish_event('order_status', {
+            'order_id': order_id,
+            'user_id': order.user_id,
+            'status': new_status,
+            'status_text': status_text_filter(new_status)
+        })
         db.session.commit()
+        employee_scheduler.order_status_changed(order_id, new_status)
         return jsonify({'success': True, 'status': new_status})
     
     return jsonify({'success': False, 'error': 'Invalid status'}), 400
 
-@app.route('/api/search/products')
-def api_search_products():
-    """API: Full-text search for products"""
-    query = request.args.get('q', '')
-    if not query:
-        return jsonify({'error': 'Search query is required'}), 400
-    
+PAYMENT_METHODS = ('cash', 'card', 'online')
+ORDER_STATUSES = ('pending', 'preparing', 'ready', 'completed', 'cancelled')
+
+def parse_batch_order(entry):
+    """Разобрать один заказ из /api/orders/batch; вернуть (cart, ошибка)"""
+    if not isinstance(entry, dict) or not isinstance(entry.get('items'), list):
+        return None, 'items must be a list'
     try:
-        result = db.session.execute(
-            db.text("SELECT * FROM search_products(:query)"),
-            {'query': query}
-        )
-        products = []
-        for row in result:
-            products.append({
-                'product_id': row[0],
-                'product_name': row[1],
-                'category_name': row[2],
-                'price': float(row[3]) if row[3] else 0,
-                'description': row[4],
-                'relevance': float(row[5]) if row[5] else 0
-            })
-        return jsonify({'success': True, 'results': products, 'count': len(products)})
+        cart = parse_cart([item['product_id'] for item in entry['items']],
+                          [item.get('quantity', 1) for item in entry['items']])
+    except (KeyError, TypeError, ValueError, AttributeError):
+        return None, 'Invalid items'
+    if not cart:
+        return None, 'Empty order'
+    if entry.get('payment_method') not in PAYMENT_METHODS:
+        return None, f"payment_method must be one of {', '.join(PAYMENT_METHODS)}"
+    key = entry.get('idempotency_key')
+    if key is not None and (not isinstance(key, str) or not key or len(key) > 255):
+        return None, 'Invalid idempotency_key'
+    for field in ('customer_phone', 'customer_name', 'notes'):
+        if entry.get(field) is not None and not isinstance(entry[field], str):
+            return None, f'{field} must be a string'
+    if len(entry.get('customer_phone') or '') > Customer.phone.type.length:
+        return None, 'customer_phone is too long'
+    return cart, None
+
+@app.route('/api/orders/batch', methods=['POST'])
+@login_required
+@admin_required
+def api_orders_batch():
+    """
+    API: пакетное создание заказов с POS-терминалов.
+
+    Тело: {"orders": [{"items": [{"product_id", "quantity"}], "payment_method",
+    "customer_phone", "customer_name", "notes", "idempotency_key"}]}.
+    Заказы проверяются по порядку против одного снимка остатков, затем
+    заказы, позиции и ключи вставляются пакетными INSERT в одной транзакции,
+    а ингредиенты списываются суммарно. Ответ содержит результат по каждому
+    заказу: created, duplicate (ключ уже использован) или rejected.
+    """
+    data = request.get_json(silent=True) or {}
+    entries = data.get('orders')
+    if not isinstance(entries, list) or not entries:
+        return jsonify({'success': False, 'error': 'orders must be a non-empty list'}), 400
+    if len(entries) > app.config['ORDER_BATCH_LIMIT']:
+        return jsonify({'success': False, 'error': f"At most {app.config['ORDER_BATCH_LIMIT']} orders per batch"}), 400
+
+    results = []
+    parsed = []
+    for index, entry in enumerate(entries):
+        cart, error = parse_batch_order(entry)
+        results.append({'index': index, 'status': 'rejected', 'error': error} if error else {'index': index})
+        if not error:
+            parsed.append((index, entry, cart))
+
+    try:
+        # Общий снимок: товары, рецептуры, ключи и клиенты — по одному запросу
+        product_ids = {pid for _, _, cart in parsed for pid in cart}
+        products = {p.product_id: p for p in Product.query.filter(Product.product_id.in_(product_ids)).all()} if product_ids else {}
+        recipes = load_recipes(product_ids)
+
+        keys = {entry['idempotency_key'] for _, entry, _ in parsed if entry.get('idempotency_key')}
+        known_keys = {}
+        if keys:
+            cutoff = datetime.now() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'])
+            own_keys = (IdempotencyKey.user_id == current_user.user_id, IdempotencyKey.idempotency_key.in_(keys))
+            IdempotencyKey.query.filter(*own_keys, IdempotencyKey.created_at < cutoff).delete(synchronize_session=False)
+            known_keys = dict(db.session.query(IdempotencyKey.idempotency_key, IdempotencyKey.order_id).filter(
+                *own_keys).all())
+
+        phones = {entry['customer_phone'] for _, entry, _ in parsed if entry.get('customer_phone')}
+        customers = {phone: cached[0] for phone in phones if (cached := customer_cache.get(phone)) is not None}
+        unknown_phones = phones - customers.keys()
+        if unknown_phones:
+            customers.update(db.session.query(Customer.phone, Customer.customer_id).filter(
+                Customer.phone.in_(unknown_phones)).all())
+
+        # Последовательная проверка заказов против общего снимка остатков
+        stock = {}
+        batch_requirements = {}
+        accepted = []
+        batch_keys = {}
+        for index, entry, cart in parsed:
+            result = results[index]
+            key = entry.get('idempotency_key')
+            if key in known_keys:
+                result.update(status='duplicate', order_id=known_keys[key])
+                continue
+            if key in batch_keys:
+                result.update(status='duplicate', duplicate_of=batch_keys[key])
+                continue
+
+            unknown = sorted(pid for pid in cart if pid not in products)
+            if unknown:
+                result.update(status='rejected', error=f"Unknown products: {', '.join(map(str, unknown))}")
+                continue
+
+            requirements = cart_requirements(cart, recipes)
+            shortages = []
+            for ingredient_id, entry_req in requirements.items():
+                ingredient = entry_req['ingredient']
+                have = stock.setdefault(ingredient_id, ingredient.stock_quantity)
+                if have < entry_req['required']:
+                    shortages.append(shortage_reason(ingredient.ingredient_name, entry_req['required'], ingredient.unit, have))
+            if shortages:
+                result.update(status='rejected', error='; '.join(shortages))
+                continue
+
+            weight = order_weight(cart, products)
+            employee_id = employee_scheduler.assign(weight)
+            if employee_id is None:
+                result.update(status='rejected', error='No active employees available')
+                continue
+
+            for ingredient_id, entry_req in requirements.items():
+                stock[ingredient_id] -= entry_req['required']
+                total_req = batch_requirements.setdefault(ingredient_id, {
+                    'ingredient': entry_req['ingredient'],
+                    'required': Decimal('0'),
+                    'product_ids': []
+                })
+                total_req['required'] += entry_req['required']
+                total_req['product_ids'].extend(entry_req['product_ids'])
+
+            phone = entry.get('customer_phone')
+            if phone and phone not in customers and entry.get('customer_name'):
+                customers[phone] = find_or_create_customer(phone, entry['customer_name'])[0]
+            if key:
+                batch_keys[key] = index
+            accepted.append((index, entry, cart, employee_id, weight))
+
+        if accepted:
+            order_rows = []
+            for index, entry, cart, employee_id, weight in accepted:
+                order_rows.append({
+                    'user_id': current_user.user_id,
+                    'customer_id': customers.get(entry.get('customer_phone')),
+                    'employee_id': employee_id,
+                    'payment_method': entry['payment_method'],
+                    'notes': entry.get('notes'),
+                    'status': 'pending',
+                    'total_amount': sum((products[pid].price * qty for pid, qty in cart.items()), Decimal('0'))
+                })
+            order_ids = db.session.execute(
+                db.insert(Order).returning(Order.order_id, sort_by_parameter_order=True), order_rows
+            ).scalars().all()
+
+            item_rows = []
+            key_rows = []
+            for order_id, row, (index, entry, cart, employee_id, weight) in zip(order_ids, order_rows, accepted):
+                for pid, qty in cart.items():
+                    item_rows.append({
+                        'order_id': order_id,
+                        'product_id': pid,
+                        'quantity': qty,
+                        'unit_price': products[pid].price,
+                        'subtotal': products[pid].price * qty
+                    })
+                if entry.get('idempotency_key'):
+                    key_rows.append({'user_id': current_user.user_id,
+                                     'idempotency_key': entry['idempotency_key'], 'order_id': order_id})
+                results[index].update(status='created', order_id=order_id,
+                                      employee_id=employee_id, total_amount=float(row['total_amount']))
+            db.session.execute(db.insert(OrderItem), item_rows)
+            if key_rows:
+                db.session.execute(db.insert(IdempotencyKey), key_rows)
+
+            # Списываем суммарное количество по всем заказам пачки
+            success, error = deduct_cart_ingredients(batch_requirements)
+            if not success:
+                return jsonify({'success': False, 'error': f'Stock changed during batch, retry: {error}'}), 409
+
+            update_product_availability(batch_requirements.keys(), commit=False)
+            # Core INSERT минует flush-события ORM; заказы пачки вставляются в
+            # 'pending', поэтому дневные итоги и sales_cache не меняются
+            db.session.info['counts_dirty'] = True  # а счётчики таблиц сбрасываются явно
+            create_notification(
+                title=f'🛒 Пакет заказов: {len(accepted)}',
+                message=f"Заказы #{', #'.join(map(str, order_ids))} | Сумма: ${float(sum(r['total_amount'] for r in order_rows)):.2f}",
+                category='order', level='info',
+                created_by=current_user.username,
+                commit=False
+            )
+            enqueue_telegram(f"""
+🛒 <b>ПАКЕТ ЗАКАЗОВ С POS: {len(accepted)}</b>
+
+💰 <b>Сумма:</b> ${float(sum(r['total_amount'] for r in order_rows)):.2f}
+<b>Заказы:</b> #{', #'.join(map(str, order_ids))}
+
+⏰ {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
+""")
+            db.session.commit()
+
+            for order_id, (index, entry, cart, employee_id, weight) in zip(order_ids, accepted):
+                employee_scheduler.track(order_id, employee_id, weight)
+
+        # Дубликаты внутри пачки ссылаются на заказ, созданный первым вхождением
+        for result in results:
+            if 'duplicate_of' in result:
+                result['order_id'] = results[result['duplicate_of']].get('order_id')
+
+    except IntegrityError as e:
+        db.session.rollback()
+        violation = integrity_violation(e)
+        if violation == 'idempotency_key':
+            return jsonify({'success': False, 'error': 'Idempotency key used concurrently, retry'}), 409
+        print(f"[ERROR] batch orders: {e}")
+        if violation == 'foreign_key':
+            # customer_id из LRU мог быть удалён в другом воркере
+            for _, entry, _ in parsed:
+                customer_cache.pop(entry.get('customer_phone'))
+            return jsonify({'success': False, 'error': 'Customer, product or employee no longer exists, retry'}), 409
+        return jsonify({'success': False, 'error': 'Failed to create orders'}), 500
     except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        db.session.rollback()
+        print(f"[ERROR] batch orders: {e}")
+        return jsonify({'success': False, 'error': 'Failed to create orders'}), 500
 
-@app.route('/api/search/customers')
-def api_search_customers():
-    """API: Full-text search for customers"""
+    return jsonify({
+        'success': True,
+        'created': sum(1 for r in results if r['status'] == 'created'),
+        'duplicates': sum(1 for r in results if r['status'] == 'duplicate'),
+        'rejected': sum(1 for r in results if r['status'] == 'rejected'),
+        'results': results
+    })
+
+SEARCH_PAGE_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+def encode_search_cursor(values):
+    """Ключ сортировки последней строки -> непрозрачный курсор для ?cursor="""
+    return base64.urlsafe_b64encode(json.dumps(values).encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_search_cursor(cursor, size):
+    """Курсор -> список значений after_* (ValueError, если курсор испорчен)"""
+    values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    if not isinstance(values, list) or len(values) != size:
+        raise ValueError('Invalid cursor')
+    return values
+
+def run_search(entity, query, limit, after=None, owner_id=None):
+    """
+    Вызвать search_*() сущности и вернуть не больше limit строк.
+
+    after — значения after_* (ключ сортировки последней строки предыдущей
+    страницы) или None для первой страницы. owner_id — только заказы этого
+    пользователя (см. search_owner); передаётся лишь сущностям с access 'owner'.
+    """
+    cursor_params = SEARCH_ENTITIES[entity]['cursor']
+    names = [name for name, _ in cursor_params]
+    params = {'query': query, 'limit': limit, **dict(zip(names, after or [None] * len(names)))}
+    if SEARCH_ENTITIES[entity]['access'] == 'owner':
+        cursor_params = cursor_params + (('owner_id', 'INTEGER'),)
+        params['owner_id'] = owner_id
+    # Явные типы: иначе драйвер передаёт float как double precision и
+    # PostgreSQL не находит перегрузку функции
+    arguments = ', '.join(f"CAST(:{name} AS {sql_type})" for name, sql_type in cursor_params)
+    result = db.session.execute(
+        db.text(f"SELECT * FROM {SEARCH_ENTITIES[entity]['function']}(:query, CAST(:limit AS INTEGER), {arguments})"),
+        params
+    )
+    return result.fetchmany(limit)
+
+def search_page(entity):
+    """
+    Одна страница /api/search/<entity> в JSON.
+
+    limit и keyset-курсор передаются в SQL-функцию, поэтому широкий запрос
+    ("completed") читает не больше limit + 1 строк.
+    """
+    if not search_allowed(entity):
+        return jsonify({'success': False, 'error': 'Forbidden'}), 403
     query = request.args.get('q', '')
     if not query:
         return jsonify({'error': 'Search query is required'}), 400
-    
+    limit = parse_search_limit()
+    if limit is None:
+        return jsonify({'success': False, 'error': f'limit must be between 1 and {SEARCH_MAX_LIMIT}'}), 400
+
+    after = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after = decode_search_cursor(cursor, len(SEARCH_ENTITIES[entity]['cursor']))
+        except (ValueError, TypeError):
+            return jsonify({'success': False, 'error': 'Invalid cursor'}), 400
+
     try:
-        result = db.session.execute(
-            db.text("SELECT * FROM search_customers(:query)"),
-            {'query': query}
-        )
-        customers = []
-        for row in result:
-            customers.append({
-                'customer_id': row[0],
-                'full_name': row[1],
-                'phone': row[2],
-                'email': row[3],
-                'loyalty_points': row[4],
-                'relevance': float(row[5]) if row[5] else 0
-            })
-        return jsonify({'success': True, 'results': customers, 'count': len(customers)})
+        rows = run_search(entity, query, limit + 1, after, owner_id=search_owner(entity))
+        page = rows[:limit]
+        serialize, sort_key = SEARCH_ENTITIES[entity]['serialize'], SEARCH_ENTITIES[entity]['sort_key']
+        return jsonify({
+            'success': True,
+            'results': [serialize(row) for row in page],
+            'count': len(page),
+            'next_cursor': encode_search_cursor(sort_key(page[-1])) if len(rows) > limit else None
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+def parse_search_limit():
+    """?limit= в пределах 1..SEARCH_MAX_LIMIT или None"""
+    try:
+        limit = int(request.args.get('limit', SEARCH_PAGE_LIMIT))
+    except ValueError:
+        return None
+    return limit if 1 <= limit <= SEARCH_MAX_LIMIT else None
+
+# (relevance, имя, id) — порядок сортировки search_products/customers/employees
+NAME_CURSOR = (('after_relevance', 'REAL'), ('after_name', 'TEXT'), ('after_id', 'INTEGER'))
+
+# Сущность -> SQL-функция, аргументы курсора, строка -> JSON, строка -> курсор
+SEARCH_ENTITIES = {
+    'products': {
+        'function': 'search_products',
+        'access': 'public',
+        'cursor': NAME_CURSOR,
+        'serialize': lambda row: {
+            'product_id': row[0],
+            'product_name': row[1],
+            'category_name': row[2],
+            'price': float(row[3]) if row[3] else 0,
+            'description': row[4],
+            'relevance': float(row[5]) if row[5] else 0
+        },
+        'sort_key': lambda row: [row[5], row[1], row[0]],
+    },
+    'customers': {
+        'function': 'search_customers',
+        'access': 'admin',
+        'cursor': NAME_CURSOR,
+        'serialize': lambda row: {
+            'customer_id': row[0],
+            'full_name': row[1],
+            'phone': row[2],
+            'email': row[3],
+            'loyalty_points': row[4],
+            'relevance': float(row[5]) if row[5] else 0
+        },
+        'sort_key': lambda row: [row[5], row[1], row[0]],
+    },
+    'orders': {
+        'function': 'search_orders',
+        'access': 'owner',
+        'cursor': (('after_relevance', 'REAL'), ('after_date', 'TIMESTAMP'), ('after_id', 'INTEGER')),
+        'serialize': lambda row: {
+            'order_id': row[0],
+            'order_date': row[1].isoformat() if row[1] else None,
+            'customer_name': row[2],
+            'employee_name': row[3],
+            'total_amount': float(row[4]) if row[4] else 0,
+            'status': row[5],
+            'payment_method': row[6],
+            'relevance': float(row[7]) if row[7] else 0
+        },
+        'sort_key': lambda row: [row[7], row[1].isoformat(), row[0]],
+    },
+    'employees': {
+        'function': 'search_employees',
+        'access': 'admin',
+        'cursor': NAME_CURSOR,
+        'serialize': lambda row: {
+            'employee_id': row[0],
+            'full_name': row[1],
+            'position_name': row[2],
+            'phone': row[3],
+            'email': row[4],
+            'salary': float(row[5]) if row[5] else 0,
+            'relevance': float(row[6]) if row[6] else 0
+        },
+        'sort_key': lambda row: [row[6], row[1], row[0]],
+    },
+}
+
+def search_allowed(entity):
+    """Доступ к сущности поиска: public — всем, owner — после входа, admin — администратору"""
+    access = SEARCH_ENTITIES[entity]['access']
+    if access == 'public':
+        return True
+    if not current_user.is_authenticated:
+        return False
+    return access == 'owner' or current_user.role == 'admin'
+
+def search_owner(entity):
+    """user_id, которым ограничен поиск (как в order_detail: свои заказы), или None — без ограничения"""
+    if SEARCH_ENTITIES[entity]['access'] != 'owner' or current_user.role == 'admin':
+        return None
+    return current_user.user_id
+
+@app.route('/api/search/products')
+def api_search_products():
+    """API: Full-text search for products (?limit=, ?cursor=)"""
+    return search_page('products')
+
+@app.route('/api/search/customers')
+def api_search_customers():
+    """API: Full-text search for customers (?limit=, ?cursor=)"""
+    return search_page('customers')
+
 @app.route('/api/search/orders')
 def api_search_orders():
-    """API: Full-text search for orders"""
-    query = request.args.get('q', '')
-    if not query:
-        return jsonify({'error': 'Search query is required'}), 400
-    
-    try:
-        result = db.session.execute(
-            db.text("SELECT * FROM search_orders(:query)"),
-            {'query': query}
-        )
-        orders = []
-        for row in result:
-            orders.append({
-                'order_id': row[0],
-                'order_date': row[1].isoformat() if row[1] else None,
-                'customer_name': row[2],
-                'employee_name': row[3],
-                'total_amount': float(row[4]) if row[4] else 0,
-                'status': row[5],
-                'payment_method': row[6],
-                'relevance': float(row[7]) if row[7] else 0
-            })
-        return jsonify({'success': True, 'results': orders, 'count': len(orders)})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+    """API: Full-text search for orders (?limit=, ?cursor=)"""
+    return search_page('orders')
 
 @app.route('/api/search/employees')
 def api_search_employees():
-    """API: Full-text search for employees"""
+    """API: Full-text search for employees (?limit=, ?cursor=)"""
+    return search_page('employees')
+
+# Общий пул: каждый поток берёт своё соединение из пула SQLAlchemy
+search_executor = ThreadPoolExecutor(max_workers=app.config['SEARCH_WORKERS'], thread_name_prefix='search')
+
+def _search_entity(entity, query, limit, deadline, owner_id=None):
+    """Поиск одной сущности в отдельном потоке (своя сессия и соединение)"""
+    with app.app_context():
+        try:
+            if db.engine.dialect.name == 'postgresql':
+                # Запрос, не уложившийся в дедлайн, не должен держать соединение
+                db.session.execute(db.text(f"SET LOCAL statement_timeout = {max(int(deadline * 1000), 1)}"))
+            serialize = SEARCH_ENTITIES[entity]['serialize']
+            return [dict(serialize(row), type=entity) for row in run_search(entity, query, limit, owner_id=owner_id)]
+        finally:
+            db.session.remove()
+
+@app.route('/api/search')
+def api_search():
+    """
+    API: поиск сразу по всем сущностям (?types=products,orders&limit=).
+
+    search_*() выполняются параллельно на разных соединениях; ответ
+    собирается не позже SEARCH_DEADLINE: сущности, не успевшие к сроку,
+    перечисляются в timed_out, а результаты остальных сливаются по relevance.
+    Сущности, недоступные вызывающему (search_allowed), не запускаются:
+    аноним ищет только продукты, пользователь — ещё и свои заказы.
+    """
     query = request.args.get('q', '')
     if not query:
         return jsonify({'error': 'Search query is required'}), 400
-    
+    limit = parse_search_limit()
+    if limit is None:
+        return jsonify({'success': False, 'error': f'limit must be between 1 and {SEARCH_MAX_LIMIT}'}), 400
+    types = [t for t in request.args.get('types', ','.join(SEARCH_ENTITIES)).split(',') if t]
+    unknown = [t for t in types if t not in SEARCH_ENTITIES]
+    if unknown or not types:
+        return jsonify({'success': False, 'error': f"Unknown search types: {', '.join(unknown)}"}), 400
+    types = [t for t in types if search_allowed(t)]
+
+    deadline = app.config['SEARCH_DEADLINE']
+    # current_user недоступен в потоках пула — владелец вычисляется здесь
+    futures = {search_executor.submit(_search_entity, entity, query, limit, deadline, search_owner(entity)): entity
+               for entity in dict.fromkeys(types)}
+    done, pending = wait(futures, timeout=deadline)
+
+    results, counts, errors = [], {}, {}
+    for future in done:
+        entity = futures[future]
+        try:
+            rows = future.result()
+        except Exception as e:
+            errors[entity] = str(e)
+            continue
+        counts[entity] = len(rows)
+        results.extend(rows)
+    for future in pending:
+        future.cancel()
+
+    results.sort(key=lambda item: item['relevance'], reverse=True)
+    return jsonify({
+        'success': not errors or bool(counts),
+        'results': results[:limit],
+        'count': min(len(results), limit),
+        'counts': counts,
+        'timed_out': sorted(futures[future] for future in pending),
+        'errors': errors
+    })
+
+@app.route('/api/suggest')
+@query_budget(2)
+def api_suggest():
+    """
+    API: подсказки при наборе (продукты; клиенты — только администратору).
+
+    Параметры: q, type=products,customers, limit (по умолчанию SUGGEST_LIMIT).
+    """
+    query = request.args.get('q', '').strip()
+    is_admin = current_user.is_authenticated and current_user.role == 'admin'
+    scopes = [scope for scope in request.args.get('type', 'products,customers').split(',') if scope]
+    if any(scope not in ('products', 'customers') for scope in scopes):
+        return jsonify({'success': False, 'error': 'type must be products and/or customers'}), 400
+    if 'customers' in scopes and not is_admin:
+        if 'type' in request.args:
+            return jsonify({'success': False, 'error': 'Forbidden'}), 403
+        scopes.remove('customers')
     try:
-        result = db.session.execute(
-            db.text("SELECT * FROM search_employees(:query)"),
-            {'query': query}
-        )
-        employees = []
-        for row in result:
-            employees.append({
-                'employee_id': row[0],
-                'full_name': row[1],
-                'position_name': row[2],
-                'phone': row[3],
-                'email': row[4],
-                'salary': float(row[5]) if row[5] else 0,
-                'relevance': float(row[6]) if row[6] else 0
-            })
-        return jsonify({'success': True, 'results': employees, 'count': len(employees)})
-    except Exception as e:
-        return jsonify({'success': False, 'error': str(e)}), 500
+        limit = min(int(request.args.get('limit', app.config['SUGGEST_LIMIT'])), SUGGEST_MAX_LIMIT)
+    except ValueError:
+        return jsonify({'success': False, 'error': 'limit must be an integer'}), 400
+
+    response = {'success': True, 'query': query}
+    for scope in scopes:
+        response[scope] = suggest(scope, query, limit) if len(query) >= SUGGEST_MIN_LENGTH and limit > 0 else []
+    return jsonify(response)
 
 # ========================================
 # Search Route
@@ -1062,13 +3075,14 @@ def profile_settings():
     return render_template('profile_settings.html')
 
 @app.route('/profile/orders')
+@query_budget(4)
 @login_required
 def profile_orders():
     """User order history"""
     page = request.args.get('page', 1, type=int)
     per_page = 10
     
-    orders = Order.query.filter_by(user_id=current_user.user_id).order_by(
+    orders = Order.query.options(selectinload(Order.order_items)).filter_by(user_id=current_user.user_id).order_by(
         Order.order_date.desc()
     ).paginate(page=page, per_page=per_page, error_out=False)
     
@@ -1114,32 +3128,31 @@ def admin_view_user(user_id):
                          total_spent=total_spent)
 
 @app.route('/admin')
+@query_budget(4)
 @login_required
 @admin_required
 def admin_panel():
     """Admin dashboard"""
-    total_products = Product.query.count()
-    total_users = User.query.count()
-    total_orders = Order.query.count()
-    total_customers = Customer.query.count()
+    counts = table_counts()
     
-    recent_products = Product.query.order_by(Product.created_at.desc()).limit(5).all()
+    recent_products = Product.query.options(joinedload(Product.category)).order_by(Product.created_at.desc()).limit(5).all()
     recent_orders = Order.query.order_by(Order.order_date.desc()).limit(5).all()
     
     return render_template('admin/dashboard.html',
-                         total_products=total_products,
-                         total_users=total_users,
-                         total_orders=total_orders,
-                         total_customers=total_customers,
+                         total_products=counts['products'],
+                         total_users=counts['users'],
+                         total_orders=counts['orders'],
+                         total_customers=counts['customers'],
                          recent_products=recent_products,
                          recent_orders=recent_orders)
 
 @app.route('/admin/products')
+@query_budget(4)
 @login_required
 @admin_required
 def admin_products():
     """Admin: Product management"""
-    products = Product.query.order_by(Product.product_name).all()
+    products = Product.query.options(joinedload(Product.category)).order_by(Product.product_name).all()
     categories = Category.query.all()
     return render_template('admin/products.html', products=products, categories=categories)
 
@@ -1156,30 +3169,22 @@ def admin_product_add():
         preparation_time = request.form.get('preparation_time')
         is_available = request.form.get('is_available') == 'on'
         
-        # Handle image upload
-        image_url = None
-        if 'image' in request.files:
-            file = request.files['image']
-            if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                # Add timestamp to make filename unique
-                filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                file.save(filepath)
-                image_url = f"/static/images/products/{filename}"
-        
         new_product = Product(
             product_name=product_name,
             category_id=category_id,
             price=price,
             description=description,
             preparation_time=preparation_time,
-            is_available=is_available,
-            image_url=image_url
+            is_available=is_available
         )
-        
         db.session.add(new_product)
+        
+        # Handle image upload (stored by content hash)
+        if 'image' in request.files:
+            file = request.files['image']
+            if file and file.filename and allowed_file(file.filename):
+                set_product_image(new_product, store_product_image(file))
+        
         db.session.commit()
         
         create_notification(
@@ -1211,16 +3216,11 @@ def admin_product_edit(product_id):
         product.preparation_time = request.form.get('preparation_time')
         product.is_available = request.form.get('is_available') == 'on'
         
-        # Handle image upload
+        # Handle image upload (stored by content hash)
         if 'image' in request.files:
             file = request.files['image']
             if file and file.filename and allowed_file(file.filename):
-                filename = secure_filename(file.filename)
-                filename = f"{datetime.now().strftime('%Y%m%d%H%M%S')}_{filename}"
-                filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-                os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-                file.save(filepath)
-                product.image_url = f"/static/images/products/{filename}"
+                set_product_image(product, store_product_image(file))
         
         db.session.commit()
         flash(f'Продукт "{product.product_name}" успешно обновлён!', 'success')
@@ -1250,6 +3250,154 @@ def admin_product_delete(product_id):
     flash(f'Продукт "{product_name}" успешно удалён!', 'success')
     return redirect(url_for('admin_products'))
 
+# Колонки выгрузки: (имя, выражение, тип Arrow)
+EXPORT_ORDER_COLUMNS = (
+    ('order_id', Order.order_id, 'int64'),
+    ('order_date', Order.order_date, 'timestamp'),
+    ('status', Order.status, 'string'),
+    ('payment_method', Order.payment_method, 'string'),
+    ('customer_name', Customer.first_name.op('||')(db.literal_column("' '")).op('||')(Customer.last_name), 'string'),
+    ('customer_phone', Customer.phone, 'string'),
+    ('employee_name', Employee.first_name.op('||')(db.literal_column("' '")).op('||')(Employee.last_name), 'string'),
+    ('total_amount', Order.total_amount, 'decimal'),
+    ('notes', Order.notes, 'string'),
+)
+EXPORT_ITEM_COLUMNS = (
+    ('order_item_id', OrderItem.order_item_id, 'int64'),
+    ('product_id', OrderItem.product_id, 'int64'),
+    ('product_name', Product.product_name, 'string'),
+    ('quantity', OrderItem.quantity, 'int64'),
+    ('unit_price', OrderItem.unit_price, 'decimal'),
+    ('subtotal', OrderItem.subtotal, 'decimal'),
+)
+
+def export_query(start, end, status=None, items=False):
+    """SELECT для выгрузки заказов (или позиций) за [start, end) в порядке order_id"""
+    columns = EXPORT_ORDER_COLUMNS + (EXPORT_ITEM_COLUMNS if items else ())
+    stmt = db.select(*(expr.label(name) for name, expr, _ in columns)).select_from(Order).outerjoin(
+        Customer, Order.customer_id == Customer.customer_id
+    ).join(Employee, Order.employee_id == Employee.employee_id).where(
+        Order.order_date >= start, Order.order_date < end
+    )
+    if status:
+        stmt = stmt.where(Order.status == status)
+    if items:
+        stmt = stmt.join(OrderItem, OrderItem.order_id == Order.order_id).join(
+            Product, OrderItem.product_id == Product.product_id
+        ).order_by(Order.order_id, OrderItem.order_item_id)
+    else:
+        stmt = stmt.order_by(Order.order_id)
+    return stmt, columns
+
+def stream_export_chunks(stmt):
+    """
+    Читать результат чанками по EXPORT_CHUNK_SIZE строк.
+
+    yield_per включает server-side cursor (именованный курсор в
+    PostgreSQL), поэтому в памяти воркера не больше одного чанка.
+    """
+    result = db.session.execute(stmt.execution_options(yield_per=app.config['EXPORT_CHUNK_SIZE']))
+    try:
+        yield from result.partitions()
+    finally:
+        result.close()
+
+# Первые символы, с которых Excel/LibreOffice начинают формулу (таб и CR тоже)
+CSV_FORMULA_PREFIXES = ('=', '+', '-', '@', '\t', '\r')
+
+def csv_safe(value):
+    """Строка из пользовательского ввода не должна выполниться как формула: '=1+1 -> \'=1+1"""
+    if isinstance(value, str) and value.startswith(CSV_FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+def export_csv(stmt, columns):
+    """Генератор CSV: заголовок, затем по одному куску текста на чанк"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(name for name, _, _ in columns)
+    for rows in stream_export_chunks(stmt):
+        writer.writerows([csv_safe(value) for value in row] for row in rows)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+    yield buffer.getvalue()
+
+class _ParquetSink(io.RawIOBase):
+    """Файл для ParquetWriter, из которого записанные байты забираются по мере записи"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+def export_parquet(stmt, columns):
+    """Генератор Parquet: каждый чанк — отдельная row group"""
+    arrow_types = {
+        'int64': pa.int64(), 'string': pa.string(),
+        'timestamp': pa.timestamp('us'), 'decimal': pa.decimal128(12, 2),
+    }
+    schema = pa.schema([(name, arrow_types[kind]) for name, _, kind in columns])
+    sink = _ParquetSink()
+    with pq.ParquetWriter(sink, schema) as writer:
+        for rows in stream_export_chunks(stmt):
+            writer.write_table(pa.Table.from_pylist([row._asdict() for row in rows], schema=schema))
+            yield sink.drain()
+    yield sink.drain()
+
+@app.route('/admin/export/orders')
+@login_required
+@admin_required
+def admin_export_orders():
+    """
+    Выгрузка заказов: /admin/export/orders?from=&to=&status=&items=1&format=csv|parquet.
+
+    Ответ отдаётся потоком по мере чтения курсора; items=1 — по строке на
+    позицию заказа. По умолчанию — последние 30 дней.
+    """
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'parquet'):
+        return jsonify({'success': False, 'error': 'format must be csv or parquet'}), 400
+    if export_format == 'parquet' and not PYARROW_AVAILABLE:
+        return jsonify({'success': False, 'error': 'Parquet export requires pyarrow'}), 501
+    status = request.args.get('status') or None
+    if status is not None and status not in ORDER_STATUSES:
+        return jsonify({'success': False, 'error': 'Invalid status'}), 400
+    try:
+        end = parse_range_bound(request.args.get('to'), datetime.now())
+        start = parse_range_bound(request.args.get('from'), end - timedelta(days=30))
+    except ValueError:
+        return jsonify({'success': False, 'error': 'from/to must be ISO 8601 dates'}), 400
+    if start >= end:
+        return jsonify({'success': False, 'error': 'from must be earlier than to'}), 400
+
+    items = request.args.get('items') in ('1', 'true')
+    stmt, columns = export_query(start, end, status, items)
+    filename = f"{'order_items' if items else 'orders'}_{start:%Y%m%d}_{end:%Y%m%d}.{export_format}"
+    if export_format == 'csv':
+        body, mimetype = export_csv(stmt, columns), 'text/csv'
+    else:
+        body, mimetype = export_parquet(stmt, columns), 'application/vnd.apache.parquet'
+    response = Response(stream_with_context(body), mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}"'
+    return response
+
 # ========================================
 # Admin Logs & Notifications
 # ========================================
@@ -1309,6 +3457,7 @@ def admin_logs():
 
     # Mark shown notifications as read
     Notification.query.filter_by(is_read=False).update({'is_read': True})
+    publish_event('notifications_read', {'id': None})
     db.session.commit()
 
     return render_template('admin/logs.html',
@@ -1333,18 +3482,7 @@ def api_notifications():
     unread_count = Notification.query.filter_by(is_read=False).count()
     recent = Notification.query.order_by(Notification.created_at.desc()).limit(8).all()
 
-    items = []
-    for n in recent:
-        items.append({
-            'id': n.notification_id,
-            'title': n.title,
-            'message': n.message[:80] + '...' if len(n.message) > 80 else n.message,
-            'category': n.category,
-            'level': n.level,
-            'is_read': n.is_read,
-            'created_at': n.created_at.strftime('%d.%m %H:%M'),
-            'created_by': n.created_by
-        })
+    items = [notification_payload(n) for n in recent]
 
     return jsonify({'unread': unread_count, 'notifications': items})
 
@@ -1367,10 +3505,50 @@ def api_notification_read(notif_id):
     if current_user.role != 'admin':
         return jsonify({'error': 'Forbidden'}), 403
     notif = Notification.query.get_or_404(notif_id)
-    notif.is_read = True
+    if not notif.is_read:
+        notif.is_read = True
+        publish_event('notifications_read', {'id': notif_id})
     db.session.commit()
     return jsonify({'status': 'ok'})
 
+@app.route('/api/events')
+@login_required
+def api_events():
+    """
+    SSE: поток событий вместо опроса /api/notifications.
+
+    Администратор получает уведомления и статусы всех заказов, остальные
+    пользователи — только статусы своих заказов. Соединение закрывается
+    через EVENT_STREAM_TIMEOUT секунд, EventSource переподключается сам.
+    """
+    is_admin = current_user.role == 'admin'
+    user_id = current_user.user_id
+    keepalive = app.config['EVENT_STREAM_KEEPALIVE']
+    deadline = time.monotonic() + app.config['EVENT_STREAM_TIMEOUT']
+    subscriber = event_broker.subscribe()
+
+    def visible(event_data):
+        if is_admin:
+            return True
+        return event_data['type'] == 'order_status' and event_data['data'].get('user_id') == user_id
+
+    def stream():
+        try:
+            yield 'retry: 5000\n\n'
+            while time.monotonic() < deadline:
+                try:
+                    event_data = subscriber.get(timeout=keepalive)
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+                    continue
+                if visible(event_data):
+                    yield f"event: {event_data['type']}\ndata: {json.dumps(event_data['data'])}\n\n"
+        finally:
+            event_broker.unsubscribe(subscriber)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ========================================
 # Обработчики ошибок
 # ========================================
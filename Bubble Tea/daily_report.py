@@ -79,40 +79,27 @@ def get_database_stats():
     
     stats = {}
     
-    # Количество заказов
-    cursor.execute("SELECT COUNT(*) FROM orders;")
-    stats['total_orders'] = cursor.fetchone()[0]
-    
-    # Количество клиентов
-    cursor.execute("SELECT COUNT(*) FROM customers;")
-    stats['total_customers'] = cursor.fetchone()[0]
-    
-    # Количество товаров
-    cursor.execute("SELECT COUNT(*) FROM products;")
-    stats['total_products'] = cursor.fetchone()[0]
-    
-    # Количество пользователей
-    cursor.execute("SELECT COUNT(*) FROM users;")
-    stats['total_users'] = cursor.fetchone()[0]
-    
-    # Размер базы данных
-    cursor.execute("SELECT pg_size_pretty(pg_database_size(current_database()));")
-    stats['db_size'] = cursor.fetchone()[0]
-    
-    # Заказы за последние 24 часа
+    # Счётчики таблиц, размер БД и итоги за 24 часа — одним запросом
     cursor.execute("""
-        SELECT COUNT(*) FROM orders 
-        WHERE order_date >= NOW() - INTERVAL '24 hours';
+        SELECT
+            (SELECT COUNT(*) FROM orders),
+            (SELECT COUNT(*) FROM customers),
+            (SELECT COUNT(*) FROM products),
+            (SELECT COUNT(*) FROM users),
+            pg_size_pretty(pg_database_size(current_database())),
+            recent.orders_24h,
+            recent.revenue_24h,
+            (SELECT COUNT(*) FROM ingredients WHERE stock_quantity <= min_quantity)
+        FROM (
+            SELECT COUNT(*) AS orders_24h,
+                   COALESCE(SUM(total_amount) FILTER (WHERE status = 'completed'), 0) AS revenue_24h
+            FROM orders
+            WHERE order_date >= NOW() - INTERVAL '24 hours'
+        ) recent;
     """)
-    stats['orders_24h'] = cursor.fetchone()[0]
-    
-    # Выручка за последние 24 часа
-    cursor.execute("""
-        SELECT COALESCE(SUM(total_amount), 0) FROM orders 
-        WHERE order_date >= NOW() - INTERVAL '24 hours' 
-        AND status = 'completed';
-    """)
-    stats['revenue_24h'] = float(cursor.fetchone()[0])
+    (stats['total_orders'], stats['total_customers'], stats['total_products'], stats['total_users'],
+     stats['db_size'], stats['orders_24h'], revenue_24h, stats['low_stock_items']) = cursor.fetchone()
+    stats['revenue_24h'] = float(revenue_24h)
     
     # Топ 3 товара за последние 24 часа
     cursor.execute("""
@@ -127,13 +114,6 @@ def get_database_stats():
     """)
     stats['top_products'] = cursor.fetchall()
     
-    # Ингредиенты с низким остатком
-    cursor.execute("""
-        SELECT COUNT(*) FROM ingredients 
-        WHERE stock_quantity <= min_quantity;
-    """)
-    stats['low_stock_items'] = cursor.fetchone()[0]
-    
     cursor.close()
     conn.close()
     
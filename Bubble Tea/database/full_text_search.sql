@@ -3,21 +3,49 @@
 -- PostgreSQL 17 - расширенный текстовый поиск
 -- ========================================
 
+-- Векторы поиска хранятся в колонках search_vector и пересчитываются
+-- триггерами при изменении исходных полей, а не в каждом запросе.
+-- Веса: A — имя/номер, B — основные атрибуты, C — контакты/статус, D — заметки.
+
 -- ========================================
 -- 1. Поиск по продуктам
 -- ========================================
 
--- Создаем GIN индекс для полнотекстового поиска по продуктам
-CREATE INDEX IF NOT EXISTS idx_products_fulltext 
-ON products USING gin(
-    to_tsvector('english', 
-        product_name || ' ' || 
-        COALESCE(description, '')
-    )
-);
+ALTER TABLE products ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION products_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', NEW.product_name), 'A') ||
+        setweight(to_tsvector('english', COALESCE(NEW.description, '')), 'B');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_products_search_vector ON products;
+CREATE TRIGGER trg_products_search_vector
+    BEFORE INSERT OR UPDATE OF product_name, description ON products
+    FOR EACH ROW EXECUTE FUNCTION products_search_vector_update();
+
+-- Заполнить существующие строки (триггер срабатывает на UPDATE OF product_name)
+UPDATE products SET product_name = product_name WHERE search_vector IS NULL;
 
--- Создаем функцию для поиска продуктов
-CREATE OR REPLACE FUNCTION search_products(search_query TEXT)
+-- GIN индекс по хранимой колонке (заменяет индекс по выражению)
+DROP INDEX IF EXISTS idx_products_fulltext;
+CREATE INDEX idx_products_fulltext ON products USING gin(search_vector);
+
+-- Функция поиска продуктов: страница из result_limit строк.
+-- Keyset-курсор (after_*) — ключ сортировки последней строки предыдущей
+-- страницы, поэтому следующая страница не пересчитывает OFFSET
+DROP FUNCTION IF EXISTS search_products(TEXT);
+CREATE OR REPLACE FUNCTION search_products(
+    search_query TEXT,
+    result_limit INTEGER DEFAULT 50,
+    after_relevance REAL DEFAULT NULL,
+    after_name TEXT DEFAULT NULL,
+    after_id INTEGER DEFAULT NULL
+)
 RETURNS TABLE (
     product_id INTEGER,
     product_name VARCHAR(100),
@@ -28,21 +56,24 @@ RETURNS TABLE (
 ) AS $$
 BEGIN
     RETURN QUERY
-    SELECT 
-        p.product_id,
-        p.product_name,
-        c.category_name,
-        p.price,
-        p.description,
-        ts_rank(
-            to_tsvector('english', p.product_name || ' ' || COALESCE(p.description, '')),
-            plainto_tsquery('english', search_query)
-        ) as relevance
-    FROM products p
-    JOIN categories c ON p.category_id = c.category_id
-    WHERE to_tsvector('english', p.product_name || ' ' || COALESCE(p.description, '')) 
-        @@ plainto_tsquery('english', search_query)
-    ORDER BY relevance DESC, p.product_name;
+    SELECT r.product_id, r.product_name, r.category_name, r.price, r.description, r.relevance
+    FROM (
+        SELECT 
+            p.product_id,
+            p.product_name,
+            c.category_name,
+            p.price,
+            p.description,
+            ts_rank(p.search_vector, plainto_tsquery('english', search_query)) as relevance
+        FROM products p
+        JOIN categories c ON p.category_id = c.category_id
+        WHERE p.search_vector @@ plainto_tsquery('english', search_query)
+    ) r
+    WHERE after_relevance IS NULL
+        OR r.relevance < after_relevance
+        OR (r.relevance = after_relevance AND (r.product_name, r.product_id) > (after_name, after_id))
+    ORDER BY r.relevance DESC, r.product_name, r.product_id
+    LIMIT result_limit;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -50,19 +81,37 @@ $$ LANGUAGE plpgsql;
 -- 2. Поиск по клиентам
 -- ========================================
 
--- GIN индекс для поиска клиентов
-CREATE INDEX IF NOT EXISTS idx_customers_fulltext 
-ON customers USING gin(
-    to_tsvector('english', 
-        first_name || ' ' || 
-        last_name || ' ' || 
-        COALESCE(phone, '') || ' ' ||
-        COALESCE(email, '')
-    )
-);
+ALTER TABLE customers ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION customers_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', NEW.first_name || ' ' || NEW.last_name), 'A') ||
+        setweight(to_tsvector('english', COALESCE(NEW.phone, '') || ' ' || COALESCE(NEW.email, '')), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_customers_search_vector ON customers;
+CREATE TRIGGER trg_customers_search_vector
+    BEFORE INSERT OR UPDATE OF first_name, last_name, phone, email ON customers
+    FOR EACH ROW EXECUTE FUNCTION customers_search_vector_update();
 
--- Функция поиска клиентов
-CREATE OR REPLACE FUNCTION search_customers(search_query TEXT)
+UPDATE customers SET first_name = first_name WHERE search_vector IS NULL;
+
+DROP INDEX IF EXISTS idx_customers_fulltext;
+CREATE INDEX idx_customers_fulltext ON customers USING gin(search_vector);
+
+-- Функция поиска клиентов (страница + keyset-курсор)
+DROP FUNCTION IF EXISTS search_customers(TEXT);
+CREATE OR REPLACE FUNCTION search_customers(
+    search_query TEXT,
+    result_limit INTEGER DEFAULT 50,
+    after_relevance REAL DEFAULT NULL,
+    after_name TEXT DEFAULT NULL,
+    after_id INTEGER DEFAULT NULL
+)
 RETURNS TABLE (
     customer_id INTEGER,
     full_name TEXT,
@@ -74,24 +123,24 @@ RETURNS TABLE (
 BEGIN
     RETURN QUERY
     SELECT 
-        c.customer_id,
-        (c.first_name || ' ' || c.last_name) as full_name,
-        c.phone,
-        c.email,
-        c.loyalty_points,
-        ts_rank(
-            to_tsvector('english', 
-                c.first_name || ' ' || c.last_name || ' ' || 
-                COALESCE(c.phone, '') || ' ' || COALESCE(c.email, '')
-            ),
-            plainto_tsquery('english', search_query)
-        ) as relevance
-    FROM customers c
-    WHERE to_tsvector('english', 
-            c.first_name || ' ' || c.last_name || ' ' || 
-            COALESCE(c.phone, '') || ' ' || COALESCE(c.email, '')
-        ) @@ plainto_tsquery('english', search_query)
-    ORDER BY relevance DESC, c.last_name, c.first_name;
+        r.customer_id,
+        (r.first_name || ' ' || r.last_name) as full_name,
+        r.phone,
+        r.email,
+        r.loyalty_points,
+        r.relevance
+    FROM (
+        SELECT 
+            c.customer_id, c.first_name, c.last_name, c.phone, c.email, c.loyalty_points,
+            ts_rank(c.search_vector, plainto_tsquery('english', search_query)) as relevance
+        FROM customers c
+        WHERE c.search_vector @@ plainto_tsquery('english', search_query)
+    ) r
+    WHERE after_relevance IS NULL
+        OR r.relevance < after_relevance
+        OR (r.relevance = after_relevance AND (r.first_name || ' ' || r.last_name, r.customer_id) > (after_name, after_id))
+    ORDER BY r.relevance DESC, r.first_name || ' ' || r.last_name, r.customer_id
+    LIMIT result_limit;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -99,19 +148,101 @@ $$ LANGUAGE plpgsql;
 -- 3. Поиск по заказам
 -- ========================================
 
--- GIN индекс для поиска заказов
-CREATE INDEX IF NOT EXISTS idx_orders_fulltext 
-ON orders USING gin(
-    to_tsvector('english', 
-        order_id::TEXT || ' ' || 
-        status || ' ' ||
-        payment_method || ' ' ||
-        COALESCE(notes, '')
-    )
-);
+-- Имена клиента и сотрудника денормализованы в вектор заказа,
+-- чтобы поиск шёл только по индексу orders без JOIN
+ALTER TABLE orders ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION build_order_search_vector(
+    p_order_id INTEGER,
+    p_status VARCHAR,
+    p_payment_method VARCHAR,
+    p_notes TEXT,
+    p_customer_id INTEGER,
+    p_employee_id INTEGER
+)
+RETURNS tsvector AS $$
+    SELECT
+        setweight(to_tsvector('english', p_order_id::TEXT), 'A') ||
+        setweight(to_tsvector('english',
+            COALESCE((SELECT cu.first_name || ' ' || cu.last_name
+                      FROM customers cu WHERE cu.customer_id = p_customer_id), '') || ' ' ||
+            COALESCE((SELECT e.first_name || ' ' || e.last_name
+                      FROM employees e WHERE e.employee_id = p_employee_id), '')
+        ), 'B') ||
+        setweight(to_tsvector('english', p_status || ' ' || p_payment_method), 'C') ||
+        setweight(to_tsvector('english', COALESCE(p_notes, '')), 'D');
+$$ LANGUAGE sql STABLE;
+
+CREATE OR REPLACE FUNCTION orders_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector := build_order_search_vector(
+        NEW.order_id, NEW.status, NEW.payment_method, NEW.notes,
+        NEW.customer_id, NEW.employee_id
+    );
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_orders_search_vector ON orders;
+CREATE TRIGGER trg_orders_search_vector
+    BEFORE INSERT OR UPDATE OF status, payment_method, notes, customer_id, employee_id ON orders
+    FOR EACH ROW EXECUTE FUNCTION orders_search_vector_update();
+
+-- Переименование клиента/сотрудника пересчитывает векторы его заказов
+-- (UPDATE только search_vector не вызывает триггер orders повторно)
+CREATE OR REPLACE FUNCTION orders_search_vector_refresh_names()
+RETURNS TRIGGER AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'customers' THEN
+        UPDATE orders o
+        SET search_vector = build_order_search_vector(
+            o.order_id, o.status, o.payment_method, o.notes, o.customer_id, o.employee_id)
+        WHERE o.customer_id = NEW.customer_id;
+    ELSE
+        UPDATE orders o
+        SET search_vector = build_order_search_vector(
+            o.order_id, o.status, o.payment_method, o.notes, o.customer_id, o.employee_id)
+        WHERE o.employee_id = NEW.employee_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_customers_refresh_order_search ON customers;
+CREATE TRIGGER trg_customers_refresh_order_search
+    AFTER UPDATE OF first_name, last_name ON customers
+    FOR EACH ROW
+    WHEN (OLD.first_name IS DISTINCT FROM NEW.first_name OR OLD.last_name IS DISTINCT FROM NEW.last_name)
+    EXECUTE FUNCTION orders_search_vector_refresh_names();
 
--- Функция поиска заказов
-CREATE OR REPLACE FUNCTION search_orders(search_query TEXT)
+DROP TRIGGER IF EXISTS trg_employees_refresh_order_search ON employees;
+CREATE TRIGGER trg_employees_refresh_order_search
+    AFTER UPDATE OF first_name, last_name ON employees
+    FOR EACH ROW
+    WHEN (OLD.first_name IS DISTINCT FROM NEW.first_name OR OLD.last_name IS DISTINCT FROM NEW.last_name)
+    EXECUTE FUNCTION orders_search_vector_refresh_names();
+
+UPDATE orders o
+SET search_vector = build_order_search_vector(
+    o.order_id, o.status, o.payment_method, o.notes, o.customer_id, o.employee_id)
+WHERE o.search_vector IS NULL;
+
+DROP INDEX IF EXISTS idx_orders_fulltext;
+CREATE INDEX idx_orders_fulltext ON orders USING gin(search_vector);
+
+-- Функция поиска заказов: JOIN только для строк страницы (имена в выдаче).
+-- owner_id ограничивает выдачу заказами пользователя (NULL — все, для администратора)
+DROP FUNCTION IF EXISTS search_orders(TEXT);
+DROP FUNCTION IF EXISTS search_orders(TEXT, INTEGER, REAL, TIMESTAMP, INTEGER);
+CREATE OR REPLACE FUNCTION search_orders(
+    search_query TEXT,
+    result_limit INTEGER DEFAULT 50,
+    after_relevance REAL DEFAULT NULL,
+    after_date TIMESTAMP DEFAULT NULL,
+    after_id INTEGER DEFAULT NULL,
+    owner_id INTEGER DEFAULT NULL
+)
 RETURNS TABLE (
     order_id INTEGER,
     order_date TIMESTAMP,
@@ -125,36 +256,34 @@ RETURNS TABLE (
 BEGIN
     RETURN QUERY
     SELECT 
-        o.order_id,
-        o.order_date,
+        r.order_id,
+        r.order_date,
         COALESCE(cu.first_name || ' ' || cu.last_name, 'Guest') as customer_name,
         e.first_name || ' ' || e.last_name as employee_name,
-        o.total_amount,
-        o.status,
-        o.payment_method,
-        ts_rank(
-            to_tsvector('english', 
-                o.order_id::TEXT || ' ' || 
-                o.status || ' ' || 
-                o.payment_method || ' ' ||
-                COALESCE(o.notes, '') || ' ' ||
-                COALESCE(cu.first_name || ' ' || cu.last_name, '') || ' ' ||
-                e.first_name || ' ' || e.last_name
-            ),
-            plainto_tsquery('english', search_query)
-        ) as relevance
-    FROM orders o
-    LEFT JOIN customers cu ON o.customer_id = cu.customer_id
-    JOIN employees e ON o.employee_id = e.employee_id
-    WHERE to_tsvector('english', 
-            o.order_id::TEXT || ' ' || 
-            o.status || ' ' || 
-            o.payment_method || ' ' ||
-            COALESCE(o.notes, '') || ' ' ||
-            COALESCE(cu.first_name || ' ' || cu.last_name, '') || ' ' ||
-            e.first_name || ' ' || e.last_name
-        ) @@ plainto_tsquery('english', search_query)
-    ORDER BY relevance DESC, o.order_date DESC;
+        r.total_amount,
+        r.status,
+        r.payment_method,
+        r.relevance
+    FROM (
+        SELECT m.*
+        FROM (
+            SELECT 
+                o.order_id, o.order_date, o.customer_id, o.employee_id,
+                o.total_amount, o.status, o.payment_method,
+                ts_rank(o.search_vector, plainto_tsquery('english', search_query)) as relevance
+            FROM orders o
+            WHERE o.search_vector @@ plainto_tsquery('english', search_query)
+                AND (owner_id IS NULL OR o.user_id = owner_id)
+        ) m
+        WHERE after_relevance IS NULL
+            OR m.relevance < after_relevance
+            OR (m.relevance = after_relevance AND (m.order_date, m.order_id) < (after_date, after_id))
+        ORDER BY m.relevance DESC, m.order_date DESC, m.order_id DESC
+        LIMIT result_limit
+    ) r
+    LEFT JOIN customers cu ON r.customer_id = cu.customer_id
+    JOIN employees e ON r.employee_id = e.employee_id
+    ORDER BY r.relevance DESC, r.order_date DESC, r.order_id DESC;
 END;
 $$ LANGUAGE plpgsql;
 
@@ -162,19 +291,56 @@ $$ LANGUAGE plpgsql;
 -- 4. Поиск по сотрудникам
 -- ========================================
 
--- GIN индекс для поиска сотрудников
-CREATE INDEX IF NOT EXISTS idx_employees_fulltext 
-ON employees USING gin(
-    to_tsvector('english', 
-        first_name || ' ' || 
-        last_name || ' ' ||
-        COALESCE(phone, '') || ' ' ||
-        COALESCE(email, '')
-    )
-);
+-- Название должности денормализовано в вектор сотрудника
+ALTER TABLE employees ADD COLUMN IF NOT EXISTS search_vector tsvector;
+
+CREATE OR REPLACE FUNCTION employees_search_vector_update()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('english', NEW.first_name || ' ' || NEW.last_name), 'A') ||
+        setweight(to_tsvector('english', COALESCE(
+            (SELECT p.position_name FROM positions p WHERE p.position_id = NEW.position_id), '')), 'B') ||
+        setweight(to_tsvector('english', COALESCE(NEW.phone, '') || ' ' || COALESCE(NEW.email, '')), 'C');
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_employees_search_vector ON employees;
+CREATE TRIGGER trg_employees_search_vector
+    BEFORE INSERT OR UPDATE OF first_name, last_name, phone, email, position_id ON employees
+    FOR EACH ROW EXECUTE FUNCTION employees_search_vector_update();
+
+-- Переименование должности пересчитывает векторы её сотрудников
+CREATE OR REPLACE FUNCTION positions_refresh_employee_search()
+RETURNS TRIGGER AS $$
+BEGIN
+    UPDATE employees SET position_id = position_id WHERE position_id = NEW.position_id;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_positions_refresh_employee_search ON positions;
+CREATE TRIGGER trg_positions_refresh_employee_search
+    AFTER UPDATE OF position_name ON positions
+    FOR EACH ROW
+    WHEN (OLD.position_name IS DISTINCT FROM NEW.position_name)
+    EXECUTE FUNCTION positions_refresh_employee_search();
+
+UPDATE employees SET first_name = first_name WHERE search_vector IS NULL;
 
--- Функция поиска сотрудников
-CREATE OR REPLACE FUNCTION search_employees(search_query TEXT)
+DROP INDEX IF EXISTS idx_employees_fulltext;
+CREATE INDEX idx_employees_fulltext ON employees USING gin(search_vector);
+
+-- Функция поиска сотрудников (страница + keyset-курсор)
+DROP FUNCTION IF EXISTS search_employees(TEXT);
+CREATE OR REPLACE FUNCTION search_employees(
+    search_query TEXT,
+    result_limit INTEGER DEFAULT 50,
+    after_relevance REAL DEFAULT NULL,
+    after_name TEXT DEFAULT NULL,
+    after_id INTEGER DEFAULT NULL
+)
 RETURNS TABLE (
     employee_id INTEGER,
     full_name TEXT,
@@ -187,48 +353,78 @@ RETURNS TABLE (
 BEGIN
     RETURN QUERY
     SELECT 
-        e.employee_id,
-        (e.first_name || ' ' || e.last_name) as full_name,
+        r.employee_id,
+        (r.first_name || ' ' || r.last_name) as full_name,
         p.position_name,
-        e.phone,
-        e.email,
-        e.salary,
-        ts_rank(
-            to_tsvector('english', 
-                e.first_name || ' ' || e.last_name || ' ' ||
-                COALESCE(e.phone, '') || ' ' || COALESCE(e.email, '') || ' ' ||
-                p.position_name
-            ),
-            plainto_tsquery('english', search_query)
-        ) as relevance
-    FROM employees e
-    JOIN positions p ON e.position_id = p.position_id
-    WHERE to_tsvector('english', 
-            e.first_name || ' ' || e.last_name || ' ' ||
-            COALESCE(e.phone, '') || ' ' || COALESCE(e.email, '') || ' ' ||
-            p.position_name
-        ) @@ plainto_tsquery('english', search_query)
-        AND e.is_active = TRUE
-    ORDER BY relevance DESC, e.last_name, e.first_name;
+        r.phone,
+        r.email,
+        r.salary,
+        r.relevance
+    FROM (
+        SELECT 
+            e.employee_id, e.first_name, e.last_name, e.position_id, e.phone, e.email, e.salary,
+            ts_rank(e.search_vector, plainto_tsquery('english', search_query)) as relevance
+        FROM employees e
+        WHERE e.search_vector @@ plainto_tsquery('english', search_query)
+            AND e.is_active = TRUE
+    ) r
+    JOIN positions p ON r.position_id = p.position_id
+    WHERE after_relevance IS NULL
+        OR r.relevance < after_relevance
+        OR (r.relevance = after_relevance AND (r.first_name || ' ' || r.last_name, r.employee_id) > (after_name, after_id))
+    ORDER BY r.relevance DESC, r.first_name || ' ' || r.last_name, r.employee_id
+    LIMIT result_limit;
 END;
 $$ LANGUAGE plpgsql;
 
 -- ========================================
--- 5. Комментарии
+-- 5. Подсказки при наборе (pg_trgm, /api/suggest)
 -- ========================================
 
-COMMENT ON FUNCTION search_products(TEXT) IS 'Full-text search for products by name and description';
-COMMENT ON FUNCTION search_customers(TEXT) IS 'Full-text search for customers by name, phone, and email';
-COMMENT ON FUNCTION search_orders(TEXT) IS 'Full-text search for orders by ID, status, and customer';
-COMMENT ON FUNCTION search_employees(TEXT) IS 'Full-text search for employees by name, position, and contact';
+-- plainto_tsquery не находит части слов, поэтому для typeahead —
+-- триграммы: ILIKE '%...%' использует эти GIN-индексы
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+-- Только цифры номера: '+7-911-111-1111' -> '79111111111'
+CREATE OR REPLACE FUNCTION phone_digits(phone TEXT)
+RETURNS TEXT AS $$
+    SELECT regexp_replace(phone, '\D', '', 'g');
+$$ LANGUAGE sql IMMUTABLE STRICT;
+
+CREATE INDEX IF NOT EXISTS idx_products_name_trgm
+ON products USING gin(product_name gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_customers_name_trgm
+ON customers USING gin((first_name || ' ' || last_name) gin_trgm_ops);
+
+CREATE INDEX IF NOT EXISTS idx_customers_phone_trgm
+ON customers USING gin(phone_digits(phone) gin_trgm_ops);
+
+-- ========================================
+-- 6. Комментарии
+-- ========================================
+
+COMMENT ON FUNCTION search_products(TEXT, INTEGER, REAL, TEXT, INTEGER) IS 'Full-text search for products by name and description';
+COMMENT ON FUNCTION search_customers(TEXT, INTEGER, REAL, TEXT, INTEGER) IS 'Full-text search for customers by name, phone, and email';
+COMMENT ON FUNCTION search_orders(TEXT, INTEGER, REAL, TIMESTAMP, INTEGER, INTEGER) IS 'Full-text search for orders by ID, status, customer and employee';
+COMMENT ON FUNCTION search_employees(TEXT, INTEGER, REAL, TEXT, INTEGER) IS 'Full-text search for employees by name, position, and contact';
 
 COMMENT ON INDEX idx_products_fulltext IS 'GIN index for full-text search on products';
 COMMENT ON INDEX idx_customers_fulltext IS 'GIN index for full-text search on customers';
 COMMENT ON INDEX idx_orders_fulltext IS 'GIN index for full-text search on orders';
 COMMENT ON INDEX idx_employees_fulltext IS 'GIN index for full-text search on employees';
 
+COMMENT ON INDEX idx_products_name_trgm IS 'Trigram index for typeahead on product names';
+COMMENT ON INDEX idx_customers_name_trgm IS 'Trigram index for typeahead on customer full names';
+COMMENT ON INDEX idx_customers_phone_trgm IS 'Trigram index for partial phone lookup (digits only)';
+
+COMMENT ON COLUMN products.search_vector IS 'Weighted tsvector (name A, description B), maintained by trigger';
+COMMENT ON COLUMN customers.search_vector IS 'Weighted tsvector (name A, contacts C), maintained by trigger';
+COMMENT ON COLUMN orders.search_vector IS 'Weighted tsvector incl. denormalized customer/employee names, maintained by triggers';
+COMMENT ON COLUMN employees.search_vector IS 'Weighted tsvector incl. denormalized position name, maintained by triggers';
+
 -- ========================================
--- 6. Примеры использования
+-- 7. Примеры использования
 -- ========================================
 
 -- Поиск продуктов:
@@ -240,6 +436,13 @@ COMMENT ON INDEX idx_employees_fulltext IS 'GIN index for full-text search on em
 -- Поиск заказов:
 -- SELECT * FROM search_orders('completed card');
 
+-- Следующая страница: ключ сортировки последней строки предыдущей
+-- SELECT * FROM search_orders('completed', 20, 0.0607927, '2024-03-01 12:30:00', 1042);
+
 -- Поиск сотрудников:
 -- SELECT * FROM search_employees('manager');
 
+-- Подсказки по части телефона (как в /api/suggest):
+-- SELECT first_name, last_name, phone FROM customers
+-- WHERE phone_digits(phone) LIKE '%1111%' LIMIT 8;
+
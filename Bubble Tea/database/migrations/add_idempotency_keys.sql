@@ -0,0 +1,20 @@
+-- Add Idempotency-Key storage to an existing Bubble Tea database
+-- (new installations get the table from schema.sql)
+
+\echo 'Creating idempotency_keys...'
+
+CREATE TABLE IF NOT EXISTS idempotency_keys (
+    user_id INTEGER NOT NULL DEFAULT 0, -- key owner; 0 = anonymous checkout
+    idempotency_key VARCHAR(255) NOT NULL,
+    order_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    CONSTRAINT fk_idem_order FOREIGN KEY (order_id)
+        REFERENCES orders(order_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys(created_at);
+
+COMMENT ON TABLE idempotency_keys IS 'Idempotency-Key -> order, replayed on retried submissions';
+
+\echo 'Done.'
@@ -0,0 +1,24 @@
+-- Add the transactional outbox to an existing Bubble Tea database
+-- (new installations get the table from schema.sql).
+-- Run before add_product_image_variants.sql, which queues outbox events.
+
+\echo 'Creating outbox_events...'
+
+CREATE TABLE IF NOT EXISTS outbox_events (
+    event_id SERIAL PRIMARY KEY,
+    event_type VARCHAR(30) NOT NULL, -- telegram, image
+    payload TEXT NOT NULL, -- JSON
+    status VARCHAR(20) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    locked_until TIMESTAMP -- lease taken by outbox_dispatcher while delivering
+);
+
+CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox_events(event_id) WHERE status = 'pending';
+
+COMMENT ON TABLE outbox_events IS 'Transactional outbox for order/inventory side effects';
+
+\echo 'Done. Run python outbox_dispatcher.py alongside the app.'
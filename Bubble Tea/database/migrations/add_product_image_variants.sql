@@ -0,0 +1,18 @@
+-- Add responsive image variants to an existing Bubble Tea database
+-- (new installations get the column from schema.sql;
+-- run add_outbox_events.sql first)
+
+\echo 'Adding products.image_variants...'
+
+ALTER TABLE products ADD COLUMN IF NOT EXISTS image_variants TEXT;
+
+COMMENT ON COLUMN products.image_variants IS
+    'JSON {format: [[width, url], ...]} generated by outbox_dispatcher (image events)';
+
+-- Queue existing photos for processing by outbox_dispatcher
+INSERT INTO outbox_events (event_type, payload)
+SELECT 'image', json_build_object('product_id', product_id, 'image_url', image_url)::text
+FROM products
+WHERE image_url IS NOT NULL AND image_variants IS NULL;
+
+\echo 'Done. Run python outbox_dispatcher.py to generate the variants.'
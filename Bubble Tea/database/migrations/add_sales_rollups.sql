@@ -0,0 +1,79 @@
+-- Add incrementally maintained sales rollups to an existing Bubble Tea database
+-- (new installations get the tables from schema.sql)
+
+\echo 'Creating daily_sales and product_daily_sales...'
+
+CREATE TABLE IF NOT EXISTS daily_sales (
+    sale_date DATE NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,  -- order_id % SALES_ROLLUP_SHARDS
+    total_orders INTEGER NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, shard)
+);
+
+CREATE TABLE IF NOT EXISTS product_daily_sales (
+    sale_date DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    times_ordered INTEGER NOT NULL DEFAULT 0,
+    quantity_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, product_id, shard),
+    CONSTRAINT fk_pds_product FOREIGN KEY (product_id)
+        REFERENCES products(product_id) ON DELETE CASCADE
+);
+
+CREATE INDEX IF NOT EXISTS idx_product_daily_sales_product ON product_daily_sales(product_id);
+
+-- Backfill from order history. Readers SUM over shards, so any split is
+-- correct: history goes to shard 0, new completions spread over
+-- SALES_ROLLUP_SHARDS shards (flask --app app rebuild-sales-rollup
+-- re-splits everything by the app setting)
+BEGIN;
+TRUNCATE product_daily_sales, daily_sales;
+
+INSERT INTO daily_sales (sale_date, total_orders, total_revenue)
+SELECT DATE(order_date), COUNT(*), SUM(total_amount)
+FROM orders
+WHERE status = 'completed'
+GROUP BY DATE(order_date);
+
+INSERT INTO product_daily_sales (sale_date, product_id, times_ordered, quantity_sold, revenue)
+SELECT DATE(o.order_date), oi.product_id, COUNT(*), SUM(oi.quantity), SUM(oi.subtotal)
+FROM order_items oi
+JOIN orders o ON oi.order_id = o.order_id
+WHERE o.status = 'completed'
+GROUP BY DATE(o.order_date), oi.product_id;
+COMMIT;
+
+\echo 'Switching v_daily_sales and v_popular_products to the rollups...'
+
+-- Column types change (COUNT -> INTEGER), so the views are recreated
+DROP VIEW IF EXISTS v_daily_sales;
+CREATE VIEW v_daily_sales AS
+SELECT 
+    sale_date,
+    SUM(total_orders) as total_orders,
+    SUM(total_revenue) as total_revenue,
+    SUM(total_revenue) / NULLIF(SUM(total_orders), 0) as avg_order_value
+FROM daily_sales
+GROUP BY sale_date
+HAVING SUM(total_orders) > 0
+ORDER BY sale_date DESC;
+
+DROP VIEW IF EXISTS v_popular_products;
+CREATE VIEW v_popular_products AS
+SELECT 
+    p.product_id,
+    p.product_name,
+    c.category_name,
+    COALESCE(SUM(pds.times_ordered), 0) as times_ordered,
+    COALESCE(SUM(pds.quantity_sold), 0) as total_quantity_sold,
+    COALESCE(SUM(pds.revenue), 0) as total_revenue
+FROM products p
+JOIN categories c ON p.category_id = c.category_id
+LEFT JOIN product_daily_sales pds ON p.product_id = pds.product_id
+GROUP BY p.product_id, p.product_name, c.category_name
+ORDER BY times_ordered DESC;
+
+\echo 'Done.'
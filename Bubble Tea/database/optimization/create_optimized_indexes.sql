@@ -60,9 +60,8 @@ CREATE INDEX IF NOT EXISTS idx_order_items_order_covering
 \echo ''
 \echo 'Products table indexes...'
 
--- Text search index for product names
-CREATE INDEX IF NOT EXISTS idx_products_name_search 
-    ON products USING gin(to_tsvector('english', product_name || ' ' || COALESCE(description, '')));
+-- Text search: GIN index on products.search_vector lives in full_text_search.sql
+DROP INDEX IF EXISTS idx_products_name_search;
 
 -- Index for available products by category
 CREATE INDEX IF NOT EXISTS idx_products_category_available 
@@ -134,6 +133,19 @@ CREATE INDEX IF NOT EXISTS idx_employees_position_active
 
 \echo '[OK] Employees indexes created'
 
+-- ======================================
+-- Product Ingredients Table Indexes
+-- ======================================
+\echo ''
+\echo 'Product ingredients table indexes...'
+
+-- Reverse ingredient -> products lookup for incremental availability updates
+CREATE INDEX IF NOT EXISTS idx_product_ingredients_ingredient 
+    ON product_ingredients(ingredient_id)
+    INCLUDE (product_id, quantity);
+
+\echo '[OK] Product ingredients indexes created'
+
 -- ======================================
 -- Inventory Table Indexes
 -- ======================================
@@ -164,6 +176,7 @@ ANALYZE products;
 ANALYZE customers;
 ANALYZE users;
 ANALYZE employees;
+ANALYZE product_ingredients;
 ANALYZE inventory;
 
 \echo '[OK] Statistics updated'
@@ -4,6 +4,10 @@
 -- ========================================
 
 -- Drop existing tables if any
+DROP TABLE IF EXISTS product_daily_sales CASCADE;
+DROP TABLE IF EXISTS daily_sales CASCADE;
+DROP TABLE IF EXISTS idempotency_keys CASCADE;
+DROP TABLE IF EXISTS outbox_events CASCADE;
 DROP TABLE IF EXISTS order_items CASCADE;
 DROP TABLE IF EXISTS orders CASCADE;
 DROP TABLE IF EXISTS product_ingredients CASCADE;
@@ -95,6 +99,7 @@ CREATE TABLE products (
     is_available BOOLEAN DEFAULT TRUE,
     preparation_time INTEGER CHECK (preparation_time > 0), -- in minutes
     image_url VARCHAR(255),
+    image_variants TEXT, -- JSON {format: [[width, url], ...]}, filled by outbox_dispatcher
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     CONSTRAINT fk_product_category FOREIGN KEY (category_id) 
         REFERENCES categories(category_id) ON DELETE RESTRICT
@@ -171,6 +176,58 @@ CREATE TABLE order_items (
         REFERENCES products(product_id) ON DELETE RESTRICT
 );
 
+-- ========================================
+-- TABLE: Outbox (side effects committed with the order)
+-- ========================================
+CREATE TABLE outbox_events (
+    event_id SERIAL PRIMARY KEY,
+    event_type VARCHAR(30) NOT NULL, -- telegram, image
+    payload TEXT NOT NULL, -- JSON
+    status VARCHAR(20) NOT NULL DEFAULT 'pending'
+        CHECK (status IN ('pending', 'sent', 'failed')),
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    processed_at TIMESTAMP,
+    locked_until TIMESTAMP -- lease taken by outbox_dispatcher while delivering
+);
+
+-- ========================================
+-- TABLE: Idempotency keys (retried order submissions)
+-- ========================================
+CREATE TABLE idempotency_keys (
+    user_id INTEGER NOT NULL DEFAULT 0, -- key owner; 0 = anonymous checkout
+    idempotency_key VARCHAR(255) NOT NULL,
+    order_id INTEGER NOT NULL,
+    created_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (user_id, idempotency_key),
+    CONSTRAINT fk_idem_order FOREIGN KEY (order_id)
+        REFERENCES orders(order_id) ON DELETE CASCADE
+);
+
+-- ========================================
+-- TABLES: Sales rollups (maintained by app.py on 'completed' transitions)
+-- ========================================
+CREATE TABLE daily_sales (
+    sale_date DATE NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,  -- order_id % SALES_ROLLUP_SHARDS
+    total_orders INTEGER NOT NULL DEFAULT 0,
+    total_revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, shard)
+);
+
+CREATE TABLE product_daily_sales (
+    sale_date DATE NOT NULL,
+    product_id INTEGER NOT NULL,
+    shard SMALLINT NOT NULL DEFAULT 0,
+    times_ordered INTEGER NOT NULL DEFAULT 0,
+    quantity_sold INTEGER NOT NULL DEFAULT 0,
+    revenue DECIMAL(12, 2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (sale_date, product_id, shard),
+    CONSTRAINT fk_pds_product FOREIGN KEY (product_id)
+        REFERENCES products(product_id) ON DELETE CASCADE
+);
+
 -- ========================================
 -- INDEXES for query optimization
 -- ========================================
@@ -182,6 +239,10 @@ CREATE INDEX idx_orders_date ON orders(order_date);
 CREATE INDEX idx_orders_status ON orders(status);
 CREATE INDEX idx_order_items_order ON order_items(order_id);
 CREATE INDEX idx_order_items_product ON order_items(product_id);
+CREATE INDEX idx_product_ingredients_ingredient ON product_ingredients(ingredient_id);
+CREATE INDEX idx_outbox_pending ON outbox_events(event_id) WHERE status = 'pending';
+CREATE INDEX idx_idempotency_keys_created ON idempotency_keys(created_at);
+CREATE INDEX idx_product_daily_sales_product ON product_daily_sales(product_id);
 
 -- ========================================
 -- VIEWS
@@ -200,31 +261,30 @@ SELECT
 FROM products p
 JOIN categories c ON p.category_id = c.category_id;
 
--- View: Daily sales statistics
+-- View: Daily sales statistics (from the daily_sales rollup)
 CREATE OR REPLACE VIEW v_daily_sales AS
 SELECT 
-    DATE(order_date) as sale_date,
-    COUNT(*) as total_orders,
-    SUM(total_amount) as total_revenue,
-    AVG(total_amount) as avg_order_value
-FROM orders
-WHERE status = 'completed'
-GROUP BY DATE(order_date)
+    sale_date,
+    SUM(total_orders) as total_orders,
+    SUM(total_revenue) as total_revenue,
+    SUM(total_revenue) / NULLIF(SUM(total_orders), 0) as avg_order_value
+FROM daily_sales
+GROUP BY sale_date
+HAVING SUM(total_orders) > 0
 ORDER BY sale_date DESC;
 
--- View: Popular products
+-- View: Popular products (from the product_daily_sales rollup)
 CREATE OR REPLACE VIEW v_popular_products AS
 SELECT 
     p.product_id,
     p.product_name,
     c.category_name,
-    COUNT(oi.order_item_id) as times_ordered,
-    SUM(oi.quantity) as total_quantity_sold,
-    SUM(oi.subtotal) as total_revenue
+    COALESCE(SUM(pds.times_ordered), 0) as times_ordered,
+    COALESCE(SUM(pds.quantity_sold), 0) as total_quantity_sold,
+    COALESCE(SUM(pds.revenue), 0) as total_revenue
 FROM products p
 JOIN categories c ON p.category_id = c.category_id
-LEFT JOIN order_items oi ON p.product_id = oi.product_id
-LEFT JOIN orders o ON oi.order_id = o.order_id AND o.status = 'completed'
+LEFT JOIN product_daily_sales pds ON p.product_id = pds.product_id
 GROUP BY p.product_id, p.product_name, c.category_name
 ORDER BY times_ordered DESC;
 
@@ -302,4 +362,8 @@ COMMENT ON TABLE ingredients IS 'Ingredients for preparation';
 COMMENT ON TABLE product_ingredients IS 'Product composition';
 COMMENT ON TABLE orders IS 'Customer orders';
 COMMENT ON TABLE order_items IS 'Order line items';
+COMMENT ON TABLE outbox_events IS 'Transactional outbox for order/inventory side effects';
+COMMENT ON TABLE idempotency_keys IS 'Idempotency-Key -> order, replayed on retried submissions';
+COMMENT ON TABLE daily_sales IS 'Completed orders per day, updated incrementally on status transitions';
+COMMENT ON TABLE product_daily_sales IS 'Completed sales per (day, product), updated incrementally on status transitions';
 
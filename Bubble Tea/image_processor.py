@@ -0,0 +1,61 @@
+"""
+Image Processor для системы Bubble Tea
+Обработка загруженных фото продуктов: уменьшение до нескольких ширин
+и перекодирование в AVIF / WebP для srcset.
+
+Вызывается из outbox_dispatcher (событие 'image'), а не в HTTP-запросе,
+чтобы загрузка фото в админке не ждала перекодирования.
+"""
+
+import os
+import uuid
+
+try:
+    from PIL import Image, ImageOps, features
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+VARIANT_WIDTHS = tuple(int(w) for w in os.getenv('IMAGE_VARIANT_WIDTHS', '320,640,1024').split(','))
+
+# Порядок важен: браузер берёт первый поддерживаемый <source>
+VARIANT_FORMATS = ('avif', 'webp')
+QUALITY = {'avif': 50, 'webp': 80}
+
+
+def available_formats():
+    """Форматы из VARIANT_FORMATS, которые умеет кодировать установленный Pillow"""
+    return [fmt for fmt in VARIANT_FORMATS if features.check(fmt)]
+
+
+def generate_variants(source_path, url_prefix):
+    """
+    Создать варианты фото рядом с исходником: <имя>-<ширина>.<формат>.
+
+    Ширины больше исходной не создаются (картинка не растягивается).
+    Возвращает {формат: [[ширина, url], ...]} для Product.image_variants.
+    """
+    base_name = os.path.splitext(os.path.basename(source_path))[0]
+    target_dir = os.path.dirname(source_path)
+
+    with Image.open(source_path) as original:
+        image = ImageOps.exif_transpose(original)
+        image = image.convert('RGBA' if 'A' in image.getbands() else 'RGB')
+
+    widths = sorted({min(width, image.width) for width in VARIANT_WIDTHS})
+    variants = {}
+    for fmt in available_formats():
+        variants[fmt] = []
+        for width in widths:
+            filename = f"{base_name}-{width}.{fmt}"
+            target_path = os.path.join(target_dir, filename)
+            # Имена от хэша содержимого: существующий вариант уже совпадает
+            if not os.path.exists(target_path):
+                height = round(image.height * width / image.width)
+                resized = image if width == image.width else image.resize((width, height), Image.LANCZOS)
+                # Свой временный файл: тот же вариант может кодировать другой диспетчер
+                tmp_path = f"{target_path}.{uuid.uuid4().hex}.tmp"
+                resized.save(tmp_path, fmt.upper(), quality=QUALITY[fmt])
+                os.replace(tmp_path, target_path)
+            variants[fmt].append([width, f"{url_prefix.rstrip('/')}/{filename}"])
+    return variants
@@ -0,0 +1,173 @@
+"""
+Outbox Dispatcher для системы Bubble Tea
+Фоновый процесс: забирает события из таблицы outbox_events пачками
+и доставляет их (Telegram, обработка фото продуктов), чтобы оформление
+заказа и админка не ждали внешние API и перекодирование.
+
+Запуск: python outbox_dispatcher.py
+        python outbox_dispatcher.py --once
+"""
+
+import argparse
+import json
+import os
+import time
+from datetime import datetime, timedelta
+
+import image_processor
+from app import app, db, OutboxEvent, Product, purge_idempotency_keys, collect_unreferenced_images
+
+BATCH_SIZE = int(os.getenv('OUTBOX_BATCH_SIZE', '50'))
+POLL_INTERVAL = float(os.getenv('OUTBOX_POLL_INTERVAL', '2'))
+MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '5'))
+LEASE_SECONDS = float(os.getenv('OUTBOX_LEASE', '300'))
+PURGE_INTERVAL = float(os.getenv('IDEMPOTENCY_PURGE_INTERVAL', '300'))
+IMAGE_GC_INTERVAL = float(os.getenv('IMAGE_GC_INTERVAL', '3600'))
+
+
+def _send_telegram(payload):
+    """Отправить сообщение в Telegram; вернуть текст ошибки или None"""
+    from telegram_notifier import get_notifier
+    result = get_notifier().send_message(payload['text'])
+    if not result.get('ok'):
+        return result.get('error') or 'Telegram API returned ok=false'
+    return None
+
+
+def _current_product(payload):
+    """Продукт из события, если его фото не заменили (иначе событие устарело)"""
+    product = db.session.get(Product, payload['product_id'])
+    if product is None or product.image_url != payload['image_url']:
+        return None
+    return product
+
+
+def _process_image(payload):
+    """Сгенерировать варианты фото и сохранить их в products.image_variants"""
+    if not image_processor.PIL_AVAILABLE:
+        return 'Pillow is not installed'
+    is_current = _current_product(payload) is not None
+    db.session.commit()  # не держать транзакцию открытой на время перекодирования
+    if not is_current:
+        return None
+    source = os.path.join(app.config['UPLOAD_FOLDER'], os.path.basename(payload['image_url']))
+    variants = image_processor.generate_variants(source, os.path.dirname(payload['image_url']))
+    # Запись попадает в ту же транзакцию, что и статус события
+    product = _current_product(payload)
+    if product is not None:
+        product.image_variants = json.dumps(variants)
+    return None
+
+
+# event_type -> обработчик(payload) -> ошибка или None
+HANDLERS = {
+    'telegram': _send_telegram,
+    'image': _process_image,
+}
+
+
+def claim_events(batch_size=BATCH_SIZE):
+    """
+    Взять пачку ожидающих событий в аренду на LEASE_SECONDS.
+
+    Строки блокируются через SELECT ... FOR UPDATE SKIP LOCKED только на
+    время короткой транзакции, которая проставляет locked_until: несколько
+    диспетчеров не возьмут одно событие дважды, а событие упавшего
+    диспетчера снова станет доступно после окончания аренды.
+    Возвращает [(event_id, event_type, payload, attempts), ...].
+    """
+    now = datetime.now()
+    events = OutboxEvent.query.filter(
+        OutboxEvent.status == 'pending',
+        db.or_(OutboxEvent.locked_until.is_(None), OutboxEvent.locked_until < now)
+    ).order_by(OutboxEvent.event_id).limit(batch_size).with_for_update(skip_locked=True).all()
+
+    claimed = [(e.event_id, e.event_type, e.payload, e.attempts) for e in events]
+    for event in events:
+        event.locked_until = now + timedelta(seconds=LEASE_SECONDS)
+    db.session.commit()
+    return claimed
+
+
+def _finish_event(event_id, event_type, attempts, error, permanent):
+    """Записать результат доставки вместе с изменениями обработчика и снять аренду"""
+    values = {'attempts': attempts + 1, 'locked_until': None}
+    if error is None:
+        values.update(status='sent', processed_at=datetime.now())
+    else:
+        values['last_error'] = error[:500]
+        if attempts + 1 >= MAX_ATTEMPTS or permanent:
+            values.update(status='failed', processed_at=datetime.now())
+            print(f"❌ Outbox #{event_id} ({event_type}): {error}")
+    db.session.execute(db.update(OutboxEvent).where(OutboxEvent.event_id == event_id).values(**values))
+    db.session.commit()
+
+
+def drain_outbox(batch_size=BATCH_SIZE):
+    """
+    Обработать одну пачку ожидающих событий.
+
+    Пачка берётся в аренду короткой транзакцией (claim_events); вызовы
+    Telegram и перекодирование фото идут без открытой транзакции и
+    блокировок, а результат каждого события коммитится отдельно.
+    Возвращает количество обработанных событий.
+    """
+    claimed = claim_events(batch_size)
+    for event_id, event_type, payload, attempts in claimed:
+        handler = HANDLERS.get(event_type)
+        try:
+            error = handler(json.loads(payload)) if handler else f'Unknown event type: {event_type}'
+        except Exception as e:
+            db.session.rollback()
+            error = str(e)
+        _finish_event(event_id, event_type, attempts, error, permanent=handler is None)
+    return len(claimed)
+
+
+def run_forever(batch_size=BATCH_SIZE, poll_interval=POLL_INTERVAL):
+    """Основной цикл: пока есть события — обрабатываем пачками, иначе спим"""
+    print(f"📤 Outbox dispatcher запущен (batch={batch_size}, poll={poll_interval}s)")
+    purged_at = collected_at = 0
+    while True:
+        # Заодно чистим истёкшие Idempotency-Key, чтобы не делать этого в заказе
+        if time.monotonic() - purged_at >= PURGE_INTERVAL:
+            try:
+                purge_idempotency_keys()
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Ошибка очистки idempotency_keys: {e}")
+            purged_at = time.monotonic()
+        # И удаляем фото продуктов, на которые больше нет ссылок
+        if time.monotonic() - collected_at >= IMAGE_GC_INTERVAL:
+            try:
+                removed = collect_unreferenced_images()
+                if removed:
+                    print(f"🗑️ Удалено неиспользуемых фото: {len(removed)}")
+            except Exception as e:
+                db.session.rollback()
+                print(f"⚠️ Ошибка очистки фото: {e}")
+            collected_at = time.monotonic()
+        try:
+            processed = drain_outbox(batch_size)
+        except Exception as e:
+            db.session.rollback()
+            print(f"⚠️ Ошибка обработки outbox: {e}")
+            processed = 0
+        if processed < batch_size:
+            time.sleep(poll_interval)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description='Доставка событий из outbox_events')
+    parser.add_argument('--once', action='store_true', help='Обработать одну пачку и выйти')
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+    args = parser.parse_args()
+
+    with app.app_context():
+        try:
+            if args.once:
+                print(f"✅ Обработано событий: {drain_outbox(args.batch_size)}")
+            else:
+                run_forever(args.batch_size)
+        except KeyboardInterrupt:
+            print("\n⚠️ Прервано пользователем")
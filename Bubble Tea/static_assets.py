@@ -0,0 +1,128 @@
+"""
+Static Assets для системы Bubble Tea
+Сборка CSS/JS с хэшем содержимого в имени и заранее сжатыми копиями
+(.gz, .br), чтобы браузеры кэшировали их навсегда, а сервер не сжимал
+файлы на каждый запрос.
+
+Результат пишется в static/dist/ вместе с manifest.json
+({"css/style.css": "dist/css/style.<hash>.css"}). Сборка — шаг деплоя,
+app.py только читает манифест:
+
+Запуск: flask --app app build-static (или python static_assets.py)
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import time
+
+try:
+    import brotli
+    BROTLI_AVAILABLE = True
+except ImportError:
+    BROTLI_AVAILABLE = False
+
+ASSET_DIRS = ('css', 'js')
+DIST_DIR = 'dist'
+MANIFEST_NAME = 'manifest.json'
+PREVIOUS_MANIFEST_NAME = 'manifest.previous.json'  # сборка до текущей
+
+# Кодирование -> расширение заранее сжатой копии (в порядке предпочтения)
+PRECOMPRESSED = (('br', '.br'), ('gzip', '.gz'))
+
+# Секунд, которые живут файлы прежних сборок: во время rolling deploy
+# воркеры старой версии ещё отдают их URL
+PRUNE_GRACE = int(os.getenv('STATIC_PRUNE_GRACE', '86400'))
+
+
+def _write(path, data):
+    """Атомарная запись: параллельно стартующие воркеры не видят половину файла"""
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+def build(static_folder, grace_seconds=None):
+    """
+    Собрать хэшированные копии ассетов и вернуть манифест.
+
+    Уже собранные файлы с тем же хэшем не переписываются. Файлы предыдущей
+    сборки (manifest.previous.json) остаются, более старые удаляются, когда
+    им больше grace_seconds (по умолчанию PRUNE_GRACE).
+    """
+    if grace_seconds is None:
+        grace_seconds = PRUNE_GRACE
+    current = load_manifest(static_folder)
+    manifest = {}
+    written = set()
+    for asset_dir in ASSET_DIRS:
+        source_dir = os.path.join(static_folder, asset_dir)
+        if not os.path.isdir(source_dir):
+            continue
+        target_dir = os.path.join(static_folder, DIST_DIR, asset_dir)
+        os.makedirs(target_dir, exist_ok=True)
+
+        for name in sorted(os.listdir(source_dir)):
+            source_path = os.path.join(source_dir, name)
+            if not os.path.isfile(source_path):
+                continue
+            with open(source_path, 'rb') as f:
+                data = f.read()
+
+            stem, extension = os.path.splitext(name)
+            digest = hashlib.blake2b(data, digest_size=6).hexdigest()
+            hashed_name = f"{stem}.{digest}{extension}"
+            hashed_path = os.path.join(target_dir, hashed_name)
+
+            outputs = {
+                hashed_path: lambda: data,
+                f"{hashed_path}.gz": lambda: gzip.compress(data, compresslevel=9, mtime=0),
+            }
+            if BROTLI_AVAILABLE:
+                outputs[f"{hashed_path}.br"] = lambda: brotli.compress(data, quality=11)
+            for path, encode in outputs.items():
+                if not os.path.exists(path):
+                    _write(path, encode())
+                written.add(path)
+
+            manifest[f"{asset_dir}/{name}"] = f"{DIST_DIR}/{asset_dir}/{hashed_name}"
+
+    # Убрать устаревшие версии, кроме предыдущей сборки. Перезапуск без
+    # изменений ассетов не сдвигает «предыдущую» сборку
+    dist_root = os.path.join(static_folder, DIST_DIR)
+    if manifest and current and current != manifest:
+        _write(os.path.join(dist_root, PREVIOUS_MANIFEST_NAME), json.dumps(current, indent=2).encode('utf-8'))
+    for target in load_manifest(static_folder, PREVIOUS_MANIFEST_NAME).values():
+        path = os.path.join(static_folder, *target.split('/'))
+        written.update((path, f"{path}.gz", f"{path}.br"))
+    cutoff = time.time() - grace_seconds
+    for asset_dir in ASSET_DIRS:
+        target_dir = os.path.join(dist_root, asset_dir)
+        if os.path.isdir(target_dir):
+            for name in os.listdir(target_dir):
+                path = os.path.join(target_dir, name)
+                if path not in written and not name.endswith('.tmp') and os.stat(path).st_mtime < cutoff:
+                    os.remove(path)
+
+    if manifest:
+        _write(os.path.join(dist_root, MANIFEST_NAME), json.dumps(manifest, indent=2).encode('utf-8'))
+    return manifest
+
+
+def load_manifest(static_folder, name=MANIFEST_NAME):
+    """Манифест последней сборки ({} если сборки не было)"""
+    try:
+        with open(os.path.join(static_folder, DIST_DIR, name), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+if __name__ == "__main__":
+    static_folder = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'static')
+    for source, target in build(static_folder).items():
+        print(f"✅ {source} -> {target}")
+    if not BROTLI_AVAILABLE:
+        print("⚠️ brotli не установлен: созданы только .gz")
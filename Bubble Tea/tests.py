@@ -7,8 +7,20 @@ Unit-тесты для веб-приложения Bubble Tea "BibaBobaBebe"
 """
 
 import unittest
+import unittest.mock
 import os
+import csv
+import gzip
+import io
+import json
+import shutil
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
 from decimal import Decimal
+from sqlalchemy import event
+from sqlalchemy.exc import IntegrityError
 
 # Переопределяем SQLALCHEMY_DATABASE_URI ДО импорта app
 # Flask-SQLAlchemy подхватит его вместо PostgreSQL URL
@@ -21,8 +33,12 @@ os.environ.setdefault('DB_PORT', '5432')
 os.environ.setdefault('DB_NAME', 'test_db')
 
 import app as application
-from app import app, db, User, Product, Category, Ingredient, ProductIngredient, Order, Employee, Position, Notification
+from app import app, db, User, Product, Category, Ingredient, ProductIngredient, Order, OrderItem, Employee, Customer, Position, Notification
 from app import check_product_availability, deduct_ingredients, create_notification
+from app import load_cart_requirements, find_cart_shortages, OutboxEvent, DailySales, ProductDailySales
+import outbox_dispatcher
+import image_processor
+import static_assets
 
 
 # ============================================================
@@ -286,6 +302,48 @@ class TestIngredientBusinessLogic(BaseTestCase):
             db.session.commit()
             self.assertTrue(ingredient.needs_restock)
 
+    def test_use_decrements_on_sql_side_despite_stale_object(self):
+        """Списание идёт от значения в БД, а не от устаревшей копии в памяти"""
+        with app.app_context():
+            ingredient = Ingredient.query.filter_by(ingredient_name='Tapioca Pearls').first()
+            # Другой воркер успел списать 400г — объект в памяти об этом не знает
+            db.session.execute(
+                db.text("UPDATE ingredients SET stock_quantity = 100 WHERE ingredient_id = :id"),
+                {'id': ingredient.ingredient_id}
+            )
+            self.assertEqual(ingredient.stock_quantity, Decimal('500'))
+
+            with self.assertRaises(ValueError):
+                ingredient.use(Decimal('150'))
+
+            ingredient.use(Decimal('60'))
+            db.session.commit()
+            self.assertEqual(ingredient.stock_quantity, Decimal('40'))
+            db.session.expire_all()
+            self.assertEqual(Ingredient.query.get(ingredient.ingredient_id).stock_quantity, Decimal('40'))
+
+    def test_incremental_availability_touches_only_affected_products(self):
+        """Пересчёт по ингредиентам затрагивает только продукты с этими ингредиентами"""
+        with app.app_context():
+            product_id, ingredient_id = self._link_ingredient_to_product(quantity_needed=600)
+            category = Category.query.first()
+            # Продукт без рецептуры, вручную снятый с продажи
+            hidden = Product(product_name='Hidden Item', category_id=category.category_id,
+                             price=Decimal('500'), is_available=False)
+            db.session.add(hidden)
+            db.session.commit()
+            hidden_id = hidden.product_id
+
+            updated = application.update_product_availability([ingredient_id])
+
+            self.assertEqual(updated, 1)
+            self.assertFalse(Product.query.get(product_id).is_available)
+            self.assertFalse(Product.query.get(hidden_id).is_available)
+
+            # Полный пересчёт по каталогу по-прежнему проверяет все продукты
+            self.assertEqual(application.update_product_availability(), 1)
+            self.assertTrue(Product.query.get(hidden_id).is_available)
+
 
 # ============================================================
 # ТЕСТ 3: HTTP-МАРШРУТЫ И КОДЫ ОТВЕТОВ
@@ -483,6 +541,1717 @@ class TestAuthAndNotifications(BaseTestCase):
             self.assertIn(resp_after.status_code, [302, 401])
 
 
+# ============================================================
+# ТЕСТ 5: ОФОРМЛЕНИЕ ЗАКАЗА И СПИСАНИЕ ПО КОРЗИНЕ
+# ============================================================
+
+class TestCartCheckout(BaseTestCase):
+    """
+    Тестирует оформление заказа по корзине целиком:
+    - требования общих ингредиентов суммируются по всем позициям
+    - корзина отклоняется, если суммарно ингредиента не хватает
+    - успешный заказ списывает суммарное количество один раз
+    """
+
+    def _seed_shared_recipe(self, per_drink=Decimal('200')):
+        """Два напитка, использующих один и тот же ингредиент"""
+        with app.app_context():
+            category = Category.query.first()
+            tapioca = Ingredient.query.filter_by(ingredient_name='Tapioca Pearls').first()
+            first = Product.query.filter_by(product_name='Test Boba').first()
+            second = Product(
+                product_name='Test Milk Tea', category_id=category.category_id,
+                price=Decimal('900'), is_available=True
+            )
+            db.session.add(second)
+            db.session.flush()
+            for product in (first, second):
+                db.session.add(ProductIngredient(
+                    product_id=product.product_id,
+                    ingredient_id=tapioca.ingredient_id,
+                    quantity=per_drink
+                ))
+            db.session.commit()
+            return first.product_id, second.product_id, tapioca.ingredient_id
+
+    def test_shared_ingredient_requirements_are_summed(self):
+        """Общий ингредиент должен учитываться суммарно по всей корзине"""
+        first_id, second_id, tapioca_id = self._seed_shared_recipe()
+        with app.app_context():
+            requirements = load_cart_requirements({first_id: 1, second_id: 2})
+
+            self.assertEqual(list(requirements), [tapioca_id])
+            self.assertEqual(requirements[tapioca_id]['required'], Decimal('600'))
+            self.assertEqual(sorted(requirements[tapioca_id]['product_ids']), sorted([first_id, second_id]))
+            # Каждый напиток по отдельности доступен, вместе — нет (600 > 500)
+            self.assertEqual(len(find_cart_shortages(requirements)), 1)
+
+    def test_checkout_rejects_cart_short_on_shared_ingredient(self):
+        """Заказ не создаётся, если суммарно ингредиента не хватает"""
+        first_id, second_id, tapioca_id = self._seed_shared_recipe(per_drink=Decimal('300'))
+
+        self.client.post('/order/new', data={
+            'product_id': [first_id, second_id],
+            'quantity': [1, 1],
+            'payment_method': 'cash'
+        })
+
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 0)
+            self.assertEqual(db.session.get(Ingredient, tapioca_id).stock_quantity, Decimal('500'))
+
+    def test_checkout_deducts_whole_cart(self):
+        """Успешный заказ списывает ингредиенты за всю корзину"""
+        first_id, second_id, tapioca_id = self._seed_shared_recipe(per_drink=Decimal('100'))
+
+        response = self.client.post('/order/new', data={
+            'product_id': [first_id, second_id, first_id],
+            'quantity': [1, 1, 1],
+            'payment_method': 'card'
+        })
+
+        self.assertEqual(response.status_code, 302)
+        with app.app_context():
+            order = Order.query.one()
+            self.assertEqual(order.total_amount, Decimal('2500'))
+            self.assertEqual(len(order.order_items), 2)
+            self.assertEqual(db.session.get(Ingredient, tapioca_id).stock_quantity, Decimal('200'))
+
+    def test_recipe_graph_max_makeable_and_invalidation(self):
+        """Кэш рецептур считает, сколько можно приготовить, и сбрасывается после изменения рецепта"""
+        first_id, second_id, tapioca_id = self._seed_shared_recipe(per_drink=Decimal('200'))
+        graph = application.recipe_graph
+        with app.app_context():
+            for vectorized in {False, application.NUMPY_AVAILABLE}:
+                with unittest.mock.patch.object(application, 'NUMPY_AVAILABLE', vectorized):
+                    self.assertEqual(graph.max_makeable(), {first_id: 2, second_id: 2})
+
+            link = ProductIngredient.query.filter_by(product_id=second_id).first()
+            link.quantity = Decimal('50')
+            db.session.commit()
+            self.assertEqual(graph.max_makeable(), {first_id: 2, second_id: 10})
+
+            # Списание обновляет кэш остатков значением из RETURNING
+            Ingredient.query.get(tapioca_id).use(Decimal('300'))
+            db.session.commit()
+            self.assertEqual(graph.max_makeable(), {first_id: 1, second_id: 4})
+
+            # Нулевое количество в рецепте не ограничивает продукт
+            link.quantity = Decimal('0')
+            db.session.commit()
+            for vectorized in {False, application.NUMPY_AVAILABLE}:
+                with unittest.mock.patch.object(application, 'NUMPY_AVAILABLE', vectorized):
+                    self.assertEqual(graph.max_makeable(), {first_id: 1})
+
+    def test_stale_recipe_cache_does_not_reject_order(self):
+        """Устаревший кэш остатков (склад пополнен другим воркером) не мешает заказу"""
+        first_id, _, tapioca_id = self._seed_shared_recipe(per_drink=Decimal('300'))
+        with app.app_context():
+            self.assertEqual(application.recipe_graph.max_makeable()[first_id], 1)
+            db.session.execute(
+                db.update(Ingredient).where(Ingredient.ingredient_id == tapioca_id)
+                .values(stock_quantity=Decimal('1000'))
+            )
+            db.session.commit()
+
+        self.client.post('/order/new', data={'product_id': [first_id], 'quantity': [2], 'payment_method': 'card'})
+
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+            self.assertEqual(db.session.get(Ingredient, tapioca_id).stock_quantity, Decimal('400'))
+
+
+# ============================================================
+# ТЕСТ 6: OUTBOX ДЛЯ ПОБОЧНЫХ ЭФФЕКТОВ ЗАКАЗА
+# ============================================================
+
+class TestOutbox(BaseTestCase):
+    """
+    Тестирует transactional outbox:
+    - заказ, уведомление и сообщение Telegram сохраняются одним коммитом
+    - Telegram не вызывается во время запроса
+    - диспетчер доставляет события пачками и помечает их отправленными
+    """
+
+    def test_checkout_writes_side_effects_to_outbox(self):
+        """Оформление заказа кладёт сообщение в outbox вместо отправки в Telegram"""
+        with app.app_context():
+            product_id = Product.query.first().product_id
+
+        with unittest.mock.patch.object(application, 'TELEGRAM_AVAILABLE', True), \
+                unittest.mock.patch('telegram_notifier.TelegramNotifier.send_message') as send:
+            response = self.client.post('/order/new', data={
+                'product_id': [product_id], 'quantity': [2], 'payment_method': 'cash'
+            })
+
+        self.assertEqual(response.status_code, 302)
+        send.assert_not_called()
+        with app.app_context():
+            order = Order.query.one()
+            event = OutboxEvent.query.one()
+            self.assertEqual(event.event_type, 'telegram')
+            self.assertEqual(event.status, 'pending')
+            self.assertIn(f'#{order.order_id}', json.loads(event.payload)['text'])
+            self.assertEqual(Notification.query.filter_by(related_id=order.order_id).count(), 1)
+
+    def test_dispatcher_drains_pending_events(self):
+        """Диспетчер отправляет ожидающие события и помечает ошибки"""
+        with app.app_context():
+            for text in ('ok', 'boom'):
+                db.session.add(OutboxEvent(event_type='telegram', payload=json.dumps({'text': text})))
+            db.session.commit()
+
+            handler = unittest.mock.Mock(side_effect=lambda payload: 'boom' if payload['text'] == 'boom' else None)
+            with unittest.mock.patch.dict(outbox_dispatcher.HANDLERS, {'telegram': handler}):
+                self.assertEqual(outbox_dispatcher.drain_outbox(batch_size=10), 2)
+
+            sent, failed = OutboxEvent.query.order_by(OutboxEvent.event_id).all()
+            self.assertEqual(sent.status, 'sent')
+            self.assertIsNotNone(sent.processed_at)
+            self.assertEqual(failed.status, 'pending')
+            self.assertEqual(failed.attempts, 1)
+            self.assertEqual(failed.last_error, 'boom')
+
+    def test_dispatcher_leases_events_outside_transaction(self):
+        """Доставка идёт без открытой транзакции; арендованные события не берутся повторно"""
+        with app.app_context():
+            for text in ('first', 'second'):
+                db.session.add(OutboxEvent(event_type='telegram', payload=json.dumps({'text': text})))
+            db.session.commit()
+
+            self.assertEqual(len(outbox_dispatcher.claim_events(batch_size=1)), 1)
+            in_transaction = []
+            handler = unittest.mock.Mock(side_effect=lambda payload: in_transaction.append(db.session().in_transaction()))
+            with unittest.mock.patch.dict(outbox_dispatcher.HANDLERS, {'telegram': handler}):
+                self.assertEqual(outbox_dispatcher.drain_outbox(batch_size=10), 1)
+            self.assertEqual(handler.call_args.args[0], {'text': 'second'})
+            self.assertEqual(in_transaction, [False])
+
+            # Аренда упавшего диспетчера истекает, и событие снова доступно
+            db.session.execute(db.update(OutboxEvent).where(OutboxEvent.status == 'pending')
+                               .values(locked_until=datetime.now() - timedelta(seconds=1)))
+            db.session.commit()
+            with unittest.mock.patch.dict(outbox_dispatcher.HANDLERS, {'telegram': handler}):
+                self.assertEqual(outbox_dispatcher.drain_outbox(batch_size=10), 1)
+            self.assertEqual({e.status for e in OutboxEvent.query}, {'sent'})
+            self.assertEqual({e.locked_until for e in OutboxEvent.query}, {None})
+
+
+# ============================================================
+# ТЕСТ 7: НАЗНАЧЕНИЕ ЗАКАЗОВ СОТРУДНИКАМ ПО НАГРУЗКЕ
+# ============================================================
+
+class TestEmployeeScheduler(BaseTestCase):
+    """
+    Тестирует распределение заказов между сотрудниками:
+    - новый заказ получает наименее загруженный сотрудник
+    - нагрузка учитывает время приготовления
+    - завершённый заказ снимается с очереди сотрудника
+    """
+
+    def _add_second_employee(self):
+        with app.app_context():
+            position = Position.query.first()
+            employee = Employee(
+                first_name='Second', last_name='Barista',
+                phone='+77004445566', email='emp2@test.com',
+                position_id=position.position_id, salary=Decimal('150000'),
+                hire_date=__import__('datetime').date.today()
+            )
+            db.session.add(employee)
+            Product.query.first().preparation_time = 5
+            db.session.commit()
+            return employee.employee_id
+
+    def _order(self, quantity=1):
+        with app.app_context():
+            product_id = Product.query.first().product_id
+        self.client.post('/order/new', data={
+            'product_id': [product_id], 'quantity': [quantity], 'payment_method': 'cash'
+        })
+        with app.app_context():
+            return Order.query.order_by(Order.order_id.desc()).first()
+
+    def test_orders_spread_by_preparation_load(self):
+        """Заказы распределяются по суммарному времени приготовления"""
+        second_id = self._add_second_employee()
+
+        first = self._order(quantity=3)    # 15 минут
+        second = self._order(quantity=1)   # 5 минут
+        third = self._order(quantity=1)    # 5 минут
+
+        self.assertNotEqual(first.employee_id, second.employee_id)
+        self.assertEqual(third.employee_id, second.employee_id)
+        with app.app_context():
+            queues = application.employee_scheduler.queues()
+        self.assertEqual(queues[first.employee_id], (15, 1))
+        self.assertEqual(queues[second.employee_id], (10, 2))
+
+    def test_completed_order_releases_load(self):
+        """Смена статуса на completed снимает нагрузку с сотрудника"""
+        self._add_second_employee()
+        self._create_admin(username='scheduler_admin', password='Admin123!')
+        first = self._order(quantity=3)
+
+        with self.client:
+            self._login('scheduler_admin', 'Admin123!')
+            response = self.client.put(f'/api/order/{first.order_id}/status', json={'status': 'completed'})
+            self.assertEqual(response.status_code, 200)
+
+        with app.app_context():
+            self.assertEqual(application.employee_scheduler.queues()[first.employee_id], (0, 0))
+            # Следующий заказ снова может получить освободившийся сотрудник
+            self.assertEqual(self._order().employee_id, first.employee_id)
+
+
+# ============================================================
+# ТЕСТ 8: IDEMPOTENCY-KEY ПРИ ОФОРМЛЕНИИ ЗАКАЗА
+# ============================================================
+
+class TestIdempotentCheckout(BaseTestCase):
+    """
+    Тестирует повторную отправку заказа с тем же Idempotency-Key:
+    - повтор не создаёт второй заказ и не списывает ингредиенты
+    - повтор возвращает исходный заказ (редирект или JSON)
+    - истёкший ключ не мешает новому заказу
+    """
+
+    def _submit(self, key, **headers):
+        with app.app_context():
+            product_id = Product.query.first().product_id
+        return self.client.post('/order/new', data={
+            'product_id': [product_id], 'quantity': [1], 'payment_method': 'cash'
+        }, headers={'Idempotency-Key': key, **headers})
+
+    def _stock(self):
+        with app.app_context():
+            return Ingredient.query.first().stock_quantity
+
+    def test_retry_returns_original_order(self):
+        """Повтор с тем же ключом не создаёт второй заказ"""
+        first = self._submit('retry-1', Accept='application/json')
+        self.assertEqual(first.status_code, 201)
+        stock_after_first = self._stock()
+
+        retry = self._submit('retry-1', Accept='application/json')
+        self.assertEqual(retry.status_code, 200)
+        self.assertEqual(retry.headers.get('Idempotent-Replayed'), 'true')
+        self.assertEqual(retry.get_json()['order_id'], first.get_json()['order_id'])
+        self.assertTrue(retry.get_json()['replayed'])
+
+        browser_retry = self._submit('retry-1')
+        self.assertEqual(browser_retry.status_code, 302)
+        self.assertIn(f"/order/{first.get_json()['order_id']}", browser_retry.headers['Location'])
+
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+        self.assertEqual(self._stock(), stock_after_first)
+
+    def test_form_field_key_and_expiry(self):
+        """Ключ из скрытого поля формы; после TTL ключ перестаёт действовать"""
+        page = self.client.get('/order/new')
+        self.assertIn(b'name="idempotency_key"', page.data)
+
+        self._submit('expiring')
+        with app.app_context():
+            record = application.IdempotencyKey.query.filter_by(idempotency_key='expiring').one()
+            self.assertEqual(record.user_id, application.ANONYMOUS_IDEMPOTENCY_SCOPE)
+            record.created_at = datetime.now() - timedelta(seconds=app.config['IDEMPOTENCY_KEY_TTL'] + 1)
+            db.session.commit()
+
+        self._submit('expiring')
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 2)
+            self.assertEqual(application.purge_idempotency_keys(), 0)
+
+    def test_keys_are_scoped_by_user(self):
+        """Чужой ключ не возвращает чужой заказ"""
+        first = self._submit('shared-key', Accept='application/json')
+        self.assertEqual(first.status_code, 201)
+
+        self._create_admin(username='idem_admin', password='Admin123!')
+        with self.client:
+            self._login('idem_admin', 'Admin123!')
+            other = self._submit('shared-key', Accept='application/json')
+            self.assertEqual(other.status_code, 201)
+            self.assertNotEqual(other.get_json()['order_id'], first.get_json()['order_id'])
+            self.assertEqual(self._submit('shared-key', Accept='application/json').get_json()['order_id'],
+                             other.get_json()['order_id'])
+
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 2)
+
+
+# ============================================================
+# ТЕСТ 9: ПАКЕТНЫЙ API ЗАКАЗОВ ДЛЯ POS
+# ============================================================
+
+class TestBatchOrders(BaseTestCase):
+    """
+    Тестирует /api/orders/batch:
+    - заказы проверяются по одному общему снимку остатков по порядку
+    - результат возвращается по каждому заказу
+    - повтор пачки с теми же ключами не создаёт заказы заново
+    """
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            product = Product.query.first()
+            ingredient = Ingredient.query.first()
+            db.session.add(ProductIngredient(product_id=product.product_id,
+                                             ingredient_id=ingredient.ingredient_id,
+                                             quantity=Decimal('100')))
+            db.session.commit()
+            self.product_id = product.product_id
+        self._create_admin(username='pos_admin', password='Admin123!')
+
+    def _post_batch(self, orders):
+        return self.client.post('/api/orders/batch', json={'orders': orders})
+
+    def _order(self, quantity, key=None, payment_method='card'):
+        order = {'items': [{'product_id': self.product_id, 'quantity': quantity}], 'payment_method': payment_method}
+        if key:
+            order['idempotency_key'] = key
+        return order
+
+    def test_batch_validates_against_shared_snapshot(self):
+        """500 г на складе: 3 + 2 напитка проходят, третий заказ отклоняется"""
+        with self.client:
+            self._login('pos_admin', 'Admin123!')
+            response = self._post_batch([
+                self._order(3, key='pos-1'),
+                self._order(3),
+                self._order(1, key='pos-1'),
+                self._order(1, payment_method='crypto'),
+                self._order(2, key='pos-2'),
+            ])
+            self.assertEqual(response.status_code, 200)
+            body = response.get_json()
+
+        statuses = [r['status'] for r in body['results']]
+        self.assertEqual(statuses, ['created', 'rejected', 'duplicate', 'rejected', 'created'])
+        self.assertIn('Not enough Tapioca Pearls', body['results'][1]['error'])
+        self.assertEqual(body['results'][2]['order_id'], body['results'][0]['order_id'])
+        self.assertEqual(body['results'][0]['total_amount'], 2400.0)
+
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 2)
+            self.assertEqual(OrderItem.query.count(), 2)
+            self.assertEqual(Ingredient.query.first().stock_quantity, Decimal('0'))
+            self.assertFalse(Product.query.first().is_available)
+
+    def test_batch_rejects_malformed_customer_fields(self):
+        """Неверный тип телефона, имени или заметки отклоняет только этот заказ"""
+        with self.client:
+            self._login('pos_admin', 'Admin123!')
+            response = self._post_batch([
+                {**self._order(1), 'customer_phone': 77010000000},
+                {**self._order(1), 'customer_name': ['Client']},
+                {**self._order(1), 'notes': {'text': 'no ice'}},
+                {**self._order(1), 'customer_phone': '+7' * 20},
+                self._order(1),
+            ])
+            self.assertEqual(response.status_code, 200)
+            results = response.get_json()['results']
+
+        self.assertEqual([r['status'] for r in results], ['rejected'] * 4 + ['created'])
+        self.assertEqual(results[0]['error'], 'customer_phone must be a string')
+        self.assertEqual(results[3]['error'], 'customer_phone is too long')
+
+    def test_batch_replay_reports_duplicates(self):
+        """Повторная отправка пачки возвращает уже созданные заказы"""
+        with self.client:
+            self._login('pos_admin', 'Admin123!')
+            first = self._post_batch([self._order(1, key='buffered-1')]).get_json()
+            replay = self._post_batch([self._order(1, key='buffered-1')]).get_json()
+
+        self.assertEqual(replay['duplicates'], 1)
+        self.assertEqual(replay['results'][0]['order_id'], first['results'][0]['order_id'])
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 1)
+            self.assertEqual(Ingredient.query.first().stock_quantity, Decimal('400'))
+
+    def test_batch_reports_constraint_violations(self):
+        """Гонка по ключу — 409 про ключ; удалённый клиент — 409 и сброс его из LRU"""
+        application.customer_cache.set('+77010000088', (999999, 'Deleted Client'))
+        violations = {
+            'UNIQUE constraint failed: idempotency_keys.user_id, idempotency_keys.idempotency_key':
+                'Idempotency key used concurrently, retry',
+            'FOREIGN KEY constraint failed': 'Customer, product or employee no longer exists, retry',
+        }
+        with self.client:
+            self._login('pos_admin', 'Admin123!')
+            for message, error in violations.items():
+                with unittest.mock.patch.object(application, 'deduct_cart_ingredients',
+                                                side_effect=IntegrityError('INSERT', {}, Exception(message))):
+                    response = self._post_batch([{**self._order(1, key='raced'), 'customer_phone': '+77010000088'}])
+                self.assertEqual(response.status_code, 409, message)
+                self.assertEqual(response.get_json()['error'], error)
+        self.assertIsNone(application.customer_cache.get('+77010000088'))
+        with app.app_context():
+            self.assertEqual(Order.query.count(), 0)
+
+    def test_batch_requires_admin(self):
+        """Без входа пакетный API недоступен"""
+        response = self._post_batch([self._order(1)])
+        self.assertNotEqual(response.status_code, 200)
+
+
+# ============================================================
+# ТЕСТ 10: SERVER-SENT EVENTS (СТАТУСЫ ЗАКАЗОВ И УВЕДОМЛЕНИЯ)
+# ============================================================
+
+class TestEventStream(BaseTestCase):
+    """
+    Тестирует поток событий /api/events:
+    - события рассылаются только после коммита
+    - смена статуса заказа публикует order_status
+    - SSE-ответ отдаёт события подписчику
+    """
+
+    def _subscribe(self):
+        with app.app_context():
+            subscriber = application.event_broker.subscribe()
+        self.addCleanup(application.event_broker.unsubscribe, subscriber)
+        return subscriber
+
+    def test_notification_published_only_after_commit(self):
+        """Откат отменяет событие, коммит — доставляет"""
+        subscriber = self._subscribe()
+        with app.app_context():
+            create_notification('Rolled back', 'msg', commit=False)
+            db.session.rollback()
+            self.assertTrue(subscriber.empty())
+
+            create_notification('Committed', 'msg', category='inventory')
+            event_data = subscriber.get_nowait()
+        self.assertEqual(event_data['type'], 'notification')
+        self.assertEqual(event_data['data']['title'], 'Committed')
+        self.assertTrue(subscriber.empty())
+
+    def test_order_status_change_is_streamed(self):
+        """PUT статуса отправляет order_status в открытый SSE-поток"""
+        self._create_admin(username='sse_admin', password='Admin123!')
+        with app.app_context():
+            product_id = Product.query.first().product_id
+        self.client.post('/order/new', data={
+            'product_id': [product_id], 'quantity': [1], 'payment_method': 'cash'
+        })
+        with app.app_context():
+            order_id = Order.query.first().order_id
+
+        with self.client:
+            self._login('sse_admin', 'Admin123!')
+            stream = self.client.get('/api/events')
+            self.assertEqual(stream.mimetype, 'text/event-stream')
+            chunks = iter(stream.response)
+            self.assertTrue(next(chunks).startswith(b'retry:'))
+
+            self.client.put(f'/api/order/{order_id}/status', json={'status': 'ready'})
+            chunk = next(chunks).decode('utf-8')
+            stream.close()
+
+        self.assertTrue(chunk.startswith('event: order_status'))
+        payload = json.loads(chunk.split('data: ', 1)[1])
+        self.assertEqual(payload['order_id'], order_id)
+        self.assertEqual(payload['status'], 'ready')
+        self.assertEqual(payload['status_text'], 'Готов')
+
+    def test_events_require_login(self):
+        """Аноним не получает поток"""
+        response = self.client.get('/api/events')
+        self.assertNotEqual(response.status_code, 200)
+
+    def test_stream_opened_only_on_live_pages(self):
+        """EventSource открывают только админка и страница заказа"""
+        self._create_admin(username='live_admin', password='Admin123!')
+        with self.client:
+            self._login('live_admin', 'Admin123!')
+            self.assertIn(b'new EventSource', self.client.get('/admin').data)
+            self.assertNotIn(b'new EventSource', self.client.get('/menu').data)
+
+
+# ============================================================
+# ТЕСТ 11: UPSERT КЛИЕНТА ПО ТЕЛЕФОНУ И LRU
+# ============================================================
+
+class TestCustomerUpsert(BaseTestCase):
+    """
+    Тестирует поиск/создание клиента при оформлении заказа:
+    - новый телефон создаёт клиента одним upsert
+    - повторный заказ берёт клиента из LRU без дубликатов
+    - откат транзакции не оставляет клиента в кэше
+    """
+
+    def setUp(self):
+        super().setUp()
+        application.customer_cache.clear()
+
+    def _order(self, phone, name):
+        with app.app_context():
+            product_id = Product.query.first().product_id
+        self.client.post('/order/new', data={
+            'product_id': [product_id], 'quantity': [1], 'payment_method': 'cash',
+            'customer_phone': phone, 'customer_name': name
+        })
+
+    def test_repeat_customer_reuses_row(self):
+        """Два заказа на один номер — один клиент, имя не перезаписывается"""
+        self._order('+77015550001', 'Aida Nurlanovna')
+        self._order('+77015550001', 'Someone Else')
+
+        with app.app_context():
+            customers = Customer.query.filter_by(phone='+77015550001').all()
+            self.assertEqual(len(customers), 1)
+            self.assertEqual(customers[0].full_name, 'Aida Nurlanovna')
+            self.assertEqual([o.customer_id for o in Order.query.all()], [customers[0].customer_id] * 2)
+            self.assertEqual(application.customer_cache.get('+77015550001'),
+                             (customers[0].customer_id, 'Aida Nurlanovna'))
+
+    def test_upsert_on_existing_phone_and_rollback(self):
+        """Upsert по существующему номеру возвращает его; откат не кэшируется"""
+        with app.app_context():
+            existing = Customer(first_name='Old', last_name='Client', phone='+77015550002')
+            db.session.add(existing)
+            db.session.commit()
+            customer_id = existing.customer_id
+
+            self.assertEqual(application.find_or_create_customer('+77015550002', 'New Name'),
+                             (customer_id, 'Old Client'))
+            db.session.commit()
+
+            # Один запрос; существующая строка не перезаписывается (DO UPDATE только created_at)
+            application.customer_cache.clear()
+            statements = []
+            listener = lambda *args: statements.append(args[2])
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                self.assertEqual(application.find_or_create_customer('+77015550002', 'Other Name'),
+                                 (customer_id, 'Old Client'))
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+            self.assertIn('ON CONFLICT (phone) DO UPDATE SET created_at = customers.created_at', statements[0])
+            self.assertIn('RETURNING', statements[0])
+            self.assertEqual(len(statements), 1)
+            db.session.commit()
+
+            application.find_or_create_customer('+77015550003', 'Rolled Back')
+            db.session.rollback()
+            self.assertIsNone(application.customer_cache.get('+77015550003'))
+            self.assertIsNone(application.find_or_create_customer('+77015550003'))
+
+    def test_lru_cache_eviction_and_ttl(self):
+        """LRUCache вытесняет самый старый ключ и соблюдает TTL"""
+        cache = application.LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+        expiring = application.LRUCache(maxsize=2, ttl=0)
+        expiring.set('a', 1)
+        time.sleep(0.01)
+        self.assertIsNone(expiring.get('a'))
+
+
+# ============================================================
+# ТЕСТ 12: КЭШ СТРАНИЦ КАТАЛОГА
+# ============================================================
+
+class TestPageCache(BaseTestCase):
+    """
+    Тестирует кэш отрендеренных страниц /, /menu, /product/<id>:
+    - повторный анонимный запрос не рендерит шаблон заново
+    - правка каталога и смена доступности поднимают версию
+    - авторизованные пользователи обходят кэш
+    """
+
+    def setUp(self):
+        super().setUp()
+        application.page_cache.clear()
+
+    def _render_count(self, *paths):
+        with unittest.mock.patch.object(application, 'render_template', wraps=application.render_template) as render:
+            responses = [self.client.get(path) for path in paths]
+        return render.call_count, responses
+
+    def test_anonymous_pages_rendered_once(self):
+        """Вторая загрузка меню и карточки товара берётся из кэша"""
+        with app.app_context():
+            product_id = Product.query.first().product_id
+        paths = ['/', '/menu', f'/product/{product_id}', '/menu?category=1']
+        renders, first = self._render_count(*paths)
+        self.assertEqual(renders, 4)
+
+        renders, second = self._render_count(*paths)
+        self.assertEqual(renders, 0)
+        self.assertEqual([r.data for r in first], [r.data for r in second])
+
+        renders, _ = self._render_count('/product/999999')
+        renders_again, _ = self._render_count('/product/999999')
+        self.assertEqual((renders, renders_again), (1, 1))
+
+    def test_catalog_changes_bump_version(self):
+        """Переименование товара и смена доступности сразу видны в меню"""
+        self.client.get('/menu')
+        with app.app_context():
+            Product.query.first().product_name = 'Renamed Boba'
+            db.session.commit()
+        self.assertIn('Renamed Boba', self.client.get('/menu').get_data(as_text=True))
+
+        version = application.catalog_version
+        with app.app_context():
+            ingredient = Ingredient.query.first()
+            db.session.add(ProductIngredient(product_id=Product.query.first().product_id,
+                                             ingredient_id=ingredient.ingredient_id, quantity=Decimal('1000')))
+            db.session.commit()
+            application.update_product_availability([ingredient.ingredient_id])
+        self.assertEqual(application.catalog_version, version + 2)
+        self.assertNotIn('Renamed Boba', self.client.get('/menu').get_data(as_text=True))
+
+    def test_authenticated_users_bypass_cache(self):
+        """Для вошедшего пользователя страница рендерится каждый раз"""
+        self._create_admin(username='cache_admin', password='Admin123!')
+        with self.client:
+            self._login('cache_admin', 'Admin123!')
+            renders, _ = self._render_count('/menu', '/menu')
+        self.assertEqual(renders, 2)
+
+
+# ============================================================
+# ТЕСТ 13: EAGER LOADING И БЮДЖЕТ ЗАПРОСОВ
+# ============================================================
+
+class TestQueryBudget(BaseTestCase):
+    """
+    Тестирует защиту от N+1:
+    - число запросов страниц не растёт с числом строк
+    - превышение бюджета маршрута в тестовом режиме — ошибка
+    """
+
+    def _seed_catalog(self, count):
+        with app.app_context():
+            categories = [Category(category_name=f'Category {i}') for i in range(count)]
+            db.session.add_all(categories)
+            db.session.flush()
+            db.session.add_all([
+                Product(product_name=f'Drink {i}', category_id=category.category_id,
+                        price=Decimal('900'), is_available=True)
+                for i, category in enumerate(categories)
+            ])
+            db.session.commit()
+            return [p.product_id for p in Product.query.all()]
+
+    def _query_count(self, path):
+        response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return int(response.headers['X-Query-Count'])
+
+    def test_query_count_independent_of_rows(self):
+        """Меню, API и детали заказа — одинаковое число запросов для 1 и 10 позиций"""
+        self._create_admin(username='budget_admin', password='Admin123!')
+        product_ids = self._seed_catalog(10)
+        for quantity_of_lines in (1, len(product_ids)):
+            lines = product_ids[:quantity_of_lines]
+            self.client.post('/order/new', data={
+                'product_id': lines, 'quantity': [1] * len(lines), 'payment_method': 'card'
+            })
+
+        with self.client:
+            self._login('budget_admin', 'Admin123!')
+            self.client.get('/menu')
+            self.client.get('/api/products')
+            self.assertEqual(self._query_count('/order/1'), self._query_count('/order/2'))
+            self.assertLessEqual(self._query_count('/menu'), 3)
+            self.assertLessEqual(self._query_count('/api/products'), 2)
+            self.assertLessEqual(self._query_count('/orders'), 3)
+
+    def test_budget_exceeded_raises_in_testing(self):
+        """Маршрут сверх бюджета падает с QueryBudgetExceeded"""
+        application.page_cache.clear()
+        with unittest.mock.patch.object(app.view_functions['menu'], 'query_budget', 1):
+            with self.assertRaises(application.QueryBudgetExceeded):
+                self.client.get('/menu')
+
+
+# ============================================================
+# ТЕСТ 14: ETAG И CONDITIONAL GET ДЛЯ КАТАЛОГА
+# ============================================================
+
+class TestConditionalGet(BaseTestCase):
+    """
+    Тестирует ETag / If-None-Match на /api/products, /menu, /product/<id>:
+    - совпавший ETag даёт 304 без тела
+    - Cache-Control разрешает кэширование прокси
+    - изменение каталога меняет ETag
+    """
+
+    def setUp(self):
+        super().setUp()
+        application.page_cache.clear()
+        with app.app_context():
+            self.product_id = Product.query.first().product_id
+
+    def test_not_modified_on_matching_etag(self):
+        """Повтор с If-None-Match получает 304"""
+        for path in ('/api/products', '/menu', f'/product/{self.product_id}'):
+            first = self.client.get(path)
+            self.assertEqual(first.status_code, 200)
+            self.assertTrue(first.headers.get('ETag'))
+            self.assertIn('public', first.headers['Cache-Control'])
+
+            again = self.client.get(path, headers={'If-None-Match': first.headers['ETag']})
+            self.assertEqual(again.status_code, 304, path)
+            self.assertEqual(again.data, b'')
+
+        self.assertIn('Cookie', self.client.get('/menu').headers.get('Vary', ''))
+
+    def test_catalog_change_changes_etag(self):
+        """После изменения цены старый ETag больше не совпадает"""
+        etag = self.client.get('/api/products').headers['ETag']
+        with app.app_context():
+            Product.query.first().price = Decimal('950')
+            db.session.commit()
+
+        response = self.client.get('/api/products', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response.headers['ETag'], etag)
+        self.assertEqual(response.get_json()[0]['price'], 950.0)
+
+
+# ============================================================
+# ТЕСТ 15: СНИМОК КАТАЛОГА ДЛЯ /api/products
+# ============================================================
+
+class TestCatalogSnapshot(BaseTestCase):
+    """
+    Тестирует /api/products поверх CatalogSnapshot:
+    - фильтры category / min_price / max_price и выбор полей
+    - gzip для клиентов с Accept-Encoding: gzip
+    - повторные запросы не обращаются к БД
+    """
+
+    def setUp(self):
+        super().setUp()
+        with app.app_context():
+            tea = Category(category_name='Tea')
+            db.session.add(tea)
+            db.session.flush()
+            db.session.add_all([
+                Product(product_name='Cheap Tea', category_id=tea.category_id, price=Decimal('500'), is_available=True),
+                Product(product_name='Royal Tea', category_id=tea.category_id, price=Decimal('1500'), is_available=True),
+                Product(product_name='Hidden Tea', category_id=tea.category_id, price=Decimal('700'), is_available=False),
+            ])
+            db.session.commit()
+            self.tea_id = tea.category_id
+
+    def test_filters_and_fields(self):
+        """Фильтры применяются к снимку, fields выбирает колонки"""
+        names = [p['name'] for p in self.client.get(f'/api/products?category={self.tea_id}').get_json()]
+        self.assertEqual(names, ['Cheap Tea', 'Royal Tea'])
+
+        response = self.client.get(f'/api/products?min_price=600&max_price=1000&fields=name,price')
+        self.assertEqual(response.get_json(), [{'name': 'Test Boba', 'price': 800.0}])
+
+        bad = self.client.get('/api/products?fields=name,secret')
+        self.assertEqual(bad.status_code, 400)
+
+    def test_gzip_and_no_queries_when_warm(self):
+        """Сжатый ответ совпадает с несжатым; тёплый снимок — без SQL"""
+        plain = self.client.get('/api/products')
+        packed = self.client.get('/api/products', headers={'Accept-Encoding': 'gzip'})
+        self.assertEqual(packed.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(packed.data), plain.data)
+        self.assertNotEqual(packed.headers['ETag'], plain.headers['ETag'])
+        self.assertIn('Accept-Encoding', plain.headers['Vary'])
+
+        self.assertEqual(self.client.get('/api/products').headers['X-Query-Count'], '0')
+
+        with app.app_context():
+            Product.query.filter_by(product_name='Hidden Tea').first().is_available = True
+            db.session.commit()
+        self.assertEqual(len(self.client.get('/api/products').get_json()), 4)
+
+    def test_body_reused_while_rendered_stock_unchanged(self):
+        """Списание, не меняющее available_quantity, не пересобирает ответ"""
+        snapshot = application.catalog_snapshot
+        with app.app_context():
+            boba = Product.query.filter_by(product_name='Test Boba').first()
+            tapioca = Ingredient.query.filter_by(ingredient_name='Tapioca Pearls').first()
+            db.session.add(ProductIngredient(product_id=boba.product_id, ingredient_id=tapioca.ingredient_id,
+                                             quantity=Decimal('200')))
+            db.session.commit()
+
+            first = snapshot.render()
+            tea_only = snapshot.render(category_id=self.tea_id)
+            self.assertIn(b'"available_quantity":2', first[0])
+
+            tapioca.use(Decimal('50'))  # 450 // 200 — всё ещё 2
+            db.session.commit()
+            self.assertIs(snapshot.render(), first)
+
+            tapioca.use(Decimal('300'))  # 150 // 200 = 0
+            db.session.commit()
+            self.assertIn(b'"available_quantity":0', snapshot.render()[0])
+            self.assertIs(snapshot.render(category_id=self.tea_id), tea_only)
+
+
+# ============================================================
+# ТЕСТ 16: ОБРАБОТКА ФОТО ПРОДУКТОВ (RESIZE, AVIF/WEBP, SRCSET)
+# ============================================================
+
+@unittest.skipUnless(image_processor.PIL_AVAILABLE, 'Pillow не установлен')
+class TestImagePipeline(BaseTestCase):
+    """
+    Тестирует фоновую обработку фото:
+    - загрузка в админке ставит событие 'image' в outbox
+    - диспетчер создаёт варианты по ширинам и сохраняет их в продукте
+    - меню отдаёт <picture> со srcset
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.upload_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.upload_dir)
+        patcher = unittest.mock.patch.dict(app.config, {'UPLOAD_FOLDER': self.upload_dir})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        application.page_cache.clear()
+        self._create_admin(username='image_admin', password='Admin123!')
+
+    def _upload(self, width=800, height=600, name='Photo Boba', color=(200, 120, 60)):
+        buffer = io.BytesIO()
+        image_processor.Image.new('RGB', (width, height), color).save(buffer, 'PNG')
+        buffer.seek(0)
+        with app.app_context():
+            category_id = Category.query.first().category_id
+        with self.client:
+            self._login('image_admin', 'Admin123!')
+            self.client.post('/admin/product/add', data={
+                'product_name': name, 'category_id': category_id, 'price': '900',
+                'preparation_time': '5', 'is_available': 'on',
+                'image': (buffer, 'photo.png')
+            }, content_type='multipart/form-data')
+            self.client.get('/logout')
+
+    def test_upload_is_processed_in_background(self):
+        """Варианты появляются только после обработки outbox"""
+        self._upload(width=800)
+        with app.app_context():
+            product = Product.query.filter_by(product_name='Photo Boba').first()
+            self.assertIsNone(product.image_variants)
+            event = OutboxEvent.query.filter_by(event_type='image').one()
+            self.assertEqual(json.loads(event.payload)['product_id'], product.product_id)
+
+            self.assertEqual(outbox_dispatcher.drain_outbox(batch_size=10), 1)
+            self.assertEqual(OutboxEvent.query.filter_by(event_type='image').one().status, 'sent')
+
+            variants = json.loads(db.session.get(Product, product.product_id).image_variants)
+        self.assertEqual(set(variants), set(image_processor.available_formats()))
+        self.assertEqual([width for width, _ in variants['webp']], [320, 640, 800])
+        for width, url in variants['webp']:
+            path = os.path.join(self.upload_dir, os.path.basename(url))
+            with image_processor.Image.open(path) as variant:
+                self.assertEqual((variant.format, variant.width), ('WEBP', width))
+
+        html = self.client.get('/menu').get_data(as_text=True)
+        self.assertIn('<picture>', html)
+        self.assertIn('-640.webp 640w', html)
+
+    def test_identical_uploads_share_one_file(self):
+        """Одинаковые байты хранятся один раз, варианты переиспользуются"""
+        self._upload(name='First')
+        with app.app_context():
+            outbox_dispatcher.drain_outbox(batch_size=10)
+        self._upload(name='Second')
+
+        with app.app_context():
+            first, second = (Product.query.filter_by(product_name=n).one() for n in ('First', 'Second'))
+            self.assertEqual(first.image_url, second.image_url)
+            self.assertRegex(os.path.basename(first.image_url), application.HASHED_IMAGE_RE)
+            self.assertEqual(first.image_variants, second.image_variants)
+            self.assertEqual(OutboxEvent.query.filter_by(event_type='image').count(), 1)
+        originals = [n for n in os.listdir(self.upload_dir) if n.endswith('.png')]
+        self.assertEqual(len(originals), 1)
+
+    def test_gc_removes_only_unreferenced_files(self):
+        """GC удаляет старое фото после замены, но не свежие файлы"""
+        self._upload(name='Swapped', color=(10, 10, 10))
+        with app.app_context():
+            old_name = os.path.basename(Product.query.filter_by(product_name='Swapped').one().image_url)
+            Product.query.filter_by(product_name='Swapped').one().image_url = None
+            db.session.commit()
+
+            self.assertEqual(application.collect_unreferenced_images(), [])
+            self.assertEqual(application.collect_unreferenced_images(grace_seconds=-1, dry_run=True), [old_name])
+            self.assertTrue(os.path.exists(os.path.join(self.upload_dir, old_name)))
+            application.collect_unreferenced_images(grace_seconds=-1)
+        self.assertFalse(os.path.exists(os.path.join(self.upload_dir, old_name)))
+
+    def test_gc_keeps_files_without_content_hash(self):
+        """README.md и старые фото с ручными именами GC не удаляет"""
+        for name in ('README.md', 'mango-fresh.jpg', '0123456789abcdef0123456789abcdef.txt'):
+            with open(os.path.join(self.upload_dir, name), 'w') as f:
+                f.write('keep')
+        with app.app_context():
+            self.assertEqual(application.collect_unreferenced_images(grace_seconds=-1), [])
+        self.assertEqual(len(os.listdir(self.upload_dir)), 3)
+
+    def test_reused_file_is_protected_from_gc(self):
+        """Повторная загрузка старого файла без ссылок обновляет его mtime"""
+        self._upload(name='Old', color=(1, 2, 3))
+        with app.app_context():
+            product = Product.query.filter_by(product_name='Old').one()
+            path = os.path.join(self.upload_dir, os.path.basename(product.image_url))
+            product.image_url = None
+            db.session.commit()
+        stale = time.time() - app.config['IMAGE_GC_GRACE'] - 10
+        os.utime(path, (stale, stale))
+
+        self._upload(name='New', color=(1, 2, 3))
+        self.assertGreater(os.stat(path).st_mtime, stale + 10)
+        with app.app_context():
+            self.assertEqual(application.collect_unreferenced_images(), [])
+
+    def test_hashed_images_are_immutable(self):
+        """Файлы с хэшем в имени отдаются с годовым Cache-Control"""
+        static_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, static_dir)
+        os.makedirs(os.path.join(static_dir, 'images', 'products'))
+        for name in ('0123456789abcdef0123456789abcdef-320.webp', 'legacy.jpg'):
+            with open(os.path.join(static_dir, 'images', 'products', name), 'wb') as f:
+                f.write(b'img')
+
+        self.addCleanup(setattr, app, 'static_folder', app.static_folder)
+        app.static_folder = static_dir
+        hashed = self.client.get('/static/images/products/0123456789abcdef0123456789abcdef-320.webp')
+        legacy = self.client.get('/static/images/products/legacy.jpg')
+        self.assertIn('immutable', hashed.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', hashed.headers['Cache-Control'])
+        self.assertNotIn('immutable', legacy.headers.get('Cache-Control', ''))
+
+
+# ============================================================
+# ТЕСТ 17: ХЭШИРОВАННЫЕ И ЗАРАНЕЕ СЖАТЫЕ CSS/JS
+# ============================================================
+
+class TestStaticAssets(BaseTestCase):
+    """
+    Тестирует сборку статики:
+    - url_for отдаёт имя с хэшем содержимого
+    - сервер выбирает .br/.gz по Accept-Encoding
+    - собранные файлы кэшируются на год
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.static_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_dir)
+        os.makedirs(os.path.join(self.static_dir, 'css'))
+        with open(os.path.join(self.static_dir, 'css', 'style.css'), 'w') as f:
+            f.write('body { color: #333; }\n' * 50)
+
+        self.addCleanup(setattr, app, 'static_folder', app.static_folder)
+        app.static_folder = self.static_dir
+        manifest = static_assets.build(self.static_dir)
+        patcher = unittest.mock.patch.object(application, 'static_manifest', manifest)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.hashed_url = '/static/' + manifest['css/style.css']
+
+    def test_url_for_uses_hashed_name(self):
+        """url_for('static') подставляет путь из манифеста"""
+        with app.test_request_context():
+            self.assertEqual(application.url_for('static', filename='css/style.css'), self.hashed_url)
+            self.assertEqual(application.url_for('static', filename='images/logo.png'), '/static/images/logo.png')
+
+    def test_rebuild_keeps_previous_version(self):
+        """После изменения файла меняется хэш; предыдущая версия остаётся для rolling deploy"""
+        dist_css = os.path.join(self.static_dir, 'dist', 'css')
+        per_version = 3 if static_assets.BROTLI_AVAILABLE else 2
+
+        def rebuild(css, grace_seconds=0):
+            with open(os.path.join(self.static_dir, 'css', 'style.css'), 'a') as f:
+                f.write(css)
+            return static_assets.build(self.static_dir, grace_seconds=grace_seconds)
+
+        manifest = rebuild('h1 { color: red; }\n')
+        self.assertNotEqual('/static/' + manifest['css/style.css'], self.hashed_url)
+        self.assertEqual(static_assets.load_manifest(self.static_dir), manifest)
+        self.assertEqual(self.client.get(self.hashed_url).status_code, 200)
+
+        # Перезапуск без изменений не удаляет предыдущую версию
+        static_assets.build(self.static_dir, grace_seconds=0)
+        self.assertEqual(len(os.listdir(dist_css)), 2 * per_version)
+
+        # Третья версия: первая удаляется (grace истёк), вторая остаётся
+        rebuild('h2 { color: blue; }\n', grace_seconds=3600)
+        self.assertEqual(len(os.listdir(dist_css)), 3 * per_version)
+        rebuild('h3 { color: green; }\n')
+        self.assertEqual(len(os.listdir(dist_css)), 2 * per_version)
+        self.assertNotIn(os.path.basename(self.hashed_url), os.listdir(dist_css))
+
+    def test_precompressed_variant_by_accept_encoding(self):
+        """gzip-клиент получает .gz, клиент без сжатия — исходный файл"""
+        plain = self.client.get(self.hashed_url, headers={'Accept-Encoding': 'identity'})
+        gzipped = self.client.get(self.hashed_url, headers={'Accept-Encoding': 'gzip'})
+        self.assertIsNone(plain.headers.get('Content-Encoding'))
+        self.assertEqual(gzipped.headers['Content-Encoding'], 'gzip')
+        self.assertEqual(gzipped.mimetype, 'text/css')
+        self.assertEqual(gzip.decompress(gzipped.data), plain.data)
+        self.assertIn('Accept-Encoding', gzipped.headers['Vary'])
+
+        if static_assets.BROTLI_AVAILABLE:
+            brotli = self.client.get(self.hashed_url, headers={'Accept-Encoding': 'gzip, br'})
+            self.assertEqual(brotli.headers['Content-Encoding'], 'br')
+            self.assertEqual(static_assets.brotli.decompress(brotli.data), plain.data)
+
+    def test_import_does_not_build(self):
+        """Импорт app не собирает статику: манифест читается лениво, сборка — командой"""
+        application.static_manifest = None
+        with unittest.mock.patch.object(static_assets, 'build') as build:
+            with app.test_request_context():
+                self.assertEqual(application.url_for('static', filename='css/style.css'), self.hashed_url)
+            build.assert_not_called()
+            result = app.test_cli_runner().invoke(args=['build-static'])
+        build.assert_called_once_with(self.static_dir)
+        self.assertEqual(result.exit_code, 0)
+
+    def test_hashed_assets_are_immutable(self):
+        """Собранные ассеты кэшируются на год, исходные — нет"""
+        hashed = self.client.get(self.hashed_url)
+        source = self.client.get('/static/css/style.css')
+        self.assertIn('immutable', hashed.headers['Cache-Control'])
+        self.assertIn('max-age=31536000', hashed.headers['Cache-Control'])
+        self.assertNotIn('immutable', source.headers.get('Cache-Control', ''))
+
+
+# ============================================================
+# ТЕСТ 18: ПОДСКАЗКИ ПРИ НАБОРЕ (/api/suggest)
+# ============================================================
+
+class TestSuggest(BaseTestCase):
+    """
+    Тестирует /api/suggest:
+    - продукты находятся по части слова, не больше limit
+    - клиенты по части телефона и имени — только администратору
+    - повторный префикс берётся из кэша без SQL
+    """
+
+    def setUp(self):
+        super().setUp()
+        application.suggest_cache.clear()
+        application.customer_suggest_cache.clear()
+        with app.app_context():
+            category_id = Category.query.first().category_id
+            for name in ('Taro Milk Tea', 'Brown Sugar Milk', 'Matcha Latte'):
+                db.session.add(Product(product_name=name, category_id=category_id,
+                                       price=Decimal('900'), is_available=True))
+            db.session.add(Customer(first_name='Olga', last_name='Volkova', phone='+7-911-111-4567'))
+            db.session.add(Customer(first_name='Sergey', last_name='Novikov', phone='+7-911-222-2222'))
+            db.session.commit()
+        self._create_admin(username='suggest_admin', password='Admin123!')
+
+    def test_partial_product_name(self):
+        """'milk' находит оба продукта, limit обрезает выдачу"""
+        data = self.client.get('/api/suggest?q=milk').get_json()
+        self.assertEqual(sorted(p['product_name'] for p in data['products']),
+                         ['Brown Sugar Milk', 'Taro Milk Tea'])
+        self.assertNotIn('customers', data)
+
+        limited = self.client.get('/api/suggest?q=milk&limit=1').get_json()
+        self.assertEqual(len(limited['products']), 1)
+        self.assertEqual(self.client.get('/api/suggest?q=m').get_json()['products'], [])
+
+    def test_like_wildcards_are_escaped(self):
+        """% в запросе ищется буквально"""
+        self.assertEqual(self.client.get('/api/suggest?q=%25%25').get_json()['products'], [])
+
+    def test_customers_require_admin(self):
+        """Аноним не получает клиентов, администратор ищет по части номера и имени"""
+        self.assertEqual(self.client.get('/api/suggest?q=4567&type=customers').status_code, 403)
+        with self.client:
+            self._login('suggest_admin', 'Admin123!')
+            by_phone = self.client.get('/api/suggest?q=111-45&type=customers').get_json()
+            self.assertEqual([c['full_name'] for c in by_phone['customers']], ['Olga Volkova'])
+            by_name = self.client.get('/api/suggest?q=ga volk&type=customers').get_json()
+            self.assertEqual([c['phone'] for c in by_name['customers']], ['+7-911-111-4567'])
+
+    def test_hot_prefix_served_from_cache(self):
+        """Повторный запрос не ходит в БД; изменение каталога сбрасывает кэш"""
+        first = self.client.get('/api/suggest?q=matcha')
+        second = self.client.get('/api/suggest?q=Matcha')
+        self.assertEqual(first.get_json()['products'], second.get_json()['products'])
+        self.assertEqual(second.headers['X-Query-Count'], '0')
+
+        with app.app_context():
+            Product.query.filter_by(product_name='Matcha Latte').one().product_name = 'Matcha Cream'
+            db.session.commit()
+        renamed = self.client.get('/api/suggest?q=matcha').get_json()
+        self.assertEqual([p['product_name'] for p in renamed['products']], ['Matcha Cream'])
+
+    def test_customer_from_checkout_upsert_clears_suggestions(self):
+        """Клиент, созданный upsert при заказе, сразу виден в подсказках"""
+        with self.client:
+            self._login('suggest_admin', 'Admin123!')
+            self.assertEqual(self.client.get('/api/suggest?q=aida&type=customers').get_json()['customers'], [])
+            self.client.get('/api/suggest?q=4567&type=customers')
+            with app.app_context():
+                Product.query.filter_by(product_name='Taro Milk Tea').one().price = Decimal('950')
+                db.session.commit()
+            # Изменение каталога не сбрасывает клиентов (1 запрос — загрузка пользователя)
+            self.assertEqual(self.client.get('/api/suggest?q=4567&type=customers').headers['X-Query-Count'], '1')
+
+            with app.app_context():
+                product_id = Product.query.first().product_id
+            self.client.post('/order/new', data={
+                'product_id': [product_id], 'quantity': [1], 'payment_method': 'cash',
+                'customer_phone': '+77015550019', 'customer_name': 'Aida Nurlanovna'
+            })
+            found = self.client.get('/api/suggest?q=aida&type=customers').get_json()['customers']
+        self.assertEqual([c['phone'] for c in found], ['+77015550019'])
+
+
+# ============================================================
+# ТЕСТ 19: ПОСТРАНИЧНЫЙ ПОИСК С KEYSET-КУРСОРОМ
+# ============================================================
+
+class TestSearchPagination(BaseTestCase):
+    """
+    Тестирует /api/search/*:
+    - limit и курсор передаются в SQL-функцию (limit + 1 строк)
+    - next_cursor содержит ключ сортировки последней строки
+    - неверные limit/cursor отклоняются до запроса к БД
+    (search_*() есть только в PostgreSQL, поэтому execute подменяется)
+    """
+
+    ORDER_ROWS = [
+        (3, datetime(2024, 3, 1, 12, 30), 'Guest', 'Test Employee', Decimal('800'), 'completed', 'card', 0.5),
+        (2, datetime(2024, 3, 1, 11, 0), 'Guest', 'Test Employee', Decimal('900'), 'completed', 'cash', 0.5),
+        (1, datetime(2024, 2, 1, 10, 0), 'Guest', 'Test Employee', Decimal('700'), 'completed', 'card', 0.25),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self._create_admin(username='search_admin', password='Admin123!')
+
+    def _search(self, url, rows, username='search_admin', password='Admin123!'):
+        result = unittest.mock.Mock()
+        result.fetchmany.side_effect = lambda size: rows[:size]
+        with self.client:
+            self._login(username, password)
+            with unittest.mock.patch.object(db.session, 'execute', return_value=result) as execute:
+                response = self.client.get(url)
+            self.client.get('/logout')
+        return response, execute
+
+    def test_limit_and_next_cursor(self):
+        """Страница из limit строк и курсор по последней из них"""
+        response, execute = self._search('/api/search/orders?q=completed&limit=2', self.ORDER_ROWS)
+        data = response.get_json()
+        self.assertEqual([r['order_id'] for r in data['results']], [3, 2])
+        self.assertEqual(data['count'], 2)
+        self.assertEqual(application.decode_search_cursor(data['next_cursor'], 3),
+                         [0.5, '2024-03-01T11:00:00', 2])
+
+        statement, params = execute.call_args[0]
+        self.assertIn('search_orders(', str(statement))
+        self.assertEqual(params['limit'], 3)
+        self.assertIsNone(params['after_id'])
+
+    def test_cursor_is_passed_to_sql(self):
+        """Курсор раскладывается в параметры after_*; последняя страница без курсора"""
+        cursor = application.encode_search_cursor([0.5, '2024-03-01T11:00:00', 2])
+        response, execute = self._search(f'/api/search/orders?q=completed&limit=2&cursor={cursor}',
+                                         self.ORDER_ROWS[2:])
+        params = execute.call_args[0][1]
+        self.assertEqual((params['after_relevance'], params['after_date'], params['after_id']),
+                         (0.5, '2024-03-01T11:00:00', 2))
+        self.assertIsNone(response.get_json()['next_cursor'])
+
+    def test_invalid_limit_and_cursor(self):
+        """limit вне диапазона и испорченный курсор — 400 без SQL"""
+        for url in ('/api/search/products?q=tea&limit=0',
+                    '/api/search/products?q=tea&limit=1000',
+                    '/api/search/products?q=tea&cursor=not-a-cursor',
+                    '/api/search/products?q=tea&cursor=' + application.encode_search_cursor([1, 2])):
+            response, execute = self._search(url, [])
+            self.assertEqual(response.status_code, 400, url)
+            execute.assert_not_called()
+
+    def test_user_searches_only_own_orders(self):
+        """Не-администратор ищет только свои заказы (owner_id в SQL), администратор — все"""
+        with app.app_context():
+            user = User(username='search_user', email='search_user@test.com', role='user')
+            user.set_password('User123!')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+
+        response, execute = self._search('/api/search/orders?q=completed', self.ORDER_ROWS[:1],
+                                         username='search_user', password='User123!')
+        self.assertEqual(response.status_code, 200)
+        statement, params = execute.call_args[0]
+        self.assertIn('CAST(:owner_id AS INTEGER)', str(statement))
+        self.assertEqual(params['owner_id'], user_id)
+
+        _, execute = self._search('/api/search/orders?q=completed', self.ORDER_ROWS[:1])
+        self.assertIsNone(execute.call_args[0][1]['owner_id'])
+
+        response, execute = self._search('/api/search/customers?q=tea', [],
+                                         username='search_user', password='User123!')
+        self.assertEqual(response.status_code, 403)
+        execute.assert_not_called()
+
+    def test_private_entities_require_access(self):
+        """Аноним не ищет клиентов, заказы и сотрудников"""
+        for entity in ('customers', 'orders', 'employees'):
+            self.assertEqual(self.client.get(f'/api/search/{entity}?q=tea').status_code, 403, entity)
+
+
+# ============================================================
+# ТЕСТ 20: ОБЩИЙ ПОИСК ПО ВСЕМ СУЩНОСТЯМ (/api/search)
+# ============================================================
+
+class TestUnifiedSearch(BaseTestCase):
+    """
+    Тестирует /api/search:
+    - сущности ищутся параллельно и сливаются по relevance
+    - сущность, не успевшая к дедлайну, попадает в timed_out
+    """
+
+    ROWS = {
+        'products': [(1, 'Taro Milk Tea', 'Drinks', Decimal('900'), None, 0.3)],
+        'customers': [(7, 'Olga Volkova', '+7-911-111-1111', None, 10, 0.9)],
+        'orders': [(5, datetime(2024, 3, 1), 'Guest', 'Test Employee', Decimal('800'), 'completed', 'card', 0.6)],
+        'employees': [],
+    }
+
+    def setUp(self):
+        super().setUp()
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+        self.threads = set()
+        self.owners = {}
+
+    def _fake_search(self, slow=()):
+        def run_search(entity, query, limit, after=None, owner_id=None):
+            self.threads.add(threading.get_ident())
+            self.owners[entity] = owner_id
+            if entity in slow:
+                self.release.wait(5)
+            return self.ROWS[entity][:limit]
+        return unittest.mock.patch.object(application, 'run_search', side_effect=run_search)
+
+    def test_results_merged_by_relevance(self):
+        """Результаты всех сущностей в одном списке, по убыванию relevance"""
+        self._create_admin(username='unified_admin', password='Admin123!')
+        with self.client, self._fake_search():
+            self._login('unified_admin', 'Admin123!')
+            data = self.client.get('/api/search?q=tea').get_json()
+        self.assertEqual([(r['type'], r['relevance']) for r in data['results']],
+                         [('customers', 0.9), ('orders', 0.6), ('products', 0.3)])
+        self.assertEqual(data['counts'], {'products': 1, 'customers': 1, 'orders': 1, 'employees': 0})
+        self.assertEqual(data['timed_out'], [])
+        self.assertNotIn(threading.get_ident(), self.threads)
+
+    def test_deadline_caps_latency(self):
+        """Медленная сущность не задерживает ответ дольше SEARCH_DEADLINE"""
+        self._create_admin(username='deadline_admin', password='Admin123!')
+        with self.client, unittest.mock.patch.dict(app.config, {'SEARCH_DEADLINE': 0.2}), \
+                self._fake_search(slow=('orders',)):
+            self._login('deadline_admin', 'Admin123!')
+            started = time.monotonic()
+            data = self.client.get('/api/search?q=tea&types=products,orders').get_json()
+            elapsed = time.monotonic() - started
+            self.release.set()
+        self.assertLess(elapsed, 2)
+        self.assertEqual(data['timed_out'], ['orders'])
+        self.assertEqual([r['type'] for r in data['results']], ['products'])
+
+    def test_unknown_type_rejected(self):
+        """Неизвестный тип — 400"""
+        self.assertEqual(self.client.get('/api/search?q=tea&types=products,users').status_code, 400)
+
+    def test_user_searches_own_orders(self):
+        """Пользователь ищет продукты и свои заказы; поток получает его user_id"""
+        with app.app_context():
+            user = User(username='unified_user', email='unified_user@test.com', role='user')
+            user.set_password('User123!')
+            db.session.add(user)
+            db.session.commit()
+            user_id = user.user_id
+        with self.client, self._fake_search():
+            self._login('unified_user', 'User123!')
+            data = self.client.get('/api/search?q=tea').get_json()
+        self.assertEqual(data['counts'], {'products': 1, 'orders': 1})
+        self.assertEqual(self.owners, {'products': None, 'orders': user_id})
+
+    def test_anonymous_searches_products_only(self):
+        """Аноним получает только продукты; закрытые типы даже не запускаются"""
+        with self._fake_search() as run_search:
+            data = self.client.get('/api/search?q=tea').get_json()
+            explicit = self.client.get('/api/search?q=tea&types=customers,employees').get_json()
+        self.assertEqual([r['type'] for r in data['results']], ['products'])
+        self.assertEqual(data['counts'], {'products': 1})
+        self.assertEqual(explicit['results'], [])
+        self.assertEqual([c.args[0] for c in run_search.call_args_list], ['products'])
+
+
+# ============================================================
+# ТЕСТ 21: ДНЕВНЫЕ ИТОГИ ПРОДАЖ (ROLLUP)
+# ============================================================
+
+class TestSalesRollup(BaseTestCase):
+    """
+    Тестирует daily_sales / product_daily_sales:
+    - переход в 'completed' добавляет заказ в итоги, выход — вычитает
+    - /analytics читает только итоги
+    - rebuild_sales_rollup() даёт тот же результат
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._create_admin(username='sales_admin', password='Admin123!')
+
+    def _order(self, quantity=2, day=datetime(2024, 3, 1, 12, 0), status='pending'):
+        with app.app_context():
+            product = Product.query.first()
+            order = Order(employee_id=Employee.query.first().employee_id, order_date=day, status=status,
+                          total_amount=product.price * quantity, payment_method='cash')
+            order.order_items.append(OrderItem(product_id=product.product_id, quantity=quantity,
+                                               unit_price=product.price, subtotal=product.price * quantity))
+            db.session.add(order)
+            db.session.commit()
+            return order.order_id
+
+    def _set_status(self, order_id, status):
+        with self.client:
+            self._login('sales_admin', 'Admin123!')
+            response = self.client.put(f'/api/order/{order_id}/status', json={'status': status})
+            self.client.get('/logout')
+        self.assertEqual(response.status_code, 200)
+
+    def _rollup(self):
+        """Итоги по дням и продуктам (суммы по всем shard)"""
+        with app.app_context():
+            days = [(d.isoformat(), orders, revenue) for d, orders, revenue in db.session.query(
+                DailySales.sale_date, db.func.sum(DailySales.total_orders), db.func.sum(DailySales.total_revenue)
+            ).group_by(DailySales.sale_date).order_by(DailySales.sale_date)]
+            products = [tuple(row) for row in db.session.query(
+                ProductDailySales.product_id, db.func.sum(ProductDailySales.times_ordered),
+                db.func.sum(ProductDailySales.quantity_sold), db.func.sum(ProductDailySales.revenue)
+            ).group_by(ProductDailySales.product_id).order_by(ProductDailySales.product_id)]
+            return days, products
+
+    def test_completed_transitions_update_rollup(self):
+        """completed -> +1, cancelled после completed -> -1"""
+        first, second = self._order(quantity=2), self._order(quantity=1)
+        self.assertEqual(self._rollup(), ([], []))
+
+        self._set_status(first, 'completed')
+        self._set_status(second, 'completed')
+        days, products = self._rollup()
+        self.assertEqual(days, [('2024-03-01', 2, Decimal('2400'))])
+        self.assertEqual(products[0][1:], (2, 3, Decimal('2400')))
+
+        self._set_status(second, 'cancelled')
+        self._set_status(first, 'completed')  # повтор того же статуса ничего не меняет
+        days, products = self._rollup()
+        self.assertEqual(days, [('2024-03-01', 1, Decimal('1600'))])
+        self.assertEqual(products[0][1:], (1, 2, Decimal('1600')))
+
+    def test_orm_update_and_delete(self):
+        """Изменение статуса и удаление заказа через ORM тоже учитываются"""
+        order_id = self._order()
+        with app.app_context():
+            order = db.session.get(Order, order_id)
+            order.status = 'completed'
+            db.session.commit()
+            order.status = 'ready'  # атрибут выгружен после commit
+            order.status = 'completed'
+            db.session.commit()
+            self.assertEqual(DailySales.query.one().total_orders, 1)
+            db.session.delete(db.session.get(Order, order_id))
+            db.session.commit()
+            self.assertEqual(DailySales.query.one().total_orders, 0)
+
+    def test_order_inserted_completed_is_counted(self):
+        """Заказ, сразу вставленный со статусом 'completed', попадает в итоги вместе с позициями"""
+        self._order(quantity=2, status='completed')
+        self._order(quantity=1, status='completed')
+        days, products = self._rollup()
+        self.assertEqual(days, [('2024-03-01', 2, Decimal('2400'))])
+        self.assertEqual(products[0][1:], (2, 3, Decimal('2400')))
+        with app.app_context():
+            self.assertEqual(DailySales.query.count(), 2)  # разные order_id -> разные shard
+
+    def test_analytics_reads_rollup_and_rebuild_matches(self):
+        """Страница аналитики показывает итоги; пересчёт с нуля совпадает"""
+        self._set_status(self._order(quantity=3), 'completed')
+        self._set_status(self._order(quantity=1, day=datetime(2024, 3, 2, 9, 0)), 'completed')
+        incremental = self._rollup()
+
+        with app.app_context():
+            application.rebuild_sales_rollup()
+        self.assertEqual(self._rollup(), incremental)
+
+        with self.client:
+            self._login('sales_admin', 'Admin123!')
+            response = self.client.get('/analytics')
+        html = response.get_data(as_text=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('3,200 ₸', html)
+        self.assertIn('Test Boba', html)
+        self.assertLessEqual(int(response.headers['X-Query-Count']), 4)
+
+
+# ============================================================
+# ТЕСТ 22: API ПРОДАЖ ПО ИНТЕРВАЛАМ (/api/analytics/sales)
+# ============================================================
+
+class TestSalesAnalyticsApi(BaseTestCase):
+    """
+    Тестирует /api/analytics/sales:
+    - группировка по часу/неделе и по продукту/способу оплаты в SQL
+    - ответ за закрытый период кэшируется, изменение продаж сбрасывает кэш
+    """
+
+    RANGE = 'from=2024-03-04&to=2024-03-11'
+
+    def setUp(self):
+        super().setUp()
+        application.sales_cache.clear()
+        self._create_admin(username='report_admin', password='Admin123!')
+        with app.app_context():
+            product = Product.query.first()
+            employee_id = Employee.query.first().employee_id
+            for day, method, quantity in ((datetime(2024, 3, 4, 12, 10), 'cash', 1),
+                                          (datetime(2024, 3, 4, 12, 50), 'card', 2),
+                                          (datetime(2024, 3, 6, 18, 5), 'card', 1),
+                                          (datetime(2024, 3, 12, 9, 0), 'card', 5)):
+                order = Order(employee_id=employee_id, order_date=day, status='completed',
+                              total_amount=product.price * quantity, payment_method=method)
+                order.order_items.append(OrderItem(product_id=product.product_id, quantity=quantity,
+                                                   unit_price=product.price, subtotal=product.price * quantity))
+                db.session.add(order)
+            db.session.commit()
+
+    def _get(self, query):
+        with self.client:
+            self._login('report_admin', 'Admin123!')
+            response = self.client.get(f'/api/analytics/sales?{query}')
+            self.client.get('/logout')
+        return response
+
+    def test_hourly_buckets(self):
+        """Два заказа в 12:xx попадают в один часовой интервал"""
+        data = self._get(f'{self.RANGE}&bucket=hour').get_json()
+        self.assertEqual([(i['bucket'], i['orders'], i['revenue']) for i in data['series']],
+                         [('2024-03-04T12:00:00', 2, 2400.0), ('2024-03-06T18:00:00', 1, 800.0)])
+        self.assertEqual(data['totals'], {'orders': 3, 'revenue': 3200.0})
+
+    def test_weekly_buckets_grouped(self):
+        """Неделя с понедельника; группировка по продукту и способу оплаты"""
+        by_product = self._get('from=2024-03-01&to=2024-03-15&bucket=week&group=product').get_json()
+        self.assertEqual([(i['bucket'], i['label'], i['quantity']) for i in by_product['series']],
+                         [('2024-03-04T00:00:00', 'Test Boba', 4), ('2024-03-11T00:00:00', 'Test Boba', 5)])
+
+        by_method = self._get(f'{self.RANGE}&group=payment_method').get_json()
+        self.assertEqual([(i['bucket'][:10], i['key'], i['orders']) for i in by_method['series']],
+                         [('2024-03-04', 'card', 1), ('2024-03-04', 'cash', 1), ('2024-03-06', 'card', 1)])
+
+    def test_closed_range_cached_until_sales_change(self):
+        """Повтор за прошлый период — из кэша; отмена заказа сбрасывает кэш"""
+        first = self._get(self.RANGE)
+        cached = self._get(self.RANGE)
+        self.assertEqual(first.get_json(), cached.get_json())
+        self.assertLess(int(cached.headers['X-Query-Count']), int(first.headers['X-Query-Count']))
+
+        with app.app_context():
+            Order.query.filter_by(payment_method='cash').one().status = 'cancelled'
+            db.session.commit()
+        self.assertEqual(self._get(self.RANGE).get_json()['totals']['orders'], 2)
+
+    def test_open_range_not_cached(self):
+        """Без to период заканчивается сейчас — такие ответы в кэш не попадают"""
+        for _ in range(3):
+            self.assertEqual(self._get('bucket=day').status_code, 200)
+        self.assertEqual(len(application.sales_cache), 0)
+
+    def test_invalid_parameters(self):
+        """Неверные bucket/group/диапазон — 400"""
+        for query in ('bucket=month', 'group=customer', 'from=yesterday',
+                      'from=2024-03-10&to=2024-03-01', 'from=2020-01-01&to=2024-01-01'):
+            self.assertEqual(self._get(query).status_code, 400, query)
+
+
+# ============================================================
+# ТЕСТ 23: ПОТОКОВАЯ ВЫГРУЗКА ЗАКАЗОВ (CSV / PARQUET)
+# ============================================================
+
+class TestOrderExport(BaseTestCase):
+    """
+    Тестирует /admin/export/orders:
+    - ответ отдаётся потоком, строки читаются чанками
+    - фильтр по датам и статусу, режим по позициям (items=1)
+    - Parquet: чанк = row group (если установлен pyarrow)
+    """
+
+    def setUp(self):
+        super().setUp()
+        self._create_admin(username='export_admin', password='Admin123!')
+        patcher = unittest.mock.patch.dict(app.config, {'EXPORT_CHUNK_SIZE': 2})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        with app.app_context():
+            product = Product.query.first()
+            employee_id = Employee.query.first().employee_id
+            for day in range(1, 6):
+                order = Order(employee_id=employee_id, order_date=datetime(2024, 5, day, 10, 0),
+                              status='completed' if day != 3 else 'cancelled',
+                              total_amount=product.price, payment_method='card', notes=f'day {day}, "quoted"')
+                order.order_items.append(OrderItem(product_id=product.product_id, quantity=1,
+                                                   unit_price=product.price, subtotal=product.price))
+                db.session.add(order)
+            db.session.commit()
+
+    def _export(self, query):
+        with self.client:
+            self._login('export_admin', 'Admin123!')
+            response = self.client.get(f'/admin/export/orders?{query}')
+            body = response.get_data()
+            self.client.get('/logout')
+        return response, body
+
+    def test_csv_streamed_in_chunks(self):
+        """CSV приходит потоком; кавычки в заметках экранированы"""
+        response, body = self._export('from=2024-05-01&to=2024-05-06')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('Content-Length', response.headers)  # потоковый ответ
+        self.assertIn('orders_20240501_20240506.csv', response.headers['Content-Disposition'])
+
+        rows = list(csv.DictReader(io.StringIO(body.decode('utf-8'))))
+        self.assertEqual([r['order_id'] for r in rows], sorted((r['order_id'] for r in rows), key=int))
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[0]['notes'], 'day 1, "quoted"')
+        self.assertEqual(rows[0]['employee_name'], 'Test Employee')
+
+    def test_filters_and_items(self):
+        """Диапазон [from, to), статус и строка на позицию"""
+        _, body = self._export('from=2024-05-02&to=2024-05-05&status=completed&items=1')
+        rows = list(csv.DictReader(io.StringIO(body.decode('utf-8'))))
+        self.assertEqual([r['order_date'][:10] for r in rows], ['2024-05-02', '2024-05-04'])
+        self.assertEqual({r['product_name'] for r in rows}, {'Test Boba'})
+
+        for query in ('format=xlsx', 'status=lost', 'from=someday', 'from=2024-05-05&to=2024-05-05'):
+            self.assertEqual(self._export(query)[0].status_code, 400, query)
+
+    def test_csv_formulas_escaped(self):
+        """Значения, начинающиеся с = + - @, таба или CR, выгружаются как текст"""
+        for notes in ('=HYPERLINK("http://example.com")', '\t=1+1', '\r=1+1'):
+            with app.app_context():
+                Order.query.order_by(Order.order_id).first().notes = notes
+                db.session.commit()
+            _, body = self._export('from=2024-05-01&to=2024-05-02')
+            row = next(csv.DictReader(io.StringIO(body.decode('utf-8'), newline='')))
+            self.assertEqual(row['notes'], "'" + notes)
+            self.assertEqual(row['total_amount'], '800.00')
+
+    @unittest.skipUnless(application.PYARROW_AVAILABLE, 'pyarrow не установлен')
+    def test_parquet_row_groups(self):
+        """Parquet читается целиком, каждый чанк курсора — row group"""
+        import pyarrow.parquet as pq
+        response, body = self._export('from=2024-05-01&to=2024-05-06&format=parquet')
+        self.assertEqual(response.status_code, 200)
+        parquet = pq.ParquetFile(io.BytesIO(body))
+        self.assertEqual(parquet.metadata.num_rows, 5)
+        self.assertEqual(parquet.metadata.num_row_groups, 3)
+        self.assertEqual(parquet.read().column('total_amount').to_pylist()[0], Decimal('800.00'))
+
+
+# ============================================================
+# ТЕСТ 24: СЧЁТЧИКИ ТАБЛИЦ ОДНИМ ЗАПРОСОМ С КЭШЕМ
+# ============================================================
+
+class TestTableCounters(BaseTestCase):
+    """
+    Тестирует table_counts():
+    - все счётчики читаются одним SELECT и кэшируются
+    - добавление/удаление строк через ORM сбрасывает кэш после COMMIT
+    - дашборд админки показывает счётчики из кэша
+    """
+
+    def setUp(self):
+        super().setUp()
+        application.counter_cache.clear()
+
+    def _count_statements(self, func):
+        statements = []
+        listener = lambda *args: statements.append(args[2])
+        with app.app_context():
+            event.listen(db.engine, 'before_cursor_execute', listener)
+            try:
+                result = func()
+            finally:
+                event.remove(db.engine, 'before_cursor_execute', listener)
+        return result, statements
+
+    def test_single_query_then_cached(self):
+        """Первый вызов — один SELECT, повторный — без запросов"""
+        counts, statements = self._count_statements(application.table_counts)
+        self.assertEqual(len(statements), 1)
+        self.assertEqual(counts, {'products': 1, 'users': 0, 'orders': 0, 'customers': 0})
+
+        _, statements = self._count_statements(application.table_counts)
+        self.assertEqual(statements, [])
+
+    def test_invalidated_after_commit(self):
+        """Новая строка видна после COMMIT, откат кэш не сбрасывает"""
+        with app.app_context():
+            self.assertEqual(application.table_counts()['customers'], 0)
+            db.session.add(Customer(first_name='Counter', last_name='Client', phone='+77010000024'))
+            db.session.flush()
+            db.session.rollback()
+            self.assertIsNotNone(application.counter_cache.get('counts'))
+
+            db.session.add(Customer(first_name='Counter', last_name='Client', phone='+77010000024'))
+            db.session.commit()
+            self.assertEqual(application.table_counts()['customers'], 1)
+
+            db.session.delete(Customer.query.first())
+            db.session.commit()
+            self.assertEqual(application.table_counts()['customers'], 0)
+
+    def test_batch_orders_invalidate_counts(self):
+        """Пакетные заказы (Core INSERT, без flush-событий) тоже сбрасывают счётчики"""
+        self._create_admin(username='counter_pos', password='Admin123!')
+        with app.app_context():
+            self.assertEqual(application.table_counts()['orders'], 0)
+            product_id = Product.query.first().product_id
+        with self.client:
+            self._login('counter_pos', 'Admin123!')
+            response = self.client.post('/api/orders/batch', json={'orders': [
+                {'items': [{'product_id': product_id, 'quantity': 1}], 'payment_method': 'card'}
+            ]})
+        self.assertEqual(response.get_json()['created'], 1)
+        with app.app_context():
+            self.assertEqual(application.table_counts()['orders'], 1)
+
+    def test_dashboard_uses_cached_counts(self):
+        """Повторное открытие дашборда делает на один запрос меньше"""
+        self._create_admin(username='counter_admin', password='Admin123!')
+        with self.client:
+            self._login('counter_admin', 'Admin123!')
+            first = self.client.get('/admin')
+            second = self.client.get('/admin')
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(int(second.headers['X-Query-Count']), int(first.headers['X-Query-Count']) - 1)
+
+
 # ============================================================
 # ЗАПУСК ТЕСТОВ
 # ============================================================
@@ -503,6 +2272,26 @@ if __name__ == '__main__':
         TestIngredientBusinessLogic,
         TestRoutes,
         TestAuthAndNotifications,
+        TestCartCheckout,
+        TestOutbox,
+        TestEmployeeScheduler,
+        TestIdempotentCheckout,
+        TestBatchOrders,
+        TestEventStream,
+        TestCustomerUpsert,
+        TestPageCache,
+        TestQueryBudget,
+        TestConditionalGet,
+        TestCatalogSnapshot,
+        TestImagePipeline,
+        TestStaticAssets,
+        TestSuggest,
+        TestSearchPagination,
+        TestUnifiedSearch,
+        TestSalesRollup,
+        TestSalesAnalyticsApi,
+        TestOrderExport,
+        TestTableCounters,
     ]:
         suite.addTests(loader.loadTestsFromTestCase(test_class))
 